@@ -27,6 +27,7 @@ MAVLINK_BAUD = int(os.getenv('MAVLINK_BAUD', '57600'))
 # 数据处理与安全配置
 DATA_UPLOAD_INTERVAL = int(os.getenv('DATA_UPLOAD_INTERVAL', '1'))  # 秒
 MAX_RETRY_ATTEMPTS = int(os.getenv('MAX_RETRY_ATTEMPTS', '3'))
+UPLOAD_BATCH_SIZE = int(os.getenv('UPLOAD_BATCH_SIZE', '100'))  # 与服务器 API_CONFIG['max_batch_size'] 保持一致
 
 # 加密开关（PLAINTEXT/AES-GCM/可插拔名称，仅作为标识；实际算法由security/crypto_algo.py决定）
 ENCRYPTION_ENABLED = os.getenv('ENCRYPTION_ENABLED', 'true').lower() == 'true'
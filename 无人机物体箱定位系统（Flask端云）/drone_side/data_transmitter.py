@@ -36,6 +36,8 @@ class DataTransmitter:
         self.drone_id = drone_id or config.DRONE_ID
         self.upload_interval = config.DATA_UPLOAD_INTERVAL
         self.max_retry_attempts = config.MAX_RETRY_ATTEMPTS
+        self.batch_size = getattr(config, 'UPLOAD_BATCH_SIZE', 100)
+        self.batch_supported = True  # 服务器不支持批量接口时自动回退为逐条上传
         self.last_upload_time = 0
         
     def create_data_package(self, barcodes: List[dict], gps_position: tuple) -> Dict:
@@ -97,6 +99,25 @@ class DataTransmitter:
         if current_time - self.last_upload_time < self.upload_interval:
             return True
         
+        if len(data_packages) > 1 and self.batch_supported:
+            for start in range(0, len(data_packages), self.batch_size):
+                chunk = data_packages[start:start + self.batch_size]
+                success = self._upload_batch(chunk)
+                if success is None:
+                    # 旧版服务器没有批量接口，剩余数据逐条上传
+                    self.batch_supported = False
+                    return self._upload_each(data_packages[start:], current_time)
+                if not success:
+                    logger.error(f"批量数据上传失败: {len(chunk)} 个数据包")
+                    return False
+        else:
+            return self._upload_each(data_packages, current_time)
+
+        self.last_upload_time = current_time
+        logger.info(f"成功上传 {len(data_packages)} 个数据包")
+        return True
+
+    def _upload_each(self, data_packages: List[Dict], current_time: float) -> bool:
         for package in data_packages:
             success = self._upload_single_package(package)
             if not success:
@@ -107,6 +128,50 @@ class DataTransmitter:
         logger.info(f"成功上传 {len(data_packages)} 个数据包")
         return True
     
+    def _upload_batch(self, packages: List[Dict]) -> Optional[bool]:
+        """
+        一次请求上传一批数据包（整批加密为一个信封）
+        
+        Args:
+            packages: 数据包列表
+            
+        Returns:
+            上传是否成功；服务器不支持批量接口时返回 None
+        """
+        url = f"{self.server_url}/api/upload/batch"
+        
+        for attempt in range(self.max_retry_attempts):
+            try:
+                payload = encrypt_payload(packages) if config.ENCRYPTION_ENABLED else packages
+                response = requests.post(
+                    url,
+                    json=payload,
+                    timeout=10,
+                    headers={'Content-Type': 'application/json'}
+                )
+                
+                if response.status_code in (404, 405):
+                    return None
+                result = response.json()
+                if result.get('status') == 'success':
+                    logger.debug(f"批量数据上传成功: {len(packages)} 个数据包")
+                    return True
+                # 部分失败不重试整批，避免已写入的数据重复
+                failed = [r for r in result.get('results', []) if r.get('status') != 'success']
+                for r in failed:
+                    logger.warning(f"数据包 {r.get('index')} 被拒绝: {r.get('message')}")
+                if result.get('status') == 'partial':
+                    return False
+                logger.warning(f"服务器返回错误: {result.get('message') or response.status_code}")
+                
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning(f"批量上传请求失败 (尝试 {attempt + 1}/{self.max_retry_attempts}): {e}")
+                
+            if attempt < self.max_retry_attempts - 1:
+                time.sleep(1)  # 重试前等待1秒
+        
+        return False
+    
     def _upload_single_package(self, package: Dict) -> bool:
         """
         上传单个数据包
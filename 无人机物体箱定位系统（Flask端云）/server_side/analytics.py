@@ -0,0 +1,434 @@
+"""
+条码分析模块 - 近似去重计数与高频条码（内存概要结构，定期检查点到 SQLite）
+
+- HyperLogLog：按天、按无人机估计不同条码数，多天的概要可合并后估计区间内去重数
+- Space-Saving：在固定容量内跟踪出现次数最多的条码（反复扫描的物体箱）
+数据在写入路径上逐条喂入（与位置写入同一写连接持有期内），概要定期写入 analytics_sketches 表，
+同时记下已计入的最大位置 id；重启后从检查点恢复，并补计 id 更大的记录。
+"""
+from __future__ import annotations
+
+import hashlib
+import heapq
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SKETCH_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS analytics_sketches (
+        name TEXT PRIMARY KEY,
+        data BLOB NOT NULL,
+        updated_at TEXT
+    )
+"""
+WATERMARK = "watermark"
+
+# (日期, 无人机, 条码)
+Detection = Tuple[str, str, str]
+
+
+def _hash64(value: str) -> int:
+    """进程无关的 64 位哈希（内置 hash 每次启动随机化，不能持久化）"""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def detection_day(ts_ms: Optional[int], timestamp: Optional[str]) -> str:
+    """检测所属日期：与统计表一致，按服务器本地时区换算毫秒时间，缺失时取字符串前 10 位"""
+    if ts_ms is not None:
+        return date.fromtimestamp(ts_ms / 1000).isoformat()
+    return str(timestamp or "")[:10]
+
+
+class HyperLogLog:
+    """HyperLogLog 基数估计：2^precision 个寄存器，相对标准误差约 1.04 / sqrt(2^precision)"""
+
+    def __init__(self, precision: int = 12, registers: Optional[bytes] = None) -> None:
+        if not 4 <= precision <= 16:
+            raise ValueError("precision 需在 4~16 之间")
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers) if registers is not None else bytearray(self.m)
+        if len(self.registers) != self.m:
+            raise ValueError("寄存器数量与 precision 不一致")
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(self.m)
+
+    def add_hash(self, h: int) -> bool:
+        """按 64 位哈希更新，寄存器变化时返回 True"""
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def add(self, value: str) -> bool:
+        return self.add_hash(_hash64(value))
+
+    def merge(self, other: "HyperLogLog") -> None:
+        if other.precision != self.precision:
+            raise ValueError("precision 不同的 HyperLogLog 不能合并")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m) if m >= 128 else {16: 0.673, 32: 0.697, 64: 0.709}[m]
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # 小基数时用线性计数修正
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
+
+
+class SpaceSaving:
+    """Space-Saving 高频项：最多跟踪 capacity 个条码。
+
+    每个条码的计数 count 是真实次数的上界，count - error 是下界；error 不超过 total / capacity。
+    真实次数超过 total / capacity 的条码一定在跟踪列表中。
+    """
+
+    def __init__(self, capacity: int = 1000) -> None:
+        self.capacity = max(1, int(capacity))
+        self.total = 0
+        self.counts: Dict[str, List[int]] = {}  # 条码 -> [count, error]
+        self._heap: List[Tuple[int, str]] = []  # 惰性最小堆，过期条目在弹出时跳过
+
+    def add(self, item: str, n: int = 1) -> None:
+        self.total += n
+        entry = self.counts.get(item)
+        if entry is None:
+            if len(self.counts) < self.capacity:
+                entry = self.counts[item] = [0, 0]
+            else:
+                # 替换当前计数最小的条码，继承其计数作为误差
+                while True:
+                    low, victim = heapq.heappop(self._heap)
+                    if self.counts.get(victim, (None,))[0] == low:
+                        break
+                del self.counts[victim]
+                entry = self.counts[item] = [low, low]
+        entry[0] += n
+        heapq.heappush(self._heap, (entry[0], item))
+        if len(self._heap) > 4 * self.capacity:
+            self._heap = [(c, k) for k, (c, _) in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    @property
+    def max_error(self) -> int:
+        return self.total // self.capacity
+
+    def top(self, k: int) -> List[Dict]:
+        items = sorted(self.counts.items(), key=lambda kv: (-kv[1][0], kv[0]))[:max(1, int(k))]
+        return [{"barcode": key, "count": c, "error": e, "min_count": c - e} for key, (c, e) in items]
+
+    def to_bytes(self) -> bytes:
+        data = {"capacity": self.capacity, "total": self.total, "items": [[k, c, e] for k, (c, e) in self.counts.items()]}
+        return json.dumps(data, separators=(",", ":")).encode("utf-8")
+
+    @classmethod
+    def from_bytes(cls, raw: bytes, capacity: int) -> "SpaceSaving":
+        data = json.loads(raw.decode("utf-8"))
+        sketch = cls(capacity)
+        sketch.total = int(data.get("total", 0))
+        items = sorted(data.get("items", []), key=lambda x: -x[1])[:sketch.capacity]
+        sketch.counts = {k: [c, e] for k, c, e in items}
+        sketch._heap = [(c, k) for k, c, _ in items]
+        heapq.heapify(sketch._heap)
+        return sketch
+
+
+class BarcodeAnalytics:
+    """条码分析概要的维护、查询与检查点
+
+    add_many 由写入路径在持有写连接时调用，因此检查点（同样在写连接上执行）记录的最大 id
+    之前的记录一定都已计入。启动或重建时从检查点之后（或从头）补计已有记录：补计范围在
+    attach 时于写连接上确定，之后的新写入只由写入路径计入，两者不会重复。补计完成前不写检查点。
+    删除与更新不会回退概要，需要时通过 rebuild 重新统计。
+    """
+
+    def __init__(
+        self,
+        pool,
+        max_id: Callable[[sqlite3.Connection], int],
+        precision: int = 12,
+        topk_capacity: int = 1000,
+        retention_days: int = 90,
+        checkpoint_interval: float = 60,
+        replay_chunk_size: int = 5000,
+    ) -> None:
+        self.pool = pool
+        self.max_id = max_id
+        self.precision = int(precision)
+        self.topk_capacity = max(1, int(topk_capacity))
+        self.retention_days = max(0, int(retention_days))
+        self.checkpoint_interval = max(1.0, float(checkpoint_interval))
+        self.replay_chunk_size = max(1, int(replay_chunk_size))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._reset()
+        self._generation = 0
+        self._replay: Optional[List[int]] = None  # [已补计到的 id, 补计终点 id]
+        self._stats = {"fed": 0, "replayed": 0, "checkpoints": 0, "last_checkpoint_ms": 0.0, "last_checkpoint_at": None}
+
+    def _reset(self) -> None:
+        self.days: Dict[str, HyperLogLog] = {}
+        self.drones: Dict[str, HyperLogLog] = {}
+        self.top = SpaceSaving(self.topk_capacity)
+        self._dirty: set = set()
+
+    # ----- 生命周期 -----
+    def attach(self, conn: sqlite3.Connection) -> None:
+        """在写连接上建表、从检查点恢复，并确定需要补计的 id 范围"""
+        conn.execute(SKETCH_TABLE_SQL)
+        conn.commit()
+        watermark = 0
+        with self._lock:
+            self._generation += 1
+            self._reset()
+            for name, data in conn.execute("SELECT name, data FROM analytics_sketches"):
+                try:
+                    if name == WATERMARK:
+                        watermark = int(data)
+                    elif name == "top:barcodes":
+                        self.top = SpaceSaving.from_bytes(data, self.topk_capacity)
+                    else:
+                        kind, _, key = name.partition(":")
+                        target = {"day": self.days, "drone": self.drones}.get(kind)
+                        if target is not None:
+                            target[key] = HyperLogLog(self.precision, data)
+                except (ValueError, TypeError) as e:
+                    # precision 或容量调整后旧概要无法使用，整体从头统计
+                    logger.warning(f"条码分析检查点不可用，将重新统计: {e}")
+                    self._reset()
+                    watermark = 0
+                    break
+            end = self.max_id(conn)
+            self._replay = [watermark, end] if end > watermark else None
+
+    def start(self) -> bool:
+        if self.is_running():
+            return True
+        self.pool.write(self.attach)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="barcode-analytics", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.checkpoint()
+        except sqlite3.Error as e:
+            logger.error(f"条码分析检查点写入失败: {e}")
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    @property
+    def ready(self) -> bool:
+        return self._replay is None
+
+    def _run(self) -> None:
+        try:
+            self.replay()
+        except sqlite3.Error as e:
+            logger.error(f"条码分析补计失败: {e}")
+        while not self._stop.wait(self.checkpoint_interval):
+            try:
+                self.checkpoint()
+            except sqlite3.Error as e:
+                logger.error(f"条码分析检查点写入失败: {e}")
+
+    def rebuild(self) -> None:
+        """清空概要并从现有位置数据重新统计（补计由后台线程或 replay 完成）"""
+        def run(conn: sqlite3.Connection) -> None:
+            conn.execute(SKETCH_TABLE_SQL)
+            with conn:
+                conn.execute("DELETE FROM analytics_sketches")
+            self.attach(conn)
+
+        self.pool.write(run)
+        if self._thread is not None and self._thread.is_alive():
+            threading.Thread(target=self.replay, name="barcode-analytics-rebuild", daemon=True).start()
+
+    def replay(self) -> None:
+        """分块补计 attach 时确定的 id 范围，块之间归还读连接"""
+        started = time.monotonic()
+        while not self._stop.is_set():
+            with self._lock:
+                if self._replay is None:
+                    return
+                generation, (last, end) = self._generation, self._replay
+            rows = self.pool.read(lambda conn: conn.execute(
+                "SELECT id, drone_id, barcode_data, ts_ms, timestamp FROM box_positions "
+                "WHERE id > ? AND id <= ? ORDER BY id LIMIT ?",
+                (last, end, self.replay_chunk_size),
+            ).fetchall())
+            with self._lock:
+                # 读取期间发生了重建，这一块作废
+                if generation != self._generation:
+                    continue
+                self._apply(((detection_day(r[3], r[4]), r[1], r[2]) for r in rows), "replayed")
+                if len(rows) < self.replay_chunk_size:
+                    self._replay = None
+                    logger.info(f"条码分析补计完成，用时 {time.monotonic() - started:.1f}s")
+                else:
+                    self._replay = [rows[-1][0], end]
+
+    # ----- 写入 -----
+    def add_many(self, detections: Iterable[Detection]) -> None:
+        """写入路径调用：计入已提交的检测；attach 之前（未启用分析）直接忽略"""
+        if not self._generation:
+            return
+        with self._lock:
+            self._apply(detections, "fed")
+
+    def _apply(self, detections: Iterable[Detection], counter: str) -> None:
+        """更新概要（调用方持有 _lock）"""
+        n = 0
+        for day, drone_id, barcode in detections:
+            h = _hash64(barcode)
+            day_hll = self.days.get(day)
+            if day_hll is None:
+                day_hll = self.days[day] = HyperLogLog(self.precision)
+            if day_hll.add_hash(h):
+                self._dirty.add(f"day:{day}")
+            drone_hll = self.drones.get(drone_id)
+            if drone_hll is None:
+                drone_hll = self.drones[drone_id] = HyperLogLog(self.precision)
+            if drone_hll.add_hash(h):
+                self._dirty.add(f"drone:{drone_id}")
+            self.top.add(barcode)
+            n += 1
+        if n:
+            self._dirty.add("top:barcodes")
+        self._stats[counter] += n
+
+    def checkpoint(self) -> bool:
+        """把变化过的概要和已计入的最大 id 写入 SQLite；补计未完成时跳过"""
+        started = time.monotonic()
+
+        def run(conn: sqlite3.Connection) -> bool:
+            now = datetime.now().isoformat()
+            with self._lock:
+                if self._replay is not None or not self._generation:
+                    return False
+                expired = self._expired_days()
+                for day in expired:
+                    del self.days[day]
+                rows = []
+                dirty, self._dirty = self._dirty, set()
+                for name in dirty:
+                    kind, _, key = name.partition(":")
+                    if kind == "day" and key in self.days:
+                        rows.append((name, self.days[key].to_bytes(), now))
+                    elif kind == "drone":
+                        rows.append((name, self.drones[key].to_bytes(), now))
+                    elif kind == "top":
+                        rows.append((name, self.top.to_bytes(), now))
+                # 写入路径在写连接上计入，此刻已提交的记录都已反映在概要里
+                rows.append((WATERMARK, str(self.max_id(conn)), now))
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO analytics_sketches (name, data, updated_at) VALUES (?, ?, ?)", rows
+                    )
+                    conn.executemany("DELETE FROM analytics_sketches WHERE name = ?", [(f"day:{d}",) for d in expired])
+            except sqlite3.Error:
+                # 未写入的概要留到下次检查点
+                with self._lock:
+                    self._dirty |= dirty
+                raise
+            return True
+
+        if not self.pool.write(run):
+            return False
+        self._stats["checkpoints"] += 1
+        self._stats["last_checkpoint_ms"] = round((time.monotonic() - started) * 1000, 3)
+        self._stats["last_checkpoint_at"] = datetime.now().isoformat()
+        return True
+
+    def _expired_days(self) -> List[str]:
+        if not self.retention_days:
+            return []
+        cutoff = (date.today() - timedelta(days=self.retention_days)).isoformat()
+        return [d for d in self.days if d < cutoff]
+
+    # ----- 查询 -----
+    def _error_bound(self) -> Dict:
+        rse = 1.04 / math.sqrt(1 << self.precision)
+        return {"relative_std_error": round(rse, 5), "relative_error_95": round(2 * rse, 5)}
+
+    def distinct_barcodes(self, start: Optional[str] = None, end: Optional[str] = None) -> Dict:
+        """[start, end] 日期区间（含两端，YYYY-MM-DD）内的不同条码数估计及逐日估计"""
+        for value in (start, end):
+            if value is not None:
+                try:
+                    date.fromisoformat(value)
+                except ValueError:
+                    raise ValueError(f"无效的日期: {value}")
+        # 只在锁内复制寄存器，估计与合并在锁外进行，不阻塞写入路径
+        with self._lock:
+            days = [
+                (d, HyperLogLog(self.precision, hll.registers)) for d, hll in sorted(self.days.items())
+                if (start is None or d >= start) and (end is None or d <= end)
+            ]
+        merged = HyperLogLog(self.precision)
+        per_day = []
+        for d, hll in days:
+            merged.merge(hll)
+            per_day.append({"day": d, "distinct_barcodes": hll.count()})
+        return dict(
+            self._error_bound(),
+            start=start, end=end, distinct_barcodes=merged.count() if days else 0,
+            days=per_day, complete=self.ready,
+        )
+
+    def distinct_by_drone(self, drone_id: Optional[str] = None) -> Dict:
+        with self._lock:
+            copies = [
+                (k, HyperLogLog(self.precision, hll.registers))
+                for k, hll in sorted(self.drones.items()) if drone_id is None or k == drone_id
+            ]
+        drones = [{"drone_id": k, "distinct_barcodes": hll.count()} for k, hll in copies]
+        return dict(self._error_bound(), drones=drones, complete=self.ready)
+
+    def top_barcodes(self, k: int = 20) -> Dict:
+        with self._lock:
+            items = self.top.top(k)
+            total, max_error = self.top.total, self.top.max_error
+        return {
+            "items": items,
+            "total": total,
+            "capacity": self.topk_capacity,
+            # 每个 count 最多高估 max_error；真实次数超过 max_error 的条码都在跟踪范围内
+            "max_error": max_error,
+            "complete": self.ready,
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = dict(self._stats, days=len(self.days), drones=len(self.drones), tracked=len(self.top.counts))
+        stats.update(
+            running=self.is_running(), ready=self.ready,
+            replay=list(self._replay) if self._replay is not None else None,
+        )
+        return stats
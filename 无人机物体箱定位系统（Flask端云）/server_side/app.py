@@ -3,14 +3,24 @@ Flask Web应用主程序
 提供REST API和WebSocket服务
 """
 import os
+import csv
+import hashlib
+import io
 import json
 import logging
+import math
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from functools import wraps
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 from flask_cors import CORS
 import socketio
 import eventlet
-from database import DatabaseManager
+from eventlet import tpool
+from broadcaster import DetectionBroadcaster
+from database import POSITION_COLUMNS, DatabaseManager
 try:
     from security.crypto_adapter import maybe_decrypt_request
 except Exception:
@@ -46,11 +56,25 @@ db_manager = DatabaseManager()
 # 存储连接的客户端
 connected_clients = set()
 
+# 检测推送：上传请求只入队，后台按节拍批量发送
+broadcaster = DetectionBroadcaster(
+    sio,
+    interval=config.WEBSOCKET_CONFIG.get('broadcast_interval', 0.1),
+    max_pending=config.WEBSOCKET_CONFIG.get('broadcast_max_pending', 5000),
+    max_batch=config.WEBSOCKET_CONFIG.get('broadcast_max_batch', 500),
+    area_cell=config.WEBSOCKET_CONFIG.get('area_cell_deg', 0.01),
+    max_area_cells=config.WEBSOCKET_CONFIG.get('max_area_cells', 400),
+    slow_client_queue=config.WEBSOCKET_CONFIG.get('slow_client_queue', 64)
+)
+
 @sio.event
 def connect(sid, environ):
     """WebSocket连接事件"""
     connected_clients.add(sid)
     logging.info(f"客户端连接: {sid}")
+    # 默认订阅全部检测，可通过 subscribe 改为按无人机 / 区域订阅
+    sio.enter_room(sid, 'all')
+    broadcaster.start()
     
     # 发送欢迎消息
     sio.emit('message', {
@@ -63,13 +87,146 @@ def connect(sid, environ):
 def disconnect(sid):
     """WebSocket断开连接事件"""
     connected_clients.discard(sid)
+    broadcaster.forget(sid)
     logging.info(f"客户端断开连接: {sid}")
 
+@sio.event
+def subscribe(sid, data):
+    """订阅检测推送：{'all': bool, 'drones': [...], 'areas': [[min_lat, min_lon, max_lat, max_lon], ...]}"""
+    try:
+        rooms = broadcaster.subscribe(sid, data)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+    return {'status': 'success', 'data': rooms}
+
+@sio.event
+def unsubscribe(sid, data):
+    """取消订阅，参数格式同 subscribe"""
+    try:
+        rooms = broadcaster.unsubscribe(sid, data)
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+    return {'status': 'success', 'data': rooms}
+
+@sio.event
+def backfill(sid, data):
+    """断线重连补发：返回 since 之后的检测数据（最近的数据由内存热层给出）"""
+    since = (data or {}).get('since') if isinstance(data, dict) else None
+    if not since:
+        return {'status': 'error', 'message': '缺少 since'}
+    max_rows = config.API_CONFIG.get('backfill_max_rows', 1000)
+    rows = []
+    try:
+        for chunk in db_manager.iter_positions(start=since, chunk_size=max_rows):
+            rows.extend(dict(zip(POSITION_COLUMNS, row)) for row in chunk)
+            if len(rows) >= max_rows:
+                break
+    except ValueError as e:
+        return {'status': 'error', 'message': str(e)}
+    except Exception as e:
+        logging.error(f"补发检测数据失败: {e}")
+        return {'status': 'error', 'message': '获取数据失败'}
+    return {'status': 'success', 'data': rows[:max_rows], 'truncated': len(rows) >= max_rows}
+
 def broadcast_data(data):
-    """广播数据到所有连接的客户端"""
+    """检测数据放入推送队列，由后台按节拍发送给订阅的客户端"""
     if connected_clients:
-        sio.emit('new_detection', data, room=None)
-        logging.debug(f"广播数据到 {len(connected_clients)} 个客户端")
+        broadcaster.publish(data)
+
+def broadcast_batch(items):
+    """批量上传的检测数据整批入队"""
+    if connected_clients and items:
+        broadcaster.publish_many(items)
+
+def _wait_future(future):
+    """在 eventlet 下等待写入结果：阻塞等待放到线程池，其他请求可继续入队"""
+    if future.done():
+        return future.result()
+    timeout = (getattr(config, 'DB_CONFIG', {}) or {}).get('group_commit_wait_timeout', 10)
+    return tpool.execute(future.result, timeout)
+
+class ResponseCache:
+    """大屏轮询接口的响应缓存
+
+    以 (路径, 查询参数) 为键，条目记录生成时各依赖数据的版本号；写入使版本号递增后
+    条目自然失效。max_age 兜底与时间相关的结果（如在线无人机数）。命中时按 ETag
+    处理 If-None-Match，内容未变返回 304。条目数有上限，按最近使用淘汰。
+    """
+
+    def __init__(self, max_entries=512, max_age=5.0):
+        self.max_entries = max(1, int(max_entries))
+        self.max_age = float(max_age)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'evictions': 0}
+
+    def lookup(self, key, versions):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['versions'] == versions \
+                    and time.monotonic() - entry['created'] < self.max_age:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry
+            self._stats['misses'] += 1
+            return None
+
+    def store(self, key, versions, body, mimetype):
+        entry = {
+            'versions': versions,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'body': body,
+            'mimetype': mimetype,
+            'created': time.monotonic(),
+        }
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return entry
+
+    def count_not_modified(self):
+        with self._lock:
+            self._stats['not_modified'] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+response_cache = ResponseCache(
+    max_entries=config.API_CONFIG.get('response_cache_size', 512),
+    max_age=config.API_CONFIG.get('response_cache_max_age', 5)
+)
+
+def cached_response(*deps):
+    """缓存 GET 接口的成功响应；deps 为依赖的数据类别（positions / drones）"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not config.API_CONFIG.get('response_cache', True):
+                return view(*args, **kwargs)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))))
+            # 先取版本号再生成：生成期间发生写入时，条目带旧版本号，下次请求即失效
+            versions = db_manager.versions.get(*deps)
+            entry = response_cache.lookup(key, versions)
+            if entry is None:
+                resp = app.make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                entry = response_cache.store(key, versions, resp.get_data(), resp.mimetype)
+            if request.if_none_match.contains(entry['etag']):
+                response_cache.count_not_modified()
+                resp = Response(status=304)
+            else:
+                resp = Response(entry['body'], mimetype=entry['mimetype'])
+            resp.set_etag(entry['etag'])
+            # 浏览器每次都带 If-None-Match 重新验证
+            resp.headers['Cache-Control'] = 'no-cache'
+            return resp
+        return wrapper
+    return decorator
 
 # Flask路由
 def _get_mapbox_token():
@@ -90,9 +247,32 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
-        'connected_clients': len(connected_clients)
+        'connected_clients': len(connected_clients),
+        'broadcaster': broadcaster.stats(),
+        'ingest_writer': db_manager.get_ingest_writer_stats(),
+        'drone_registry': db_manager.get_drone_registry_stats(),
+        'connection_pool': db_manager.get_pool_stats(),
+        'system_logs': db_manager.get_system_log_stats(),
+        'epoch_migration': db_manager.get_epoch_migration_status(),
+        'maintenance': db_manager.get_maintenance_stats(),
+        'hot_tier': db_manager.get_hot_tier_stats(),
+        'analytics': db_manager.get_analytics_stats(),
+        'snapshots': db_manager.get_snapshot_stats(),
+        'shards': db_manager.get_shard_stats(),
+        'response_cache': response_cache.stats()
     })
 
+REQUIRED_UPLOAD_FIELDS = ['timestamp', 'drone_id', 'barcode_data', 'confidence']
+
+def _validate_package(data):
+    """校验单个数据包，返回错误信息；合法时返回 None"""
+    if not isinstance(data, dict) or not data:
+        return '无效的数据'
+    for field in REQUIRED_UPLOAD_FIELDS:
+        if field not in data:
+            return f'缺少必要字段: {field}'
+    return None
+
 @app.route('/api/upload', methods=['POST'])
 def upload_data():
     """接收无人机上传的数据"""
@@ -104,13 +284,17 @@ def upload_data():
             return jsonify({'status': 'error', 'message': '无效的数据'}), 400
         
         # 验证必要字段
-        required_fields = ['timestamp', 'drone_id', 'barcode_data', 'confidence']
-        for field in required_fields:
-            if field not in data:
-                return jsonify({'status': 'error', 'message': f'缺少必要字段: {field}'}), 400
+        error = _validate_package(data)
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
         
-        # 存储到数据库
-        if db_manager.insert_box_position(data):
+        # 存储到数据库（启用组提交时与并发请求合并为一个事务）
+        try:
+            stored = _wait_future(db_manager.submit_box_position(data))
+        except Exception as e:
+            logging.error(f"数据写入失败: {e}")
+            stored = False
+        if stored:
             # 广播数据到WebSocket客户端
             broadcast_data(data)
             
@@ -126,6 +310,78 @@ def upload_data():
         logging.error(f"数据上传处理失败: {e}")
         return jsonify({'status': 'error', 'message': '服务器内部错误'}), 500
 
+def _unpack_batch(body):
+    """解析批量上传请求体：数据包数组、{"packages": [...]}，或包裹数组的加密信封"""
+    if isinstance(body, dict):
+        body = maybe_decrypt_request(body)
+        if isinstance(body, dict):
+            body = body.get('packages')
+    return body if isinstance(body, list) else None
+
+@app.route('/api/upload/batch', methods=['POST'])
+def upload_batch():
+    """批量接收无人机上传的数据：一次校验、一个事务写入、一次广播"""
+    try:
+        packages = _unpack_batch(request.get_json(silent=True))
+        if packages is None:
+            return jsonify({'status': 'error', 'message': '需要数据包数组'}), 400
+        if not packages:
+            return jsonify({'status': 'error', 'message': '数据包数组为空'}), 400
+
+        max_batch = config.API_CONFIG.get('max_batch_size', 100)
+        if len(packages) > max_batch:
+            return jsonify({'status': 'error', 'message': f'单批最多 {max_batch} 个数据包'}), 413
+
+        # 单趟完成解密与校验，只有合法数据包进入数据库
+        errors = [None] * len(packages)
+        valid = []
+        for i, pkg in enumerate(packages):
+            try:
+                pkg = maybe_decrypt_request(pkg) if isinstance(pkg, dict) else pkg
+            except Exception as e:
+                errors[i] = f'解密失败: {e}'
+                continue
+            errors[i] = _validate_package(pkg)
+            if errors[i] is None:
+                packages[i] = pkg
+                valid.append(i)
+
+        stored = []
+        storage_failed = False
+        if valid:
+            # 批量写入会等待事务提交，放到线程池执行以免阻塞其他请求
+            db_errors = tpool.execute(db_manager.insert_box_positions, [packages[i] for i in valid])
+            for i, err in zip(valid, db_errors):
+                if err:
+                    errors[i] = f'数据存储失败: {err}'
+                    storage_failed = True
+                else:
+                    stored.append(packages[i])
+
+        broadcast_batch(stored)
+
+        results = [
+            {'index': i, 'status': 'success'} if err is None else {'index': i, 'status': 'error', 'message': err}
+            for i, err in enumerate(errors)
+        ]
+        if len(stored) == len(packages):
+            status, code = 'success', 200
+        elif stored:
+            status, code = 'partial', 200
+        else:
+            status, code = 'error', (500 if storage_failed else 400)
+        return jsonify({
+            'status': status,
+            'accepted': len(stored),
+            'rejected': len(packages) - len(stored),
+            'results': results,
+            'timestamp': datetime.now().isoformat()
+        }), code
+
+    except Exception as e:
+        logging.error(f"批量数据上传处理失败: {e}")
+        return jsonify({'status': 'error', 'message': '服务器内部错误'}), 500
+
 @app.route('/api/heartbeat', methods=['POST'])
 def heartbeat():
     """接收无人机心跳"""
@@ -158,18 +414,29 @@ def heartbeat():
         return jsonify({'status': 'error', 'message': '服务器内部错误'}), 500
 
 @app.route('/api/positions')
+@cached_response('positions')
 def get_positions():
     """获取位置数据"""
     try:
         limit = request.args.get('limit', 100, type=int)
         drone_id = request.args.get('drone_id')
+        before = request.args.get('before')
+        after = request.args.get('after')
+        if before and after:
+            return jsonify({'status': 'error', 'message': 'before 与 after 不能同时使用'}), 400
         
-        positions = db_manager.get_recent_positions(limit, drone_id)
+        try:
+            page = db_manager.get_positions_page(limit, drone_id, before=before, after=after)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        positions = page['data']
         
         return jsonify({
             'status': 'success',
             'data': positions,
             'count': len(positions),
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
             'timestamp': datetime.now().isoformat()
         })
         
@@ -177,7 +444,273 @@ def get_positions():
         logging.error(f"获取位置数据失败: {e}")
         return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
 
+def _export_rows(chunks, fmt):
+    """把分块的位置记录编码为 NDJSON 或 CSV 文本块"""
+    try:
+        yield from _encode_rows(chunks, fmt)
+    except Exception as e:
+        # 响应头已发出，只能记录日志并提前结束输出
+        logging.error(f"导出位置数据中断: {e}")
+
+def _encode_rows(chunks, fmt):
+    if fmt == 'csv':
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        writer.writerow(POSITION_COLUMNS)
+        yield buf.getvalue()
+        for rows in chunks:
+            buf.seek(0)
+            buf.truncate()
+            writer.writerows(rows)
+            yield buf.getvalue()
+    else:
+        for rows in chunks:
+            yield ''.join(
+                json.dumps(dict(zip(POSITION_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows
+            )
+
+@app.route('/api/positions/export')
+def export_positions():
+    """流式导出位置数据（NDJSON 或 CSV），内存占用与结果规模无关"""
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'status': 'error', 'message': 'format 仅支持 ndjson 或 csv'}), 400
+    chunk_size = min(max(request.args.get('chunk_size', 1000, type=int), 1), 10000)
+
+    try:
+        chunks = db_manager.iter_positions(
+            start=request.args.get('from'),
+            end=request.args.get('to'),
+            drone_id=request.args.get('drone_id'),
+            barcode=request.args.get('barcode'),
+            chunk_size=chunk_size,
+            source=request.args.get('source', 'primary')
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"positions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    return Response(
+        stream_with_context(_export_rows(chunks, fmt)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/positions/query', methods=['POST'])
+def query_positions():
+    """按过滤条件查询位置数据
+
+    请求体: {"filter": {"confidence": {"gte": 0.8}, "barcode_type": {"in": ["QR"]},
+             "barcode_data": {"prefix": "BOX-"}, "time": {"gte": "2024-01-01T00:00:00"}},
+             "order": "desc", "limit": 100, "cursor": "...", "explain": false, "source": "primary"}
+    可能全表扫描的查询按扫描上限分段返回（scan_limited 为 true 时页可能不足 limit 条）。
+    source 为 replica 时在最新快照上查询，适合不要求实时数据的大报表。
+    """
+    try:
+        body = request.json or {}
+        if not isinstance(body, dict):
+            return jsonify({'status': 'error', 'message': '无效的数据'}), 400
+        max_limit = config.API_CONFIG.get('query_max_limit', 1000)
+        try:
+            result = db_manager.query_positions(
+                filters=body.get('filter'),
+                order=body.get('order', 'desc'),
+                limit=min(max(int(body.get('limit', 100)), 1), max_limit),
+                cursor=body.get('cursor'),
+                scan_budget=config.API_CONFIG.get('query_scan_budget', 20000),
+                explain=bool(body.get('explain')),
+                source=body.get('source', 'primary')
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if result is None:
+            return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+        return jsonify(dict(
+            result,
+            status='success',
+            count=len(result['data']),
+            timestamp=datetime.now().isoformat()
+        ))
+
+    except Exception as e:
+        logging.error(f"过滤查询位置数据失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+@app.route('/api/positions/summary')
+@cached_response('positions')
+def get_positions_summary():
+    """按无人机或条码汇总最近的检测（数量、平均置信度、首末时间、平均坐标）"""
+    try:
+        try:
+            data = db_manager.get_positions_summary(
+                since=request.args.get('since'),
+                group_by=request.args.get('group_by', 'drone'),
+                limit=min(max(request.args.get('limit', 100, type=int), 1), 1000)
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if data is None:
+            return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+        return jsonify({
+            'status': 'success',
+            'data': data,
+            'count': len(data),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logging.error(f"汇总位置数据失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+def _parse_bbox(value):
+    """解析 bbox=minLon,minLat,maxLon,maxLat（与 GeoJSON / Leaflet toBBoxString 顺序一致）"""
+    parts = [float(v) for v in (value or '').split(',')]
+    if len(parts) != 4:
+        raise ValueError('bbox 需要 minLon,minLat,maxLon,maxLat')
+    # float() 接受 nan / inf，这类值与任何坐标比较都不成立，需要单独拒绝
+    if not all(math.isfinite(v) for v in parts):
+        raise ValueError('bbox 坐标必须为有限数值')
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError('bbox 最小值不能大于最大值')
+    return min_lat, min_lon, max_lat, max_lon
+
+@app.route('/api/positions/within')
+def get_positions_within():
+    """按矩形范围获取位置数据（地图可视区域）"""
+    try:
+        try:
+            bbox = _parse_bbox(request.args.get('bbox'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        limit = request.args.get('limit', 500, type=int)
+        try:
+            positions = db_manager.get_positions_within(
+                *bbox,
+                since=request.args.get('since'),
+                drone_id=request.args.get('drone_id'),
+                limit=limit
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        return jsonify({
+            'status': 'success',
+            'data': positions,
+            'count': len(positions),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logging.error(f"范围查询位置数据失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+@app.route('/api/positions/nearest')
+def get_positions_nearest():
+    """获取距离指定坐标最近的 k 条位置数据"""
+    try:
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        if lat is None or lon is None:
+            return jsonify({'status': 'error', 'message': '需要 lat 与 lon 参数'}), 400
+        max_distance = request.args.get('max_distance', type=float)
+        if not all(math.isfinite(v) for v in (lat, lon, max_distance or 0.0)):
+            return jsonify({'status': 'error', 'message': 'lat、lon 与 max_distance 必须为有限数值'}), 400
+        k = min(max(request.args.get('k', 10, type=int), 1), 1000)
+        try:
+            positions = db_manager.get_nearest_positions(
+                lat, lon, k,
+                max_distance_m=max_distance,
+                since=request.args.get('since')
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        
+        return jsonify({
+            'status': 'success',
+            'data': positions,
+            'count': len(positions),
+            'timestamp': datetime.now().isoformat()
+        })
+        
+    except Exception as e:
+        logging.error(f"最近邻查询失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+@app.route('/api/boxes/lookup', methods=['POST'])
+def lookup_boxes():
+    """批量查询多个条码的最新位置"""
+    try:
+        barcodes = (request.get_json(silent=True) or {}).get('barcodes')
+        if not isinstance(barcodes, list) or not all(isinstance(b, str) for b in barcodes):
+            return jsonify({'status': 'error', 'message': '需要 barcodes 字符串数组'}), 400
+
+        max_batch = config.API_CONFIG.get('max_batch_size', 100)
+        if len(barcodes) > max_batch:
+            return jsonify({'status': 'error', 'message': f'单次最多查询 {max_batch} 个条码'}), 413
+
+        boxes = db_manager.get_boxes_latest(barcodes)
+        found = {box['barcode_data'] for box in boxes}
+        return jsonify({
+            'status': 'success',
+            'data': boxes,
+            'count': len(boxes),
+            'missing': [b for b in dict.fromkeys(barcodes) if b not in found],
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logging.error(f"批量查询物体箱位置失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+@app.route('/api/boxes/search')
+def search_boxes():
+    """按部分条码（前缀、后缀或任意片段）搜索物体箱最新位置"""
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 500)
+        try:
+            boxes = db_manager.search_boxes(
+                request.args.get('q', ''),
+                mode=request.args.get('match', 'contains'),
+                sort=request.args.get('sort', 'recent'),
+                limit=limit
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+
+        return jsonify({
+            'status': 'success',
+            'data': boxes,
+            'count': len(boxes),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logging.error(f"搜索物体箱失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+@app.route('/api/boxes/by-barcode/<path:barcode>')
+def get_box(barcode):
+    """获取单个条码的最新位置（独立路径前缀，条码为 search、lookup 等也不会与其他端点冲突）"""
+    try:
+        box = db_manager.get_box_latest(barcode)
+        if box is None:
+            return jsonify({'status': 'error', 'message': '未找到该条码'}), 404
+
+        return jsonify({
+            'status': 'success',
+            'data': box,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logging.error(f"获取物体箱位置失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
 @app.route('/api/drones')
+@cached_response('drones')
 def get_drones():
     """获取无人机状态"""
     try:
@@ -195,7 +728,76 @@ def get_drones():
         logging.error(f"获取无人机状态失败: {e}")
         return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
 
+@app.route('/api/drones/<drone_id>/track')
+def get_drone_track(drone_id):
+    """获取无人机轨迹折线；tolerance 为简化容差（米），越大点越少"""
+    try:
+        tolerance = request.args.get('tolerance', type=float)
+        if tolerance is not None and tolerance < 0:
+            return jsonify({'status': 'error', 'message': 'tolerance 不能为负数'}), 400
+        try:
+            track = db_manager.get_drone_track(
+                drone_id,
+                start=request.args.get('from'),
+                end=request.args.get('to'),
+                tolerance_m=tolerance
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if track is None:
+            return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+        return jsonify({
+            'status': 'success',
+            'drone_id': drone_id,
+            'data': track,
+            'count': len(track),
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logging.error(f"获取无人机轨迹失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+def _analytics_response(fetch):
+    """条码分析查询的统一响应：未启用返回 503，参数错误返回 400"""
+    try:
+        data = fetch()
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    except Exception as e:
+        logging.error(f"条码分析查询失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+    if data is None:
+        return jsonify({'status': 'error', 'message': '条码分析未启用'}), 503
+    return jsonify({
+        'status': 'success',
+        'data': data,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/api/analytics/barcodes/distinct')
+def get_distinct_barcodes():
+    """日期区间（from/to，YYYY-MM-DD，含两端）内不同条码数的近似值"""
+    return _analytics_response(lambda: db_manager.get_distinct_barcodes(
+        request.args.get('from'), request.args.get('to')
+    ))
+
+@app.route('/api/analytics/drones/distinct')
+def get_distinct_barcodes_by_drone():
+    """每架无人机识别到的不同条码数的近似值"""
+    return _analytics_response(lambda: db_manager.get_distinct_barcodes_by_drone(
+        request.args.get('drone_id')
+    ))
+
+@app.route('/api/analytics/barcodes/top')
+def get_top_barcodes():
+    """检测次数最多的条码（带误差上界）"""
+    k = min(max(request.args.get('k', 20, type=int), 1), config.DB_CONFIG.get('analytics_topk_capacity', 1000))
+    return _analytics_response(lambda: db_manager.get_top_barcodes(k))
+
 @app.route('/api/statistics')
+@cached_response('positions', 'drones')
 def get_statistics():
     """获取系统统计信息"""
     try:
@@ -211,6 +813,47 @@ def get_statistics():
         logging.error(f"获取统计信息失败: {e}")
         return jsonify({'status': 'error', 'message': '获取统计信息失败'}), 500
 
+_STEP_UNITS = {'s': 1000, 'm': 60000, 'h': 3600000, 'd': 86400000}
+
+def _parse_step(value):
+    """解析 step：纯数字为秒，或带单位 s/m/h/d（如 5m、1h）；未提供时返回 None"""
+    if not value:
+        return None
+    value = value.strip().lower()
+    unit = _STEP_UNITS.get(value[-1])
+    number = value[:-1] if unit else value
+    if not number.isdigit():
+        raise ValueError('step 格式应为秒数或 5m/1h/1d')
+    return int(number) * (unit or 1000)
+
+@app.route('/api/timeseries')
+def get_timeseries():
+    """检测数量时间序列（按无人机或条码前缀分组），由预聚合汇总表回答"""
+    try:
+        try:
+            result = db_manager.get_timeseries(
+                start=request.args.get('from'),
+                end=request.args.get('to'),
+                group_by=request.args.get('group_by', 'drone'),
+                key=request.args.get('key'),
+                step_ms=_parse_step(request.args.get('step')),
+                max_points=config.API_CONFIG.get('timeseries_max_points', 1000)
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if result is None:
+            return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
+        return jsonify({
+            'status': 'success',
+            'data': result,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except Exception as e:
+        logging.error(f"获取时间序列失败: {e}")
+        return jsonify({'status': 'error', 'message': '获取数据失败'}), 500
+
 @app.route('/api/cleanup', methods=['POST'])
 def cleanup_data():
     """清理旧数据"""
@@ -261,6 +904,13 @@ def _check_admin(req_json) -> bool:
     token = request.headers.get('X-Admin-Token') or (req_json or {}).get('admin_token')
     return token == expect
 
+def _submit_job(kind, **kwargs):
+    try:
+        job = db_manager.submit_bulk_job(kind, **kwargs)
+    except ValueError as e:
+        return jsonify({'status':'error','message':str(e)}), 400
+    return jsonify({'status':'accepted','job':job}), 202
+
 @app.route('/api/admin/positions/clear', methods=['POST'])
 def admin_clear_positions():
     body = request.json or {}
@@ -268,8 +918,7 @@ def admin_clear_positions():
         return jsonify({'status':'error','message':'未授权'}), 403
     if not body.get('confirm'):
         return jsonify({'status':'error','message':'需要确认(confirm=true)'}), 400
-    ok = db_manager.clear_positions()
-    return jsonify({'status':'success' if ok else 'error'})
+    return _submit_job('clear')
 
 @app.route('/api/admin/drones/clear', methods=['POST'])
 def admin_clear_drones():
@@ -283,33 +932,182 @@ def admin_clear_drones():
 
 @app.route('/api/admin/positions/delete', methods=['POST'])
 def admin_delete_positions():
+    """后台分块删除：按 ids，或按 filter（from/to/drone_id/barcode）"""
     body = request.json or {}
     if not _check_admin(body):
         return jsonify({'status':'error','message':'未授权'}), 403
-    ids = body.get('ids') or []
-    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+    ids = body.get('ids')
+    filters = body.get('filter')
+    if ids is not None and not isinstance(ids, list):
         return jsonify({'status':'error','message':'ids 需要为整数列表'}), 400
+    if filters is not None and not isinstance(filters, dict):
+        return jsonify({'status':'error','message':'filter 需要为对象'}), 400
     if not body.get('confirm'):
         return jsonify({'status':'error','message':'需要确认(confirm=true)'}), 400
-    ok = db_manager.delete_positions(ids)
-    return jsonify({'status':'success' if ok else 'error'})
+    return _submit_job('delete', ids=ids, filters=filters)
 
 @app.route('/api/admin/positions/update', methods=['POST'])
 def admin_update_position():
+    """单条修改（id）同步执行；批量修改（ids 或 filter）作为后台任务"""
     body = request.json or {}
     if not _check_admin(body):
         return jsonify({'status':'error','message':'未授权'}), 403
-    pid = body.get('id')
     fields = body.get('fields') or {}
-    if not isinstance(pid, int) or not isinstance(fields, dict):
+    if not isinstance(fields, dict):
+        return jsonify({'status':'error','message':'fields 需要为对象'}), 400
+    if 'ids' in body or 'filter' in body:
+        ids = body.get('ids')
+        filters = body.get('filter')
+        if ids is not None and not isinstance(ids, list):
+            return jsonify({'status':'error','message':'ids 需要为整数列表'}), 400
+        if filters is not None and not isinstance(filters, dict):
+            return jsonify({'status':'error','message':'filter 需要为对象'}), 400
+        return _submit_job('update', ids=ids, filters=filters, fields=fields)
+    pid = body.get('id')
+    if not isinstance(pid, int):
         return jsonify({'status':'error','message':'需要 id(int) 与 fields(dict)'}), 400
     ok = db_manager.update_position(pid, fields)
     return jsonify({'status':'success' if ok else 'error'})
 
+@app.route('/api/admin/jobs')
+def admin_list_jobs():
+    if not _check_admin(None):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    return jsonify({'status':'success','data':db_manager.list_bulk_jobs()})
+
+@app.route('/api/admin/jobs/<job_id>')
+def admin_get_job(job_id):
+    if not _check_admin(None):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    job = db_manager.get_bulk_job(job_id)
+    if job is None:
+        return jsonify({'status':'error','message':'任务不存在'}), 404
+    return jsonify({'status':'success','data':job})
+
+@app.route('/api/admin/jobs/<job_id>/cancel', methods=['POST'])
+def admin_cancel_job(job_id):
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    if db_manager.get_bulk_job(job_id) is None:
+        return jsonify({'status':'error','message':'任务不存在'}), 404
+    ok = db_manager.cancel_bulk_job(job_id)
+    return jsonify({'status':'success' if ok else 'error','data':db_manager.get_bulk_job(job_id)})
+
+@app.route('/api/admin/maintenance')
+def admin_maintenance_stats():
+    if not _check_admin(None):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    return jsonify({'status':'success','data':db_manager.get_maintenance_stats()})
+
+@app.route('/api/admin/maintenance/run', methods=['POST'])
+def admin_run_maintenance():
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    metrics = db_manager.run_maintenance()
+    if metrics is None:
+        return jsonify({'status':'error','message':'数据库维护失败'}), 500
+    return jsonify({'status':'success','data':db_manager.get_maintenance_stats()})
+
+@app.route('/api/admin/analytics/rebuild', methods=['POST'])
+def admin_rebuild_analytics():
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    ok = db_manager.rebuild_analytics()
+    return jsonify({'status':'success' if ok else 'error','data':db_manager.get_analytics_stats()})
+
+@app.route('/api/admin/snapshots', methods=['GET'])
+def admin_list_snapshots():
+    if not _check_admin(None):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    return jsonify({'status':'success','data':db_manager.list_snapshots()})
+
+@app.route('/api/admin/snapshots', methods=['POST'])
+def admin_start_snapshot():
+    """后台开始在线快照，返回快照任务（202），通过 /api/admin/snapshots/<id> 查询进度与吞吐"""
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    snapshot = db_manager.start_snapshot()
+    if snapshot is None:
+        return jsonify({'status':'error','message':'已有快照正在进行'}), 409
+    return jsonify({'status':'accepted','snapshot':snapshot}), 202
+
+@app.route('/api/admin/snapshots/<snapshot_id>')
+def admin_get_snapshot(snapshot_id):
+    if not _check_admin(None):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    snapshot = db_manager.get_snapshot(snapshot_id)
+    if snapshot is None:
+        return jsonify({'status':'error','message':'快照不存在'}), 404
+    return jsonify({'status':'success','data':snapshot})
+
+@app.route('/api/admin/snapshots/<snapshot_id>/cancel', methods=['POST'])
+def admin_cancel_snapshot(snapshot_id):
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    if db_manager.get_snapshot(snapshot_id) is None:
+        return jsonify({'status':'error','message':'快照不存在'}), 404
+    ok = db_manager.cancel_snapshot(snapshot_id)
+    return jsonify({'status':'success' if ok else 'error','data':db_manager.get_snapshot(snapshot_id)})
+
+@app.route('/api/admin/statistics/rebuild', methods=['POST'])
+def admin_rebuild_statistics():
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    ok = db_manager.rebuild_statistics()
+    return jsonify({'status':'success' if ok else 'error'})
+
+@app.route('/api/admin/boxes/rebuild', methods=['POST'])
+def admin_rebuild_box_latest():
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    ok = db_manager.rebuild_box_latest()
+    return jsonify({'status':'success' if ok else 'error'})
+
+@app.route('/api/admin/rollups/rebuild', methods=['POST'])
+def admin_rebuild_rollups():
+    body = request.json or {}
+    if not _check_admin(body):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    ok = db_manager.rebuild_rollups()
+    return jsonify({'status':'success' if ok else 'error'})
+
+@app.route('/api/admin/partitions')
+def admin_list_partitions():
+    if not _check_admin(None):
+        return jsonify({'status':'error','message':'未授权'}), 403
+    return jsonify({
+        'status': 'success',
+        'partitioning': db_manager.partitions.period if db_manager.partitions else 'none',
+        'data': db_manager.list_partitions()
+    })
+
 def initialize_database():
     """初始化数据库"""
     if db_manager.connect():
         if db_manager.create_tables():
+            if config.DB_CONFIG.get('group_commit'):
+                db_manager.start_ingest_writer()
+            elif db_manager.shards is not None:
+                logging.warning("已启用分片但未开启 DB_GROUP_COMMIT：单条上传在请求线程上同步写入，写吞吐不随分片数增长")
+            db_manager.start_drone_registry()
+            db_manager.start_system_log_sink()
+            db_manager.start_epoch_backfill()
+            if config.DB_CONFIG.get('maintenance', True):
+                db_manager.start_maintenance()
+            db_manager.start_analytics()
+            if db_manager.replica_enabled:
+                db_manager.open_replica()
+            db_level = getattr(logging, config.LOG_CONFIG.get('db_level', 'INFO'), logging.INFO)
+            logging.getLogger().addHandler(
+                db_manager.system_log_handler(db_level, config.LOG_CONFIG.get('db_exclude', ()))
+            )
             logging.info("数据库初始化成功")
             return True
         else:
@@ -331,11 +1129,21 @@ def main():
     
     # 启动服务器
     logging.info("启动服务器...")
-    eventlet.wsgi.server(
-        eventlet.listen((config.FLASK_CONFIG['host'], config.FLASK_CONFIG['port'])),
-        app_sio,
-        log=logging.getLogger('eventlet')
-    )
+    try:
+        eventlet.wsgi.server(
+            eventlet.listen((config.FLASK_CONFIG['host'], config.FLASK_CONFIG['port'])),
+            app_sio,
+            log=logging.getLogger('eventlet')
+        )
+    finally:
+        # 先提交组提交队列中尚未落盘的检测（写入线程为守护线程，进程退出时会被直接丢弃）
+        db_manager.stop_ingest_writer()
+        broadcaster.stop()
+        # 退出前写入内存中尚未落盘的无人机状态与系统日志
+        db_manager.stop_maintenance()
+        db_manager.stop_analytics()
+        db_manager.stop_drone_registry()
+        db_manager.stop_system_log_sink()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,289 @@
+"""
+检测推送模块 - 按节拍合并的 WebSocket 广播
+
+上传请求只把检测数据放入内存队列（不做任何发送），后台任务每个节拍（默认 100ms）取出队列，
+按订阅房间各发一条 detections 消息：
+- all：全部检测（客户端连接后默认加入）
+- drone:<无人机ID>：指定无人机的检测
+- area:<纬度格>:<经度格>：落在指定网格内的检测，网格边长由 area_cell 决定（度）
+积压处理：队列超过上限时同一 (无人机, 条码) 只保留最新一条，仍超限则丢弃最旧的；
+发送队列积压的慢客户端本节拍被跳过，恢复后收到 detections_gap，按其中的 since 调用 backfill 补齐。
+"""
+from __future__ import annotations
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ALL_ROOM = "all"
+DRONE_ROOM = "drone:"
+AREA_ROOM = "area:"
+
+
+def _coords(item: Dict[str, Any]) -> Tuple[Optional[float], Optional[float]]:
+    """取检测的经纬度：兼容上传数据包的 gps 字段与扁平的 latitude / longitude"""
+    gps = item.get("gps")
+    source = gps if isinstance(gps, dict) else item
+    try:
+        return float(source["latitude"]), float(source["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+
+def _merge_key(item: Dict[str, Any]) -> Tuple[Any, Any]:
+    return item.get("drone_id"), item.get("barcode_data")
+
+
+def coalesce(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """同一 (无人机, 条码) 只保留最新一条，按最新一条的到达顺序排列"""
+    latest: "OrderedDict[Tuple[Any, Any], Dict[str, Any]]" = OrderedDict()
+    for item in items:
+        key = _merge_key(item)
+        latest.pop(key, None)
+        latest[key] = item
+    return list(latest.values())
+
+
+class DetectionBroadcaster:
+    """按节拍批量推送检测数据，支持按无人机、按区域订阅"""
+
+    def __init__(self, sio, interval: float = 0.1, max_pending: int = 5000, max_batch: int = 500,
+                 area_cell: float = 0.01, max_area_cells: int = 400, slow_client_queue: int = 64,
+                 namespace: str = "/") -> None:
+        if interval <= 0:
+            raise ValueError("interval 必须大于 0")
+        if area_cell <= 0:
+            raise ValueError("area_cell 必须大于 0")
+        self.sio = sio
+        self.interval = interval
+        self.max_pending = max(1, max_pending)
+        self.max_batch = max(1, max_batch)
+        self.area_cell = area_cell
+        self.max_area_cells = max_area_cells
+        self.slow_client_queue = slow_client_queue
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._pending: List[Dict[str, Any]] = []
+        # 慢客户端：sid -> 首个被跳过节拍中最早的检测时间
+        self._lagging: Dict[str, Optional[str]] = {}
+        self._running = False
+        self._task = None
+        self._seq = 0
+        self._published = 0
+        self._merged = 0
+        self._dropped = 0
+        self._dropped_unreported = 0
+        self._ticks = 0
+        self._messages = 0
+        self._skipped = 0
+        self._last_flush_ms = 0.0
+
+    # ---- 生命周期 ----
+    def start(self) -> None:
+        """启动后台推送任务（重复调用无副作用）"""
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._task = self.sio.start_background_task(self._run)
+        logger.info(f"检测推送已启动，节拍 {self.interval * 1000:.0f}ms")
+
+    def stop(self) -> None:
+        """停止后台任务并推送剩余数据"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"检测推送收尾失败: {e}")
+
+    def _run(self) -> None:
+        while self._running:
+            started = time.monotonic()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"检测推送失败: {e}")
+            self.sio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    # ---- 写入侧：只入队，不发送 ----
+    def publish(self, item: Dict[str, Any]) -> None:
+        self.publish_many((item,))
+
+    def publish_many(self, items: Iterable[Dict[str, Any]]) -> None:
+        with self._lock:
+            for item in items:
+                self._pending.append(item)
+                self._published += 1
+            if len(self._pending) > self.max_pending:
+                self._shed()
+
+    def _shed(self) -> None:
+        """积压超限：先合并同一箱子的检测，仍超限则丢弃最旧的，留出 1/4 余量避免每次入队都整理"""
+        before = len(self._pending)
+        self._pending = coalesce(self._pending)
+        self._merged += before - len(self._pending)
+        keep = self.max_pending - self.max_pending // 4
+        if len(self._pending) > keep:
+            drop = len(self._pending) - keep
+            del self._pending[:drop]
+            self._dropped += drop
+            self._dropped_unreported += drop
+
+    # ---- 推送侧 ----
+    def flush(self) -> int:
+        """推送一个节拍的数据，返回本节拍发出的消息数"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            dropped, self._dropped_unreported = self._dropped_unreported, 0
+        started = time.perf_counter()
+        slow = self._check_slow_clients(batch)
+        if not batch:
+            return 0
+        if len(batch) > self.max_batch:
+            merged = coalesce(batch)
+            extra = max(0, len(merged) - self.max_batch)
+            with self._lock:
+                self._merged += len(batch) - len(merged)
+                self._dropped += extra
+            dropped += extra
+            batch = merged[extra:]
+
+        rooms = self.sio.manager.rooms.get(self.namespace, {})
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        if ALL_ROOM in rooms:
+            groups[ALL_ROOM] = batch
+        for item in batch:
+            drone = DRONE_ROOM + str(item.get("drone_id"))
+            if drone in rooms:
+                groups.setdefault(drone, []).append(item)
+            lat, lon = _coords(item)
+            if lat is not None:
+                area = self.area_room(lat, lon)
+                if area in rooms:
+                    groups.setdefault(area, []).append(item)
+
+        self._seq += 1
+        skip = list(slow) or None
+        for room, items in groups.items():
+            self.sio.emit("detections", {
+                "room": room,
+                "seq": self._seq,
+                "items": items,
+                "dropped": dropped,
+            }, room=room, skip_sid=skip, namespace=self.namespace)
+        with self._lock:
+            self._ticks += 1
+            self._messages += len(groups)
+            self._last_flush_ms = (time.perf_counter() - started) * 1000
+        return len(groups)
+
+    def _check_slow_clients(self, batch: List[Dict[str, Any]]) -> List[str]:
+        """发送队列积压超过阈值的客户端本节拍跳过；恢复的客户端收到 detections_gap"""
+        if self.slow_client_queue <= 0:
+            return []
+        earliest = min((str(item["timestamp"]) for item in batch if item.get("timestamp")), default=None)
+        slow = []
+        recovered = []
+        for sid, eio_sid in self.sio.manager.get_participants(self.namespace, None):
+            if self._queue_size(eio_sid) > self.slow_client_queue:
+                slow.append(sid)
+                if batch:
+                    if self._lagging.get(sid) is None:
+                        self._lagging[sid] = earliest
+                    self._skipped += 1
+            elif sid in self._lagging:
+                recovered.append((sid, self._lagging.pop(sid)))
+        for sid, since in recovered:
+            self.sio.emit("detections_gap", {"since": since}, to=sid, namespace=self.namespace)
+        return slow
+
+    def _queue_size(self, eio_sid) -> int:
+        socket = self.sio.eio.sockets.get(eio_sid)
+        queue = getattr(socket, "queue", None)
+        try:
+            return queue.qsize() if queue is not None else 0
+        except Exception:
+            return 0
+
+    # ---- 订阅 ----
+    def area_room(self, lat: float, lon: float) -> str:
+        return f"{AREA_ROOM}{math.floor(lat / self.area_cell)}:{math.floor(lon / self.area_cell)}"
+
+    def area_rooms(self, area: Any) -> List[str]:
+        """区域订阅展开为网格房间：area 为 {min_lat, min_lon, max_lat, max_lon} 或同序的四元列表"""
+        if isinstance(area, dict):
+            area = [area.get(k) for k in ("min_lat", "min_lon", "max_lat", "max_lon")]
+        try:
+            min_lat, min_lon, max_lat, max_lon = (float(v) for v in area)
+        except (TypeError, ValueError):
+            raise ValueError("区域需为 min_lat, min_lon, max_lat, max_lon")
+        if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lon <= max_lon <= 180):
+            raise ValueError("区域经纬度范围无效")
+        lat0, lat1 = math.floor(min_lat / self.area_cell), math.floor(max_lat / self.area_cell)
+        lon0, lon1 = math.floor(min_lon / self.area_cell), math.floor(max_lon / self.area_cell)
+        cells = (lat1 - lat0 + 1) * (lon1 - lon0 + 1)
+        if cells > self.max_area_cells:
+            raise ValueError(f"区域过大：覆盖 {cells} 个网格，上限 {self.max_area_cells}")
+        return [f"{AREA_ROOM}{a}:{o}" for a in range(lat0, lat1 + 1) for o in range(lon0, lon1 + 1)]
+
+    def rooms_for(self, spec: Dict[str, Any]) -> List[str]:
+        """订阅参数 {'all': bool, 'drones': [...], 'areas': [...]} 对应的房间"""
+        if not isinstance(spec, dict):
+            raise ValueError("订阅参数需为对象")
+        rooms = [ALL_ROOM] if spec.get("all") else []
+        drones = spec.get("drones") or []
+        areas = spec.get("areas") or []
+        if not isinstance(drones, list) or not isinstance(areas, list):
+            raise ValueError("drones 与 areas 需为列表")
+        rooms.extend(DRONE_ROOM + str(d) for d in drones)
+        for area in areas:
+            rooms.extend(self.area_rooms(area))
+        if not rooms:
+            raise ValueError("未指定订阅内容")
+        return list(dict.fromkeys(rooms))
+
+    def subscribe(self, sid: str, spec: Dict[str, Any]) -> List[str]:
+        """加入订阅房间；只订阅无人机或区域时退出 all，避免重复收到同一检测"""
+        rooms = self.rooms_for(spec)
+        if ALL_ROOM not in rooms:
+            self.sio.leave_room(sid, ALL_ROOM, namespace=self.namespace)
+        for room in rooms:
+            self.sio.enter_room(sid, room, namespace=self.namespace)
+        return self.subscriptions(sid)
+
+    def unsubscribe(self, sid: str, spec: Dict[str, Any]) -> List[str]:
+        for room in self.rooms_for(spec):
+            self.sio.leave_room(sid, room, namespace=self.namespace)
+        return self.subscriptions(sid)
+
+    def subscriptions(self, sid: str) -> List[str]:
+        return sorted(r for r in self.sio.rooms(sid, namespace=self.namespace)
+                      if r == ALL_ROOM or r.startswith((DRONE_ROOM, AREA_ROOM)))
+
+    def forget(self, sid: str) -> None:
+        """客户端断开：清理慢客户端记录"""
+        self._lagging.pop(sid, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "running": self._running,
+                "interval_ms": self.interval * 1000,
+                "pending": len(self._pending),
+                "published": self._published,
+                "merged": self._merged,
+                "dropped": self._dropped,
+                "ticks": self._ticks,
+                "messages": self._messages,
+                "slow_skips": self._skipped,
+                "lagging_clients": len(self._lagging),
+                "last_flush_ms": round(self._last_flush_ms, 3),
+            }
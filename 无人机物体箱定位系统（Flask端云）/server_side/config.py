@@ -26,7 +26,85 @@ DB_CONFIG = {
     'type': 'sqlite',
     'path': str(DATA_DIR / 'drone_positioning.db'),
     'timeout': 30,
-    'check_same_thread': False
+    'check_same_thread': False,
+    # 组提交：上传请求只入队，由后台单连接合并为批量事务提交
+    'group_commit': os.getenv('DB_GROUP_COMMIT', 'false').lower() == 'true',
+    'group_commit_batch_size': int(os.getenv('DB_GROUP_COMMIT_BATCH', '256')),
+    'group_commit_max_delay_ms': float(os.getenv('DB_GROUP_COMMIT_DELAY_MS', '5')),
+    'group_commit_queue_size': 10000,
+    'group_commit_wait_timeout': 10,  # 秒，请求等待提交结果的上限
+    # 位置数据分区：none/day/week。分区后过期数据整表删除，不再逐行 DELETE
+    'partitioning': os.getenv('DB_PARTITIONING', 'none'),
+    # 按 drone_id 哈希分片（0 为不分片，最多 8 个）：每个分片是独立的库文件与写连接，写吞吐随分片数增长。
+    # 分片数在首次启用时记入数据库，之后修改不生效；分片模式下不使用分区。
+    # 分片模式不支持内存热层、条码分析与只读副本，需同时设置 DB_HOT_TIER / DB_ANALYTICS /
+    # DB_SNAPSHOT_REPLICA 为 false，否则启动时报错退出。
+    # 写吞吐要随分片数增长还需开启 DB_GROUP_COMMIT：未开启时单条上传在请求所在的 eventlet
+    # 线程上同步提交，各分片的写入仍被同一个事件循环串行化
+    'shards': int(os.getenv('DB_SHARDS', '0')),
+    # 毫秒时间列回填：后台分块执行，每块一个短事务，块间暂停让出写连接
+    'epoch_backfill_chunk_size': 2000,
+    'epoch_backfill_pause': 0.05,  # 秒
+    # 时间序列汇总（1m/1h/1d）：条码前缀长度修改后需执行 manage.py rebuild-rollups；
+    # 各粒度单独保留（天），0 表示永久保留，不随原始数据清理
+    'rollup_prefix_length': 4,
+    'rollup_retention_days': {'1m': 30, '1h': 730, '1d': 0},
+    # 无人机状态持久化窗口（秒）：心跳先写内存，按此间隔批量落盘；0 表示每次心跳同步写入
+    'drone_flush_interval': float(os.getenv('DB_DRONE_FLUSH_INTERVAL', '5')),
+    # 无人机轨迹在线压缩：偏离直线超过容差（米）才保留拐点；至少每 max_interval 秒保留一个点
+    'track_tolerance_m': float(os.getenv('DB_TRACK_TOLERANCE_M', '5')),
+    'track_max_interval': 300,  # 秒
+    'track_max_window': 500,  # 单架无人机未存储点的上限
+    # 内存热层：最近 window 秒的检测以列式数组常驻内存，最近的分页、范围、导出与汇总查询不访问 SQLite
+    'hot_tier': os.getenv('DB_HOT_TIER', 'true').lower() == 'true',
+    'hot_tier_window': int(os.getenv('DB_HOT_TIER_WINDOW', str(6 * 3600))),  # 秒
+    'hot_tier_max_rows': 500000,
+    'hot_tier_reload_interval': 1.0,  # 秒，删除/更新后两次整体重新加载的最小间隔
+    # 连接管理：单个写连接 + 有上限的只读连接池，每个连接缓存预编译语句
+    'read_pool_size': int(os.getenv('DB_READ_POOL_SIZE', '4')),
+    'statement_cache_size': 256,
+    'pool_checkout_timeout': 10,  # 秒，借出连接的最长等待
+    'busy_retries': 3,  # 遇到 SQLITE_BUSY 时的重试次数
+    # 数据库维护：WAL 超过 passive 阈值即做 PASSIVE 检查点；低负载时再做 TRUNCATE 检查点、
+    # PRAGMA optimize 与增量回收空闲页。auto_vacuum 仅对新建库生效，已有库执行 manage.py vacuum 转换
+    'maintenance': os.getenv('DB_MAINTENANCE', 'true').lower() == 'true',
+    'maintenance_interval': 60,  # 秒
+    'maintenance_idle_writes_per_sec': 5,  # 写连接借出速率低于此值视为低负载
+    'wal_checkpoint_passive_mb': 4,
+    'wal_checkpoint_truncate_mb': 64,
+    'optimize_interval': 3600,  # 秒
+    'analysis_limit': 1000,
+    'auto_vacuum': 'incremental',
+    'incremental_vacuum_pages': 256,  # 每轮最多回收的页数
+    'incremental_vacuum_min_free_pages': 1024,
+    # 条码分析：按天 / 按无人机的 HyperLogLog 去重计数与 Space-Saving 高频条码，
+    # 随写入增量更新，定期写检查点，重启后只补计检查点之后的记录
+    'analytics': os.getenv('DB_ANALYTICS', 'true').lower() == 'true',
+    'analytics_hll_precision': 12,  # 2^12 个寄存器，相对标准误差约 1.6%
+    'analytics_topk_capacity': 1000,
+    'analytics_retention_days': 90,  # 按天概要保留天数
+    'analytics_checkpoint_interval': 60,  # 秒
+    # 在线快照：SQLite 备份 API 分步复制，步间暂停，不阻塞写入；最新快照可作为报表查询的只读副本
+    'snapshot_dir': str(DATA_DIR / 'snapshots'),
+    'snapshot_step_pages': 256,  # 每步复制的页数
+    'snapshot_step_pause': 0.01,  # 秒
+    'snapshot_keep': 3,
+    'snapshot_replica': os.getenv('DB_SNAPSHOT_REPLICA', 'true').lower() == 'true',
+    'replica_pool_size': 2,
+    # 批量导入（manage.py import）：每批一个事务；导入期间写连接临时使用下列 PRAGMA，结束后恢复
+    'import_batch_size': 50000,
+    'import_pragmas': {
+        'synchronous': 'OFF',
+        'cache_size': -262144,  # KB，约 256MB
+        'temp_store': 'MEMORY',
+    },
+    # 管理端批量删除/更新：后台分块执行，每块一个短事务，块间暂停让出写连接
+    'bulk_chunk_size': 500,
+    'bulk_chunk_pause': 0.02,  # 秒
+    # 系统日志异步批量写入：队列满时先丢弃低级别日志
+    'system_log_queue_size': 10000,
+    'system_log_batch_size': 500,
+    'system_log_flush_interval': 2,  # 秒
 }
 
 # Flask配置
@@ -42,7 +120,14 @@ WEBSOCKET_CONFIG = {
     'host': os.getenv('WS_HOST', '0.0.0.0'),
     'port': int(os.getenv('WS_PORT', '5001')),
     'cors_allowed_origins': "*",
-    'async_mode': 'eventlet'
+    'async_mode': 'eventlet',
+    # 检测推送：每个节拍合并为一条 detections 消息，按无人机 / 区域网格分房间
+    'broadcast_interval': float(os.getenv('WS_BROADCAST_INTERVAL', '0.1')),  # 秒
+    'broadcast_max_pending': 5000,  # 待推送上限，超出时合并同一箱子的检测并丢弃最旧的
+    'broadcast_max_batch': 500,  # 单个节拍最多推送的检测数
+    'area_cell_deg': 0.01,  # 区域订阅网格边长（度）
+    'max_area_cells': 400,  # 单个区域订阅最多覆盖的网格数
+    'slow_client_queue': 64  # 客户端发送队列超过该长度视为慢客户端，跳过推送
 }
 
 # 日志配置
@@ -50,7 +135,11 @@ LOG_CONFIG = {
     'level': os.getenv('LOG_LEVEL', 'INFO'),
     'file': str(LOGS_DIR / 'server.log'),
     'max_size': 10 * 1024 * 1024,  # 10MB
-    'backup_count': 5
+    'backup_count': 5,
+    # 同时写入数据库 system_logs 表的最低级别（经异步批量写入器）
+    'db_level': os.getenv('LOG_DB_LEVEL', 'INFO'),
+    # 不写入 system_logs 的 logger：eventlet 每个请求一条访问日志，写库会让每次上传多一行写入
+    'db_exclude': ['eventlet', 'werkzeug']
 }
 
 # 文件上传配置
@@ -86,5 +175,14 @@ API_CONFIG = {
     'version': 'v1',
     'timeout': 30,
     'max_batch_size': 100,
+    'timeseries_max_points': 1000,  # /api/timeseries 单个分组最多返回的时间点
+    'backfill_max_rows': 1000,  # WebSocket 重连补发单次最多返回的检测数
+    # /api/positions/query：单页上限；可能全表扫描的查询每页最多检查的索引条目数
+    'query_max_limit': 1000,
+    'query_scan_budget': 20000,
+    # 大屏轮询接口响应缓存：写入后按版本号失效，支持 ETag / 304
+    'response_cache': os.getenv('API_RESPONSE_CACHE', 'true').lower() == 'true',
+    'response_cache_size': 512,
+    'response_cache_max_age': 5,  # 秒，兜底与时间相关的统计（如在线无人机数）
     'enable_cors': True
 }
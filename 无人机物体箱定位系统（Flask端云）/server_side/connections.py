@@ -0,0 +1,408 @@
+"""
+数据库连接模块 - 单写多读连接池与组提交写入器
+
+ConnectionPool 管理唯一的写连接与有上限的只读连接池，GroupCommitWriter 在后台把上传请求
+合并为批量事务提交。本模块只依赖 sqlite3，表结构与写入语句由 database 模块传入。
+"""
+from __future__ import annotations
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def _is_busy(error: sqlite3.Error) -> bool:
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class ConnectionPool:
+    """单写多读连接管理
+
+    - 写连接只有一个，放在容量为 1 的队列里，所有写操作排队取用，
+      进程内不再有多个连接争抢 SQLite 写锁；同一线程可重入。
+    - 读连接池有上限，连接以 query_only 打开并复用，不再随线程（green thread）无限增长。
+    - 每个连接开启语句缓存（cached_statements），相同 SQL 只编译一次。
+    持有写连接的线程再申请读连接时直接复用写连接，能读到本事务内尚未提交的修改。
+    read_only 为真时以只读 URI 打开（用于快照副本），不修改数据库文件，也不提供写连接。
+    on_open 在每个新建的读连接切换为 query_only 之前调用（如附加分片库）。
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        timeout: float = 30,
+        read_pool_size: int = 4,
+        cached_statements: int = 256,
+        checkout_timeout: float = 10,
+        busy_retries: int = 3,
+        auto_vacuum: Optional[str] = "incremental",
+        read_only: bool = False,
+        on_open: Optional[Callable[[sqlite3.Connection], None]] = None,
+    ) -> None:
+        self.db_path = db_path
+        self.read_only = read_only
+        self.on_open = on_open
+        self.auto_vacuum = auto_vacuum
+        self.timeout = timeout
+        self.read_pool_size = max(1, int(read_pool_size))
+        self.cached_statements = max(0, int(cached_statements))
+        self.checkout_timeout = checkout_timeout
+        self.busy_retries = max(0, int(busy_retries))
+        self._write_slot: "queue.Queue[Optional[sqlite3.Connection]]" = queue.Queue(maxsize=1)
+        self._write_slot.put(None)  # 写连接在首次使用时创建
+        self._writer_owner: Optional[int] = None
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._writer_depth = 0
+        self._idle: List[sqlite3.Connection] = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._stats = {
+            "read_checkouts": 0, "write_checkouts": 0,
+            "read_wait_ms": 0.0, "write_wait_ms": 0.0,
+            "max_read_wait_ms": 0.0, "max_write_wait_ms": 0.0,
+            "busy_retries": 0, "checkout_timeouts": 0,
+        }
+
+    def _open(self, readonly: bool) -> sqlite3.Connection:
+        if self.read_only:
+            conn = sqlite3.connect(
+                f"file:{self.db_path}?mode=ro", uri=True, timeout=self.timeout,
+                check_same_thread=False, cached_statements=self.cached_statements,
+            )
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA query_only=ON")
+            return conn
+        conn = sqlite3.connect(
+            self.db_path, timeout=self.timeout, check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        # 提升稳定性：启用 WAL、外键，设置 busy_timeout。
+        # auto_vacuum 只对尚未建表的新库生效，必须在切换 WAL 之前设置；已有库需 VACUUM 转换
+        pragmas = [f"PRAGMA auto_vacuum={self.auto_vacuum}"] if self.auto_vacuum else []
+        for pragma in pragmas + [
+            "PRAGMA journal_mode=WAL",
+            "PRAGMA foreign_keys=ON",
+            f"PRAGMA busy_timeout={int(self.timeout*1000)}",
+        ]:
+            try:
+                conn.execute(pragma)
+            except Exception:
+                pass
+        if readonly:
+            if self.on_open is not None:
+                self.on_open(conn)
+            conn.execute("PRAGMA query_only=ON")
+        return conn
+
+    def open_dedicated(self) -> sqlite3.Connection:
+        """打开一个不属于连接池的只读连接，由调用方关闭；长时间任务使用，避免占用池内连接"""
+        return self._open(readonly=True)
+
+    def _record_wait(self, kind: str, started: float) -> None:
+        waited = (time.monotonic() - started) * 1000
+        with self._cond:
+            self._stats[f"{kind}_checkouts"] += 1
+            self._stats[f"{kind}_wait_ms"] += waited
+            self._stats[f"max_{kind}_wait_ms"] = max(self._stats[f"max_{kind}_wait_ms"], waited)
+
+    def _timeout(self, what: str) -> sqlite3.OperationalError:
+        with self._cond:
+            self._stats["checkout_timeouts"] += 1
+        return sqlite3.OperationalError(f"等待{what}超时")
+
+    @contextmanager
+    def writer(self) -> Iterator[sqlite3.Connection]:
+        """独占写连接；异常退出时回滚未提交的事务"""
+        if self.read_only:
+            raise sqlite3.OperationalError("只读连接池不提供写连接")
+        me = threading.get_ident()
+        if self._writer_owner == me:
+            self._writer_depth += 1
+            try:
+                yield self._writer_conn  # type: ignore[misc]
+            finally:
+                self._writer_depth -= 1
+            return
+
+        started = time.monotonic()
+        try:
+            conn = self._write_slot.get(timeout=self.checkout_timeout)
+        except queue.Empty:
+            raise self._timeout("写连接")
+        try:
+            if conn is None:
+                conn = self._open(readonly=False)
+        except BaseException:
+            self._write_slot.put(None)
+            raise
+        self._record_wait("write", started)
+        self._writer_owner, self._writer_conn, self._writer_depth = me, conn, 1
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    pass
+            raise
+        finally:
+            self._writer_owner, self._writer_conn, self._writer_depth = None, None, 0
+            self._write_slot.put(conn)
+
+    @contextmanager
+    def reader(self) -> Iterator[sqlite3.Connection]:
+        """从读连接池借出一个只读连接"""
+        if self._writer_owner == threading.get_ident():
+            yield self._writer_conn  # type: ignore[misc]
+            return
+
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        conn: Optional[sqlite3.Connection] = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._created < self.read_pool_size:
+                    self._created += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if not self._idle:
+                        self._stats["checkout_timeouts"] += 1
+                        raise sqlite3.OperationalError("等待读连接超时")
+        if conn is None:
+            try:
+                conn = self._open(readonly=True)
+            except BaseException:
+                with self._cond:
+                    self._created -= 1
+                    self._cond.notify()
+                raise
+        self._record_wait("read", started)
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                try:
+                    conn.rollback()
+                except sqlite3.Error:
+                    pass
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def _retry(self, checkout: Callable, fn: Callable[[sqlite3.Connection], T]) -> T:
+        attempt = 0
+        while True:
+            try:
+                with checkout() as conn:
+                    return fn(conn)
+            except sqlite3.Error as e:
+                if not _is_busy(e) or attempt >= self.busy_retries:
+                    raise
+                attempt += 1
+                with self._cond:
+                    self._stats["busy_retries"] += 1
+                time.sleep(0.05 * (2 ** attempt))
+
+    def read(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """借出读连接执行 fn，遇到 SQLITE_BUSY 时退避重试"""
+        return self._retry(self.reader, fn)
+
+    def write(self, fn: Callable[[sqlite3.Connection], T]) -> T:
+        """持有写连接执行 fn（fn 自行提交），遇到 SQLITE_BUSY 时回滚并退避重试"""
+        return self._retry(self.writer, fn)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            stats = dict(self._stats, read_pool_size=self.read_pool_size,
+                         read_open=self._created, read_idle=len(self._idle))
+        for kind in ("read", "write"):
+            checkouts = stats[f"{kind}_checkouts"]
+            stats[f"avg_{kind}_wait_ms"] = round(stats[f"{kind}_wait_ms"] / checkouts, 3) if checkouts else 0.0
+        return stats
+
+    def close(self) -> None:
+        """关闭空闲连接与写连接；之后再次使用时按需重新打开"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        try:
+            conn = self._write_slot.get_nowait()
+        except queue.Empty:
+            return
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self._write_slot.put(None)
+
+
+# 写入队列元素：(记录列表, Future, 是否批量提交)
+_WriteItem = Tuple[List[tuple], Future, bool]
+
+
+class GroupCommitWriter:
+    """后台组提交写入器
+
+    请求线程只负责入队并拿到 Future；单个写入线程持有独立连接，
+    把队列中的多条记录合并进一个 executemany 事务，一次 commit（一次 fsync）。
+    批次大小和最大等待时间共同决定何时提交。Future 在事务提交后才置为成功，
+    因此调用方拿到的仍是持久化后的结果。insert(conn, rows) 在写连接上以一个事务写入整批记录，
+    返回与 rows 对齐的逐条错误。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        insert: Callable[[sqlite3.Connection, List[tuple]], List[Optional[sqlite3.Error]]],
+        batch_size: int = 256,
+        max_delay: float = 0.005,
+        queue_size: int = 10000,
+        wait_timeout: float = 10,
+        on_stored: Optional[Callable[[List[tuple], List[Optional[sqlite3.Error]]], None]] = None,
+    ) -> None:
+        self.pool = pool
+        self.insert = insert
+        self.on_stored = on_stored
+        self.batch_size = max(1, int(batch_size))
+        self.max_delay = max(0.0, float(max_delay))
+        self.wait_timeout = wait_timeout
+        self._queue: "queue.Queue[_WriteItem]" = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"batches": 0, "rows": 0, "failed_rows": 0, "max_batch": 0}
+
+    def start(self) -> bool:
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-group-commit", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"组提交写入器已启动: batch_size={self.batch_size}, max_delay={self.max_delay*1000:.1f}ms"
+        )
+        return True
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # 线程退出后仍残留的请求直接判失败，避免调用方永久等待
+        while True:
+            try:
+                _, fut, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if not fut.done():
+                fut.set_exception(RuntimeError("写入器已停止"))
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def submit(self, values: tuple) -> Future:
+        """提交单条记录；Future 结果为 True，失败时为对应异常"""
+        return self._put([values], many=False)
+
+    def submit_many(self, rows: List[tuple]) -> Future:
+        """提交一组记录，保证落在同一事务；Future 结果为逐条错误列表（None 表示成功）"""
+        return self._put(list(rows), many=True)
+
+    def _put(self, rows: List[tuple], many: bool) -> Future:
+        fut: Future = Future()
+        try:
+            self._queue.put((rows, fut, many), timeout=self.wait_timeout)
+        except queue.Full:
+            fut.set_exception(RuntimeError("写入队列已满"))
+        return fut
+
+    def stats(self) -> Dict:
+        return dict(self._stats, queue_size=self._queue.qsize())
+
+    def _collect(self) -> List[_WriteItem]:
+        try:
+            batch = [self._queue.get(timeout=0.2)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_delay
+        count = len(batch[0][0])
+        while count < self.batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._collect()
+            if batch:
+                self._commit_batch(batch)
+
+    def _commit_batch(self, batch: List[_WriteItem]) -> None:
+        # 批量提交请求整体进入本批次，因此批次可能略超过 batch_size
+        rows = [values for rows, _, _ in batch for values in rows]
+        errors: Optional[List[Optional[Exception]]] = None
+        try:
+            # 与其他写操作共用唯一的写连接，事务边界由 insert 显式控制
+            with self.pool.writer() as conn:
+                errors = self.insert(conn, rows)
+                self._notify_stored(rows, errors)
+        except Exception as e:
+            # 任何异常都不能终止唯一的写入线程；异常退出时写连接回滚，整批判失败
+            logger.error(f"组提交批次写入失败: {e}")
+            if errors is None:
+                errors = [e] * len(rows)
+        pos = 0
+        for rows, fut, many in batch:
+            item_errors = errors[pos:pos + len(rows)]
+            pos += len(rows)
+            if many:
+                fut.set_result(item_errors)
+            elif item_errors[0] is None:
+                fut.set_result(True)
+            else:
+                fut.set_exception(item_errors[0])
+        failed = sum(1 for e in errors if e is not None)
+        self._stats["batches"] += 1
+        self._stats["rows"] += len(errors) - failed
+        self._stats["failed_rows"] += failed
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(errors))
+
+    def _notify_stored(self, rows: List[tuple], errors: List[Optional[sqlite3.Error]]) -> None:
+        """回调失败只记录日志：记录已提交，不能报告为失败，否则无人机重传会产生重复数据"""
+        if self.on_stored is None:
+            return
+        try:
+            self.on_stored(rows, errors)
+        except Exception as e:
+            logger.error(f"写入后回调失败（记录已提交）: {e}")
@@ -3,17 +3,1799 @@
 """
 from __future__ import annotations
 
+import base64
+import copy
+import heapq
+import itertools
 import json
 import logging
+import math
+import os
+import queue
+import re
 import sqlite3
 import threading
+import time
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar, Union
 
 import config
+from analytics import BarcodeAnalytics, detection_day
+from connections import ConnectionPool, GroupCommitWriter
+from hot_tier import HOT_SUMMARY_GROUPS, HotTier, hot_tier_available
+from shards import SHARD_ID_BITS, SHARD_MAX, ShardSet, merge_box_latest
+from snapshots import SnapshotManager
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# 位置表结构：非分区模式下即 box_positions，分区模式下每个分区表都使用同一结构
+POSITION_COLUMNS = (
+    "id", "timestamp", "drone_id", "barcode_data", "barcode_type", "latitude", "longitude",
+    "altitude", "confidence", "bbox_x1", "bbox_y1", "bbox_x2", "bbox_y2", "created_at", "ts_ms",
+)
+POSITION_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        id INTEGER PRIMARY KEY{autoincrement},
+        timestamp TEXT NOT NULL,
+        drone_id TEXT NOT NULL,
+        barcode_data TEXT NOT NULL,
+        barcode_type TEXT,
+        latitude REAL,
+        longitude REAL,
+        altitude REAL,
+        confidence REAL,
+        bbox_x1 INTEGER,
+        bbox_y1 INTEGER,
+        bbox_x2 INTEGER,
+        bbox_y2 INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        ts_ms INTEGER
+    )
+"""
+
+
+def to_epoch_ms(value) -> Optional[int]:
+    """ISO 时间字符串（或 datetime）转为 Unix 毫秒；无时区时按服务器本地时间解释，无法解析时返回 None"""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        dt = value
+    else:
+        text = str(value).strip()
+        if text.endswith("Z"):
+            text = text[:-1] + "+00:00"
+        try:
+            dt = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    try:
+        return int(round(dt.timestamp() * 1000))
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+def add_column_if_missing(cur: sqlite3.Cursor, table: str, column: str, decl: str) -> None:
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {r[1] for r in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _index_prefix(table: str) -> str:
+    # 默认分区可能由原 box_positions 表改名而来，沿用原索引名以免重复建索引
+    return "idx_box" if table in ("box_positions", PositionPartitions.DEFAULT) else f"idx_{table}"
+
+
+def position_index_sql(table: str, text_time: bool = False) -> List[str]:
+    """位置表的二级索引；text_time 为真（毫秒列回填未完成）时保留文本时间索引，否则删除"""
+    prefix = _index_prefix(table)
+    # 回填完成前时间键仍为 timestamp，分页与范围查询依赖文本时间索引
+    return ([
+        f"CREATE INDEX IF NOT EXISTS {prefix}_drone_ts ON {table}(drone_id, timestamp, id)",
+        f"CREATE INDEX IF NOT EXISTS {prefix}_ts_id ON {table}(timestamp, id)",
+    ] if text_time else legacy_time_index_sql(table)) + [
+        # 复合索引：按无人机过滤并按 (ts_ms, id) 排序/翻页时直接走索引范围扫描
+        f"CREATE INDEX IF NOT EXISTS {prefix}_drone_ms ON {table}(drone_id, ts_ms, id)",
+        f"CREATE INDEX IF NOT EXISTS {prefix}_ms_id ON {table}(ts_ms, id)",
+        # 条码 + 时间：最新位置重算与单箱历史查询无需排序
+        f"CREATE INDEX IF NOT EXISTS {prefix}_barcode_ts ON {table}(barcode_data, timestamp, id)",
+        f"DROP INDEX IF EXISTS {prefix}_barcode",
+    ]
+
+
+def legacy_time_index_sql(table: str) -> List[str]:
+    """毫秒列回填完成后不再需要的文本时间索引"""
+    prefix = _index_prefix(table)
+    return [f"DROP INDEX IF EXISTS {prefix}_drone_ts", f"DROP INDEX IF EXISTS {prefix}_ts_id"]
+
+
+POSITION_INSERT_SQL = (
+    "INSERT INTO box_positions (timestamp, drone_id, barcode_data, barcode_type, "
+    "latitude, longitude, altitude, confidence, bbox_x1, bbox_y1, bbox_x2, bbox_y2, created_at, ts_ms) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+# 增量统计：由 box_positions 上的触发器在同一事务内维护，/api/statistics 只读这几行
+STATS_TABLES_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS stats_counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_daily (
+        day TEXT PRIMARY KEY,
+        detections INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stats_barcodes (
+        barcode_data TEXT PRIMARY KEY,
+        detections INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+]
+
+
+def _day_of(row: str) -> str:
+    """统计用的日期：优先由毫秒列按服务器本地时区换算，尚未回填的旧记录取字符串前 10 位"""
+    return f"coalesce(date({row}.ts_ms / 1000, 'unixepoch', 'localtime'), substr({row}.timestamp, 1, 10))"
+
+
+# 位置表触发器模板（{table} 为位置表名），每次 create_tables 时重建以保持定义最新
+_STATS_ADD = """
+    UPDATE stats_counters SET value = value + 1 WHERE name = 'total_detections';
+    INSERT INTO stats_daily (day, detections) VALUES (""" + _day_of("NEW") + """, 1)
+        ON CONFLICT(day) DO UPDATE SET detections = detections + 1;
+    UPDATE stats_counters SET value = value + 1 WHERE name = 'unique_barcodes'
+        AND NOT EXISTS (SELECT 1 FROM stats_barcodes WHERE barcode_data = NEW.barcode_data);
+    INSERT INTO stats_barcodes (barcode_data, detections) VALUES (NEW.barcode_data, 1)
+        ON CONFLICT(barcode_data) DO UPDATE SET detections = detections + 1;
+"""
+_STATS_REMOVE = """
+    UPDATE stats_counters SET value = value - 1 WHERE name = 'total_detections';
+    UPDATE stats_daily SET detections = detections - 1 WHERE day = """ + _day_of("OLD") + """;
+    DELETE FROM stats_daily WHERE day = """ + _day_of("OLD") + """ AND detections <= 0;
+    UPDATE stats_barcodes SET detections = detections - 1 WHERE barcode_data = OLD.barcode_data;
+    UPDATE stats_counters SET value = value - 1 WHERE name = 'unique_barcodes'
+        AND EXISTS (SELECT 1 FROM stats_barcodes WHERE barcode_data = OLD.barcode_data AND detections <= 0);
+    DELETE FROM stats_barcodes WHERE barcode_data = OLD.barcode_data AND detections <= 0;
+"""
+
+# 每个条码的最新位置（物化表）：回答“箱子 X 现在在哪”只需一次主键查找
+LATEST_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS box_latest (
+        barcode_data TEXT PRIMARY KEY,
+        position_id INTEGER,
+        drone_id TEXT,
+        barcode_type TEXT,
+        latitude REAL,
+        longitude REAL,
+        altitude REAL,
+        confidence REAL,
+        best_confidence REAL,
+        first_seen TEXT,
+        last_seen TEXT,
+        sightings INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+"""
+_LATEST_COLUMNS = "position_id, drone_id, barcode_type, latitude, longitude, altitude, confidence, last_seen"
+_LATEST_SOURCE = "id, drone_id, barcode_type, latitude, longitude, altitude, confidence, timestamp"
+# 只有时间不早于当前最新记录的观测才覆盖位置列（乱序补传不会回退位置）
+_LATEST_NEWER = "excluded.last_seen >= box_latest.last_seen"
+_LATEST_ADD = (
+    """
+    INSERT INTO box_latest (barcode_data, position_id, drone_id, barcode_type, latitude, longitude,
+        altitude, confidence, best_confidence, first_seen, last_seen, sightings)
+    VALUES (NEW.barcode_data, NEW.id, NEW.drone_id, NEW.barcode_type, NEW.latitude, NEW.longitude,
+        NEW.altitude, NEW.confidence, NEW.confidence, NEW.timestamp, NEW.timestamp, 1)
+    ON CONFLICT(barcode_data) DO UPDATE SET
+"""
+    + "".join(
+        f"        {col} = CASE WHEN {_LATEST_NEWER} THEN excluded.{col} ELSE box_latest.{col} END,\n"
+        for col in _LATEST_COLUMNS.split(", ")
+    )
+    + """        best_confidence = CASE
+            WHEN box_latest.best_confidence IS NULL OR excluded.best_confidence > box_latest.best_confidence
+            THEN excluded.best_confidence ELSE box_latest.best_confidence END,
+        first_seen = min(box_latest.first_seen, excluded.first_seen),
+        sightings = box_latest.sightings + 1;
+"""
+)
+# 删除的恰好是最新、最早或最高置信度记录时，才按 (barcode_data, timestamp, id) 索引重算
+_LATEST_REMOVE = (
+    """
+    UPDATE box_latest SET sightings = sightings - 1 WHERE barcode_data = OLD.barcode_data;
+    DELETE FROM box_latest WHERE barcode_data = OLD.barcode_data AND sightings <= 0;
+    UPDATE box_latest SET
+        ("""
+    + _LATEST_COLUMNS
+    + """) = (SELECT """
+    + _LATEST_SOURCE
+    + """ FROM box_positions
+            WHERE barcode_data = OLD.barcode_data ORDER BY timestamp DESC, id DESC LIMIT 1),
+        (best_confidence, first_seen) = (SELECT MAX(confidence), MIN(timestamp) FROM box_positions
+            WHERE barcode_data = OLD.barcode_data)
+    WHERE barcode_data = OLD.barcode_data
+        AND (position_id = OLD.id OR best_confidence = OLD.confidence OR first_seen = OLD.timestamp);
+"""
+)
+
+# 条码模糊搜索：FTS5 trigram 索引建在 box_latest 的条码上（每个条码一行，远小于位置表）。
+# box_latest 是 WITHOUT ROWID 表，另用 box_barcodes 分配整数 id 作为外部内容表；
+# box_latest 的插入/删除经触发器同步到 box_barcodes，再同步到 box_search
+BARCODE_SEARCH_SQL = [
+    "CREATE TABLE IF NOT EXISTS box_barcodes (id INTEGER PRIMARY KEY, barcode_data TEXT NOT NULL UNIQUE)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS box_search USING fts5("
+    "barcode_data, content='box_barcodes', content_rowid='id', tokenize='trigram')",
+]
+BARCODE_SEARCH_TRIGGERS = {
+    "trg_box_latest_search_ins": "AFTER INSERT ON box_latest BEGIN "
+    "INSERT OR IGNORE INTO box_barcodes (barcode_data) VALUES (NEW.barcode_data); END",
+    "trg_box_latest_search_del": "AFTER DELETE ON box_latest BEGIN "
+    "DELETE FROM box_barcodes WHERE barcode_data = OLD.barcode_data; END",
+    "trg_box_barcodes_ins": "AFTER INSERT ON box_barcodes BEGIN "
+    "INSERT INTO box_search (rowid, barcode_data) VALUES (NEW.id, NEW.barcode_data); END",
+    "trg_box_barcodes_del": "AFTER DELETE ON box_barcodes BEGIN "
+    "INSERT INTO box_search (box_search, rowid, barcode_data) VALUES ('delete', OLD.id, OLD.barcode_data); END",
+}
+# trigram 至少需要 3 个字符
+SEARCH_MIN_LENGTH = 3
+
+
+def create_barcode_search(cur: sqlite3.Cursor) -> bool:
+    """创建条码搜索索引及同步触发器；SQLite 不支持 FTS5 trigram 时返回 False"""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'box_search'")
+    existed = cur.fetchone() is not None
+    try:
+        for sql in BARCODE_SEARCH_SQL:
+            cur.execute(sql)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"SQLite 不支持 FTS5 trigram，条码搜索将退化为扫描 box_latest: {e}")
+        return False
+    for name, body in BARCODE_SEARCH_TRIGGERS.items():
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute(f"CREATE TRIGGER {name} {body}")
+    if not existed:
+        cur.execute("INSERT OR IGNORE INTO box_barcodes (barcode_data) SELECT barcode_data FROM box_latest")
+    return True
+
+
+# 时间序列预聚合：每个粒度一张表，按 (维度, 时间桶, 键) 计数，桶为起始时刻的 Unix 毫秒。
+# 维度 drone 的键为 drone_id，prefix 的键为条码前 ROLLUP_PREFIX_LENGTH 个字符（修改后需 rebuild-rollups）。
+# 插入、修改与删除都同步到汇总表（管理端删除属于纠错，图表随之更新）；保留策略清理期间
+# db_meta 中有 RETENTION_CLEANUP_KEY 标记，删除不扣减汇总，历史由 rollup_retention_days 单独清理。
+ROLLUP_LEVELS = {"1m": 60_000, "1h": 3_600_000, "1d": 86_400_000}
+RETENTION_CLEANUP_KEY = "retention_cleanup"
+ROLLUP_PREFIX_LENGTH = int((getattr(config, "DB_CONFIG", {}) or {}).get("rollup_prefix_length", 4))
+ROLLUP_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS rollup_{level} (
+        dimension TEXT NOT NULL,
+        key TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        detections INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (dimension, bucket, key)
+    ) WITHOUT ROWID
+"""
+
+
+def rollup_bucket_sql(col: str, level: str) -> str:
+    """毫秒时间列所在时间桶的起点；按天汇总以服务器本地零点为界"""
+    if level == "1d":
+        return f"CAST(strftime('%s', date({col} / 1000, 'unixepoch', 'localtime'), 'utc') AS INTEGER) * 1000"
+    return f"({col} - {col} % {ROLLUP_LEVELS[level]})"
+
+
+def rollup_bucket(ms: int, level: str) -> int:
+    """与 rollup_bucket_sql 一致的 Python 实现"""
+    if level == "1d":
+        day = datetime.fromtimestamp(ms / 1000).date()
+        return int(datetime(day.year, day.month, day.day).timestamp() * 1000)
+    return ms - ms % ROLLUP_LEVELS[level]
+
+
+# 未指定 step 时按顺序选第一个不超过点数上限的步长
+TIMESERIES_AUTO_STEPS = (
+    60_000, 300_000, 900_000, 3_600_000, 21_600_000, 86_400_000, 604_800_000,
+)
+
+
+def _rollup_keys(row: str) -> Dict[str, str]:
+    return {
+        "drone": f"{row}.drone_id",
+        "prefix": f"substr({row}.barcode_data, 1, {ROLLUP_PREFIX_LENGTH})",
+    }
+
+
+_ROLLUP_ADD = "".join(
+    f"""
+    INSERT INTO rollup_{level} (dimension, key, bucket, detections)
+        SELECT '{dim}', {key}, {rollup_bucket_sql("NEW.ts_ms", level)}, 1 WHERE NEW.ts_ms IS NOT NULL
+        ON CONFLICT(dimension, bucket, key) DO UPDATE SET detections = detections + 1;"""
+    for level in ROLLUP_LEVELS
+    for dim, key in _rollup_keys("NEW").items()
+) + "\n"
+# 扣减与清零都带完整主键 (dimension, bucket, key)，每行触发只做主键查找
+_ROLLUP_REMOVE = "".join(
+    f"""
+    UPDATE rollup_{level} SET detections = detections - 1
+        WHERE dimension = '{dim}' AND bucket = {rollup_bucket_sql("OLD.ts_ms", level)} AND key = {key};
+    DELETE FROM rollup_{level}
+        WHERE dimension = '{dim}' AND bucket = {rollup_bucket_sql("OLD.ts_ms", level)} AND key = {key}
+        AND detections <= 0;"""
+    for level in ROLLUP_LEVELS
+    for dim, key in _rollup_keys("OLD").items()
+) + "\n"
+
+POSITION_TRIGGERS = {
+    "stats_ins": "AFTER INSERT ON {table} BEGIN" + _STATS_ADD + "END",
+    "stats_del": "AFTER DELETE ON {table} BEGIN" + _STATS_REMOVE + "END",
+    # 修改时间或条码等价于删除旧记录再插入新记录，总数抵消（回填 ts_ms 会把记录移到本地日期）
+    "stats_upd": "AFTER UPDATE OF timestamp, barcode_data, ts_ms ON {table} BEGIN"
+    + _STATS_REMOVE + _STATS_ADD + "END",
+    "latest_ins": "AFTER INSERT ON {table} BEGIN" + _LATEST_ADD + "END",
+    "latest_del": "AFTER DELETE ON {table} BEGIN" + _LATEST_REMOVE + "END",
+    # 不含 ts_ms：毫秒列回填不影响最新位置
+    "latest_upd": "AFTER UPDATE OF " + ", ".join(c for c in POSITION_COLUMNS if c not in ("ts_ms", "created_at"))
+    + " ON {table} BEGIN" + _LATEST_REMOVE + _LATEST_ADD + "END",
+    # 回填 ts_ms 时 OLD.ts_ms 为空，只计入新桶
+    "rollup_ins": "AFTER INSERT ON {table} BEGIN" + _ROLLUP_ADD + "END",
+    "rollup_upd": "AFTER UPDATE OF drone_id, barcode_data, ts_ms ON {table} BEGIN"
+    + _ROLLUP_REMOVE + _ROLLUP_ADD + "END",
+    "rollup_del": "AFTER DELETE ON {table} "
+    f"WHEN NOT EXISTS (SELECT 1 FROM db_meta WHERE key = '{RETENTION_CLEANUP_KEY}') BEGIN"
+    + _ROLLUP_REMOVE + "END",
+}
+
+# 空间索引：R*Tree 以点（min=max）保存有坐标的记录，id 与位置表 id 一致；
+# 每个位置表（含分区表）各有一个 {table}_rtree
+SPATIAL_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {table}_rtree "
+    "USING rtree(id, min_lat, max_lat, min_lon, max_lon)"
+)
+_RTREE_ADD = """
+    INSERT OR REPLACE INTO {table}_rtree (id, min_lat, max_lat, min_lon, max_lon)
+        SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+        WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+"""
+_RTREE_REMOVE = """
+    DELETE FROM {table}_rtree WHERE id = OLD.id;
+"""
+SPATIAL_TRIGGERS = {
+    "rtree_ins": "AFTER INSERT ON {table} BEGIN" + _RTREE_ADD + "END",
+    "rtree_del": "AFTER DELETE ON {table} BEGIN" + _RTREE_REMOVE + "END",
+    "rtree_upd": "AFTER UPDATE OF id, latitude, longitude ON {table} BEGIN"
+    + _RTREE_REMOVE + _RTREE_ADD + "END",
+}
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320.0
+# 最近邻查询每轮取回的候选数（k 的倍数）
+NEAREST_CANDIDATE_FACTOR = 4
+
+
+def haversine_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """两点间球面距离（米）"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def install_position_triggers(cur: sqlite3.Cursor, table: str = "box_positions", spatial: bool = False) -> None:
+    """为位置表（重新）创建派生数据维护触发器"""
+    triggers = dict(POSITION_TRIGGERS)
+    if spatial:
+        triggers.update(SPATIAL_TRIGGERS)
+    for name, body in triggers.items():
+        trigger = f"trg_{table}_{name}"
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        cur.execute(f"CREATE TRIGGER {trigger} " + body.format(table=table))
+
+
+def create_spatial_index(cur: sqlite3.Cursor, table: str = "box_positions") -> bool:
+    """创建位置表的 R*Tree 空间索引；SQLite 未编译 rtree 模块时返回 False"""
+    cur.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (f"{table}_rtree",))
+    existed = cur.fetchone() is not None
+    try:
+        cur.execute(SPATIAL_TABLE_SQL.format(table=table))
+    except sqlite3.OperationalError as e:
+        logger.warning(f"SQLite 不支持 R*Tree，空间查询将退化为全表过滤: {e}")
+        return False
+    if not existed:
+        cur.execute(
+            f"INSERT INTO {table}_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+            f"SELECT id, latitude, latitude, longitude, longitude FROM {table} "
+            "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+        )
+    return True
+
+
+# 分区整体删除时不会触发行级触发器，这里补做派生数据的扣减（{table} 为被删除的分区表）
+PARTITION_DROP_SQL = [
+    "UPDATE stats_counters SET value = value - (SELECT COUNT(*) FROM {table}) "
+    "WHERE name = 'total_detections'",
+    "UPDATE stats_daily SET detections = detections - "
+    "(SELECT COUNT(*) FROM {table} t WHERE " + _day_of("t") + " = stats_daily.day) "
+    "WHERE day IN (SELECT DISTINCT " + _day_of("t") + " FROM {table} t)",
+    "DELETE FROM stats_daily WHERE detections <= 0",
+    "UPDATE stats_barcodes SET detections = detections - "
+    "(SELECT COUNT(*) FROM {table} t WHERE t.barcode_data = stats_barcodes.barcode_data) "
+    "WHERE barcode_data IN (SELECT barcode_data FROM {table})",
+    "UPDATE stats_counters SET value = value - (SELECT COUNT(*) FROM stats_barcodes WHERE detections <= 0) "
+    "WHERE name = 'unique_barcodes'",
+    "DELETE FROM stats_barcodes WHERE detections <= 0",
+    "UPDATE box_latest SET sightings = sightings - "
+    "(SELECT COUNT(*) FROM {table} t WHERE t.barcode_data = box_latest.barcode_data) "
+    "WHERE barcode_data IN (SELECT barcode_data FROM {table})",
+    "DELETE FROM box_latest WHERE sightings <= 0",
+    # 执行时视图已不含该分区，重算的是剩余数据中的最新记录
+    "UPDATE box_latest SET (" + _LATEST_COLUMNS + ") = (SELECT " + _LATEST_SOURCE + " FROM box_positions p "
+    "WHERE p.barcode_data = box_latest.barcode_data ORDER BY p.timestamp DESC, p.id DESC LIMIT 1), "
+    "(best_confidence, first_seen) = (SELECT MAX(confidence), MIN(timestamp) FROM box_positions p "
+    "WHERE p.barcode_data = box_latest.barcode_data) "
+    "WHERE barcode_data IN (SELECT barcode_data FROM {table})",
+]
+
+# 管理端整体删除分区时扣减汇总表（保留策略删除分区时不执行，保留历史）
+PARTITION_ROLLUP_DROP_SQL = [
+    f"INSERT INTO rollup_{level} (dimension, key, bucket, detections) "
+    f"SELECT '{dim}', {key}, {rollup_bucket_sql('t.ts_ms', level)}, -COUNT(*) FROM {{table}} t "
+    "WHERE t.ts_ms IS NOT NULL GROUP BY 2, 3 "
+    "ON CONFLICT(dimension, bucket, key) DO UPDATE SET detections = detections + excluded.detections"
+    for level in ROLLUP_LEVELS
+    for dim, key in _rollup_keys("t").items()
+] + [f"DELETE FROM rollup_{level} WHERE detections <= 0" for level in ROLLUP_LEVELS]
+
+
+class PositionPartitions:
+    """按天/按周分区的位置数据布局
+
+    - 每个周期一张分区表 box_positions_pYYYYMMDD（周分区以周一为起点），
+      无法解析时间的记录进入 box_positions_pdefault；
+    - box_positions 变为 UNION ALL 视图，INSTEAD OF 触发器把插入/删除/更新路由到分区，
+      原有查询与写入 SQL 无需区分模式；
+    - id 由 box_sequence 全局分配，保证跨分区唯一；
+    - 过期数据直接 DROP 分区表，不再逐行 DELETE。
+    """
+
+    DEFAULT = "box_positions_pdefault"
+
+    def __init__(self, period: str = "day", spatial: bool = False) -> None:
+        if period not in ("day", "week"):
+            raise ValueError(f"不支持的分区周期: {period}")
+        self.period = period
+        self.spatial = spatial
+        # 毫秒列回填完成前，新建分区同样需要文本时间索引
+        self.text_time = False
+
+    def period_for(self, timestamp) -> Optional[Tuple[str, str, str]]:
+        """返回 (分区表名, 起始日期, 结束日期)；时间无法解析时返回 None（进入默认分区）"""
+        try:
+            day = datetime.strptime(str(timestamp)[:10], "%Y-%m-%d").date()
+        except (TypeError, ValueError):
+            return None
+        if self.period == "week":
+            day -= timedelta(days=day.weekday())
+            end = day + timedelta(days=7)
+        else:
+            end = day + timedelta(days=1)
+        return f"box_positions_p{day:%Y%m%d}", day.isoformat(), end.isoformat()
+
+    def setup(self, cur: sqlite3.Cursor) -> None:
+        """创建分区目录与默认分区；已有的普通 box_positions 表整体转为默认分区"""
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS box_partitions ("
+            "name TEXT PRIMARY KEY, period_start TEXT, period_end TEXT, "
+            "created_at TEXT DEFAULT CURRENT_TIMESTAMP)"
+        )
+        cur.execute("CREATE TABLE IF NOT EXISTS box_sequence (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+        cur.execute("SELECT type FROM sqlite_master WHERE name = 'box_positions'")
+        row = cur.fetchone()
+        if row is not None and row[0] == "table":
+            cur.execute("SELECT COALESCE(MAX(id), 0) FROM box_positions")
+            max_id = cur.fetchone()[0]
+            for name in list(POSITION_TRIGGERS) + list(SPATIAL_TRIGGERS):
+                cur.execute(f"DROP TRIGGER IF EXISTS trg_box_positions_{name}")
+            cur.execute(f"ALTER TABLE box_positions RENAME TO {self.DEFAULT}")
+            cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'box_positions_rtree'")
+            if cur.fetchone() is not None:
+                cur.execute(f"ALTER TABLE box_positions_rtree RENAME TO {self.DEFAULT}_rtree")
+            cur.execute(
+                "INSERT OR REPLACE INTO box_sequence (name, value) VALUES ('box_positions', ?)", (max_id,)
+            )
+            logger.warning(f"已将原 box_positions 表转为默认分区 {self.DEFAULT}（{max_id} 条）")
+        cur.execute("INSERT OR IGNORE INTO box_sequence (name, value) VALUES ('box_positions', 0)")
+
+        self._create_table(cur, self.DEFAULT, None, None)
+        for name in self.names(cur):
+            self._create_table(cur, name, None, None, register=False)
+        today = self.period_for(datetime.now().isoformat())
+        if today:
+            self._create_table(cur, *today)
+        self.rebuild_view(cur)
+
+    def names(self, cur: sqlite3.Cursor) -> List[str]:
+        cur.execute("SELECT name FROM box_partitions ORDER BY period_start IS NULL, period_start DESC")
+        return [r[0] for r in cur.fetchall()]
+
+    def list(self, cur: sqlite3.Cursor) -> List[Dict]:
+        cur.execute(
+            "SELECT name, period_start, period_end, created_at FROM box_partitions "
+            "ORDER BY period_start IS NULL, period_start DESC"
+        )
+        return [dict(zip(("name", "period_start", "period_end", "created_at"), r)) for r in cur.fetchall()]
+
+    def ensure(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        """写事务内调用：为本批记录缺失的周期创建分区（rows 第一列为 timestamp）"""
+        periods = {}
+        for values in rows:
+            period = self.period_for(values[0])
+            if period:
+                periods[period[0]] = period
+        if not periods:
+            return
+        marks = ",".join("?" * len(periods))
+        existing = {
+            r[0] for r in conn.execute(f"SELECT name FROM box_partitions WHERE name IN ({marks})", list(periods))
+        }
+        missing = [p for name, p in periods.items() if name not in existing]
+        if not missing:
+            return
+        cur = conn.cursor()
+        for period in missing:
+            self._create_table(cur, *period)
+        self.rebuild_view(cur)
+        cur.close()
+
+    def _create_table(
+        self, cur: sqlite3.Cursor, name: str, start: Optional[str], end: Optional[str], register: bool = True
+    ) -> None:
+        # 分区表 id 由路由触发器显式分配，不需要 AUTOINCREMENT
+        cur.execute(POSITION_TABLE_SQL.format(table=name, autoincrement=""))
+        add_column_if_missing(cur, name, "ts_ms", "INTEGER")
+        for sql in position_index_sql(name, text_time=self.text_time):
+            cur.execute(sql)
+        if self.spatial:
+            create_spatial_index(cur, name)
+        install_position_triggers(cur, name, spatial=self.spatial)
+        if register:
+            cur.execute(
+                "INSERT OR IGNORE INTO box_partitions (name, period_start, period_end) VALUES (?, ?, ?)",
+                (name, start, end),
+            )
+
+    def rebuild_view(self, cur: sqlite3.Cursor) -> None:
+        """按当前分区重建 box_positions 视图及其路由触发器"""
+        cur.execute(
+            "SELECT name, period_start, period_end FROM box_partitions "
+            "ORDER BY period_start IS NULL, period_start DESC"
+        )
+        parts = cur.fetchall()
+        cols = ", ".join(POSITION_COLUMNS)
+        data_cols = [c for c in POSITION_COLUMNS if c != "id"]
+        new_values = ", ".join(f"NEW.{c}" for c in data_cols)
+        new_id = "COALESCE(NEW.id, (SELECT value FROM box_sequence WHERE name = 'box_positions'))"
+
+        cur.execute("DROP VIEW IF EXISTS box_positions")
+        cur.execute(
+            "CREATE VIEW box_positions AS "
+            + " UNION ALL ".join(f"SELECT {cols} FROM {name}" for name, _, _ in parts)
+        )
+
+        ranges = []
+        inserts = []
+        for name, start, end in parts:
+            if start is None:
+                continue
+            cond = f"NEW.timestamp >= '{start}' AND NEW.timestamp < '{end}'"
+            ranges.append(f"({cond})")
+            inserts.append(f"INSERT INTO {name} ({cols}) SELECT {new_id}, {new_values} WHERE {cond};")
+        default_cond = f"NOT ({' OR '.join(ranges)})" if ranges else "1"
+        inserts.append(
+            f"INSERT INTO {self.DEFAULT} ({cols}) SELECT {new_id}, {new_values} WHERE {default_cond};"
+        )
+        cur.execute(
+            "CREATE TRIGGER trg_box_positions_route_ins INSTEAD OF INSERT ON box_positions BEGIN "
+            "UPDATE box_sequence SET value = CASE WHEN NEW.id IS NULL THEN value + 1 "
+            "ELSE max(value, NEW.id) END WHERE name = 'box_positions'; "
+            + " ".join(inserts)
+            + " END"
+        )
+        cur.execute(
+            "CREATE TRIGGER trg_box_positions_route_del INSTEAD OF DELETE ON box_positions BEGIN "
+            + " ".join(f"DELETE FROM {name} WHERE id = OLD.id;" for name, _, _ in parts)
+            + " END"
+        )
+        sets = ", ".join(f"{c} = NEW.{c}" for c in data_cols)
+        cur.execute(
+            "CREATE TRIGGER trg_box_positions_route_upd INSTEAD OF UPDATE ON box_positions BEGIN "
+            + " ".join(f"UPDATE {name} SET {sets} WHERE id = OLD.id;" for name, _, _ in parts)
+            + " END"
+        )
+
+    def expired(self, cur: sqlite3.Cursor, cutoff_day: str) -> List[str]:
+        """整个周期都早于 cutoff_day 的分区"""
+        cur.execute(
+            "SELECT name FROM box_partitions WHERE period_end IS NOT NULL AND period_end <= ?",
+            (cutoff_day,),
+        )
+        return [r[0] for r in cur.fetchall()]
+
+    def drop(self, cur: sqlite3.Cursor, name: str, keep_rollups: bool = False) -> None:
+        """整体删除一个分区：先从视图摘除，再扣减派生数据，最后 DROP 表与其空间索引。
+
+        保留策略清理传入 keep_rollups=True，时间序列汇总保留历史。
+        """
+        cur.execute("DELETE FROM box_partitions WHERE name = ?", (name,))
+        self.rebuild_view(cur)
+        for sql in PARTITION_DROP_SQL + ([] if keep_rollups else PARTITION_ROLLUP_DROP_SQL):
+            cur.execute(sql.format(table=name))
+        cur.execute(f"DROP TABLE IF EXISTS {name}")
+        cur.execute(f"DROP TABLE IF EXISTS {name}_rtree")
+
+
+def insert_position_rows(
+    conn: sqlite3.Connection,
+    rows: List[tuple],
+    prepare: Optional[Callable[[sqlite3.Connection, List[tuple]], None]] = None,
+) -> List[Optional[sqlite3.Error]]:
+    """在一个事务内写入多条位置记录，返回与 rows 对齐的逐条错误（None 表示成功）。
+
+    先尝试整批 executemany；失败时回滚并用 SAVEPOINT 逐条隔离坏数据，
+    其余记录仍在同一事务内提交。prepare 在取得写锁后、写入前执行（如创建分区）。
+    调用前连接上不应有未结束的事务。
+    """
+    if not rows:
+        return []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if prepare is not None:
+            prepare(conn, rows)
+        conn.executemany(POSITION_INSERT_SQL, rows)
+        conn.execute("COMMIT")
+        return [None] * len(rows)
+    except sqlite3.Error as e:
+        try:
+            conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+        if len(rows) == 1:
+            return [e]
+        logger.warning(f"批量写入失败，逐条重试: {e}")
+
+    results: List[Optional[sqlite3.Error]] = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if prepare is not None:
+            prepare(conn, rows)
+        for values in rows:
+            conn.execute("SAVEPOINT row")
+            try:
+                conn.execute(POSITION_INSERT_SQL, values)
+                results.append(None)
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO row")
+                results.append(e)
+            conn.execute("RELEASE row")
+        conn.execute("COMMIT")
+        return results
+    except sqlite3.Error as e:
+        try:
+            conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            pass
+        logger.error(f"批量写入失败: {e}")
+        return [e] * len(rows)
+
+
+def encode_cursor(timestamp, row_id: int) -> str:
+    """把 (时间键, id) 编码为不透明的分页游标；时间键为 ISO 字符串或毫秒整数"""
+    raw = json.dumps([timestamp, row_id], separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[object, int]:
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        timestamp, row_id = json.loads(raw.decode("utf-8"))
+    except Exception as e:
+        raise ValueError(f"无效的分页游标: {cursor}") from e
+    if not isinstance(timestamp, (str, int)) or isinstance(timestamp, bool) or not isinstance(row_id, int):
+        raise ValueError(f"无效的分页游标: {cursor}")
+    return timestamp, row_id
+
+
+# 过滤查询语法：字段 -> 类型；"time" 映射到当前时间键（ts_ms 或 timestamp）
+QUERY_FIELDS = {
+    "time": "time",
+    "id": "int",
+    "drone_id": "text",
+    "barcode_data": "text",
+    "barcode_type": "text",
+    "confidence": "real",
+    "latitude": "real",
+    "longitude": "real",
+    "altitude": "real",
+}
+QUERY_RANGE_OPS = {"gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+QUERY_MAX_IN = 100
+
+
+def compile_position_filter(
+    filters: Dict,
+    time_key: str,
+    time_value: Callable[[object], object],
+) -> Tuple[List[str], List]:
+    """把过滤条件编译为参数化 WHERE 子句（条件列表与参数）。
+
+    每个字段取一个值（等值，null 表示 IS NULL）或一个操作符对象：
+    eq / in（列表）/ gt / gte / lt / lte / between（[下限, 上限]，闭区间）/ prefix（仅文本字段）。
+    前缀编译为半开区间而非 LIKE，可以直接使用 (barcode_data, ...) 索引。
+    字段、操作符或取值不合法时抛出 ValueError。
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("filter 必须是对象")
+    conds: List[str] = []
+    params: List = []
+    for field, spec in filters.items():
+        kind = QUERY_FIELDS.get(field)
+        if kind is None:
+            raise ValueError(f"不支持的过滤字段: {field}")
+        column = time_key if kind == "time" else field
+
+        def value(v):
+            if kind == "time":
+                return time_value(v)
+            if kind == "text":
+                ok = isinstance(v, str)
+            else:
+                ok = isinstance(v, (int, float)) and not isinstance(v, bool)
+                ok = ok and (kind == "real" or isinstance(v, int))
+            if not ok:
+                raise ValueError(f"字段 {field} 的取值类型不正确: {v!r}")
+            return v
+
+        if not isinstance(spec, dict):
+            spec = {"eq": spec}
+        if not spec:
+            raise ValueError(f"字段 {field} 缺少操作符")
+        for op, arg in spec.items():
+            if op == "eq" and arg is None:
+                conds.append(f"{column} IS NULL")
+            elif op == "eq":
+                conds.append(f"{column} = ?")
+                params.append(value(arg))
+            elif op in QUERY_RANGE_OPS:
+                conds.append(f"{column} {QUERY_RANGE_OPS[op]} ?")
+                params.append(value(arg))
+            elif op == "between":
+                if not isinstance(arg, list) or len(arg) != 2:
+                    raise ValueError(f"字段 {field} 的 between 需要 [下限, 上限]")
+                conds.append(f"{column} BETWEEN ? AND ?")
+                params.extend(value(v) for v in arg)
+            elif op == "in":
+                if not isinstance(arg, list) or not arg or len(arg) > QUERY_MAX_IN:
+                    raise ValueError(f"字段 {field} 的 in 需要 1~{QUERY_MAX_IN} 个取值")
+                conds.append(f"{column} IN ({', '.join('?' * len(arg))})")
+                params.extend(value(v) for v in arg)
+            elif op == "prefix":
+                if kind != "text" or not isinstance(arg, str) or not arg:
+                    raise ValueError(f"prefix 仅支持文本字段且不能为空: {field}")
+                conds.append(f"{column} >= ?")
+                params.append(arg)
+                if ord(arg[-1]) < 0x10FFFF:
+                    conds.append(f"{column} < ?")
+                    params.append(arg[:-1] + chr(ord(arg[-1]) + 1))
+            else:
+                raise ValueError(f"不支持的操作符: {op}")
+    return conds, params
+
+
+def explain_plan(conn: sqlite3.Connection, sql: str, params: List) -> List[str]:
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+def plan_scans_fully(plan: List[str]) -> bool:
+    """计划中存在对位置表的 SCAN（无论是否按索引顺序）即视为可能全表扫描"""
+    return any(line.startswith("SCAN ") and not line.startswith("SCAN CONSTANT") for line in plan)
+
+
+# (ts_ms, latitude, longitude, altitude)
+TrackPoint = Tuple[int, float, float, Optional[float]]
+
+TRACK_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS drone_tracks (
+        id INTEGER PRIMARY KEY,
+        drone_id TEXT NOT NULL,
+        ts_ms INTEGER NOT NULL,
+        latitude REAL NOT NULL,
+        longitude REAL NOT NULL,
+        altitude REAL
+    )
+"""
+TRACK_INSERT_SQL = "INSERT INTO drone_tracks (drone_id, ts_ms, latitude, longitude, altitude) VALUES (?, ?, ?, ?, ?)"
+
+
+def segment_distance_m(p: TrackPoint, a: TrackPoint, b: TrackPoint) -> float:
+    """点 p 到线段 ab 的水平距离（米），在 a 处做局部等距投影，适用于轨迹尺度"""
+    coslat = math.cos(math.radians(a[1]))
+    px, py = (p[2] - a[2]) * coslat * METERS_PER_DEG_LAT, (p[1] - a[1]) * METERS_PER_DEG_LAT
+    bx, by = (b[2] - a[2]) * coslat * METERS_PER_DEG_LAT, (b[1] - a[1]) * METERS_PER_DEG_LAT
+    length2 = bx * bx + by * by
+    t = 0.0 if length2 == 0 else max(0.0, min(1.0, (px * bx + py * by) / length2))
+    return math.hypot(px - t * bx, py - t * by)
+
+
+def douglas_peucker(points: List[TrackPoint], tolerance_m: float) -> List[TrackPoint]:
+    """Douglas-Peucker 折线简化（迭代实现），保留首尾点"""
+    if len(points) < 3 or tolerance_m <= 0:
+        return list(points)
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        index, worst = 0, tolerance_m
+        for i in range(first + 1, last):
+            d = segment_distance_m(points[i], points[first], points[last])
+            if d > worst:
+                index, worst = i, d
+        if index:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return [p for p, k in zip(points, keep) if k]
+
+
+class TrackSimplifier:
+    """无人机轨迹的在线压缩（滑动窗口 / 死区）
+
+    每架无人机保留最后一个已存储点（锚点）和其后尚未存储的点。新点到达时，
+    若窗口内某点偏离“锚点→新点”线段超过 tolerance_m，就存储前一个点并以它为新锚点；
+    直线巡航或悬停时窗口一直扩展，只留下拐点。距锚点超过 max_interval 秒
+    或窗口达到 max_window 个点时强制存储，限制崩溃时丢失的尾段与单次计算量。
+    """
+
+    def __init__(self, tolerance_m: float = 5.0, max_interval: float = 300, max_window: int = 500) -> None:
+        self.tolerance_m = max(0.0, float(tolerance_m))
+        self.max_interval_ms = int(max(1.0, float(max_interval)) * 1000)
+        self.max_window = max(2, int(max_window))
+        self._anchors: Dict[str, TrackPoint] = {}
+        self._windows: Dict[str, List[TrackPoint]] = {}
+        self._lock = threading.Lock()
+        self._stats = {"received": 0, "stored": 0}
+
+    def add(self, drone_id: str, point: TrackPoint) -> List[TrackPoint]:
+        """加入一个新点，返回需要存储的点（按时间顺序）"""
+        with self._lock:
+            self._stats["received"] += 1
+            anchor = self._anchors.get(drone_id)
+            window = self._windows.setdefault(drone_id, [])
+            emit: List[TrackPoint] = []
+            if anchor is None:
+                emit.append(point)
+            elif point[0] - anchor[0] > self.max_interval_ms or len(window) >= self.max_window:
+                # 保留长间隔之前的最后位置，再从新点重新开始
+                if window:
+                    emit.append(window[-1])
+                emit.append(point)
+            elif any(segment_distance_m(p, anchor, point) > self.tolerance_m for p in window):
+                emit.append(window[-1])
+                window[:] = [point]
+                self._anchors[drone_id] = emit[-1]
+                self._stats["stored"] += 1
+                return emit
+            else:
+                window.append(point)
+                return emit
+            window.clear()
+            self._anchors[drone_id] = point
+            self._stats["stored"] += len(emit)
+            return emit
+
+    def pending(self, drone_id: str) -> Optional[TrackPoint]:
+        """尚未存储的最新位置（查询时补在轨迹末尾）"""
+        with self._lock:
+            window = self._windows.get(drone_id)
+            return window[-1] if window else None
+
+    def drain(self) -> List[Tuple[str, TrackPoint]]:
+        """取出所有无人机尚未存储的最新位置（停止前调用）"""
+        with self._lock:
+            tail = [(drone_id, window[-1]) for drone_id, window in self._windows.items() if window]
+            for drone_id, point in tail:
+                self._anchors[drone_id] = point
+            self._windows.clear()
+            self._stats["stored"] += len(tail)
+            return tail
+
+    def clear(self) -> None:
+        with self._lock:
+            self._anchors.clear()
+            self._windows.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, tolerance_m=self.tolerance_m)
+
+
+_DRONE_COLUMNS = (
+    "drone_id", "status", "last_heartbeat", "gps_latitude", "gps_longitude", "gps_altitude",
+    "battery_level", "signal_strength", "created_at", "updated_at", "last_heartbeat_ms",
+)
+_DRONE_UPSERT_SQL = (
+    f"INSERT INTO drone_status ({', '.join(_DRONE_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_DRONE_COLUMNS))}) "
+    "ON CONFLICT(drone_id) DO UPDATE SET "
+    + ", ".join(f"{c}=excluded.{c}" for c in _DRONE_COLUMNS if c not in ("drone_id", "created_at"))
+)
+
+
+class DroneRegistry:
+    """内存中的无人机状态表
+
+    心跳只更新内存并标记为脏，后台线程每 flush_interval 秒把脏条目合并成一次
+    UPSERT 批量写入 drone_status。flush_interval 即持久化窗口：进程崩溃最多丢失
+    这段时间内的心跳；设为 0 或后台线程未启动时退化为每次心跳同步写入。
+    带 GPS 的心跳经 tracks 压缩后，保留下来的轨迹点随同一事务写入 drone_tracks。
+    """
+
+    def __init__(
+        self, pool: ConnectionPool, flush_interval: float = 5, tracks: Optional[TrackSimplifier] = None
+    ) -> None:
+        self.pool = pool
+        self.flush_interval = max(0.0, float(flush_interval))
+        self.tracks = tracks
+        self._drones: Dict[str, Dict] = {}
+        self._dirty: set = set()
+        self._track_rows: List[tuple] = []
+        self._lock = threading.Lock()
+        # 串行化落盘，避免后台刷新与同步刷新交错写入旧快照
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"heartbeats": 0, "flushes": 0, "rows_flushed": 0, "flush_errors": 0}
+
+    def load(self, conn: sqlite3.Connection) -> None:
+        """从 drone_status 装载已有状态（启动时调用一次）"""
+        rows = [dict(r) for r in conn.execute("SELECT * FROM drone_status")]
+        for r in rows:
+            if r.get("last_heartbeat_ms") is None:
+                r["last_heartbeat_ms"] = to_epoch_ms(r.get("last_heartbeat"))
+        with self._lock:
+            self._drones = {r["drone_id"]: r for r in rows}
+            self._dirty.clear()
+
+    def start(self) -> bool:
+        if self.flush_interval <= 0:
+            return False
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="drone-registry-flush", daemon=True)
+        self._thread.start()
+        logger.info(f"无人机状态刷新线程已启动: 持久化窗口 {self.flush_interval}s")
+        return True
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        # 停止前把剩余脏条目与轨迹尾段写入
+        if self.tracks is not None:
+            tail = self.tracks.drain()
+            with self._lock:
+                self._track_rows.extend((drone_id,) + point for drone_id, point in tail)
+        self.flush()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def update(self, drone_id: str, status_data: Dict) -> bool:
+        gps = status_data.get("gps")
+        gps = gps if isinstance(gps, dict) else {}
+        received = time.time()
+        now = datetime.fromtimestamp(received).isoformat()
+        with self._lock:
+            entry = self._drones.get(drone_id)
+            if entry is None:
+                entry = {"id": None, "drone_id": drone_id, "created_at": now}
+                self._drones[drone_id] = entry
+            entry.update(
+                status=status_data.get("status", "online"),
+                last_heartbeat=now,
+                last_heartbeat_ms=int(received * 1000),
+                gps_latitude=gps.get("latitude"),
+                gps_longitude=gps.get("longitude"),
+                gps_altitude=gps.get("altitude"),
+                battery_level=status_data.get("battery_level"),
+                signal_strength=status_data.get("signal_strength"),
+                updated_at=now,
+            )
+            self._dirty.add(drone_id)
+            self._stats["heartbeats"] += 1
+        lat, lon = gps.get("latitude"), gps.get("longitude")
+        if self.tracks is not None and lat is not None and lon is not None:
+            try:
+                point = (int(received * 1000), float(lat), float(lon), gps.get("altitude"))
+            except (TypeError, ValueError):
+                point = None
+            if point is not None:
+                kept = self.tracks.add(drone_id, point)
+                if kept:
+                    with self._lock:
+                        self._track_rows.extend((drone_id,) + p for p in kept)
+        if self.is_running():
+            return True
+        return self.flush()
+
+    def get(self, drone_id: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            if drone_id:
+                entry = self._drones.get(drone_id)
+                return [dict(entry)] if entry else []
+            drones = [dict(e) for e in self._drones.values()]
+        drones.sort(key=lambda d: d.get("updated_at") or "", reverse=True)
+        return drones
+
+    def online_count(self, since_ms: int) -> int:
+        with self._lock:
+            return sum(
+                1 for e in self._drones.values()
+                if e.get("status") == "online" and (e.get("last_heartbeat_ms") or 0) > since_ms
+            )
+
+    def clear(self) -> None:
+        with self._flush_lock, self._lock:
+            self._drones.clear()
+            self._dirty.clear()
+            self._track_rows.clear()
+        if self.tracks is not None:
+            self.tracks.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, drones=len(self._drones), dirty=len(self._dirty))
+
+    def flush(self) -> bool:
+        """把脏条目以一次 UPSERT 批量写入 drone_status"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._dirty and not self._track_rows:
+                    return True
+                ids = list(self._dirty)
+                self._dirty.clear()
+                rows = [tuple(self._drones[i].get(c) for c in _DRONE_COLUMNS) for i in ids if i in self._drones]
+                new_ids = [i for i in ids if i in self._drones and self._drones[i].get("id") is None]
+                track_rows, self._track_rows = self._track_rows, []
+
+            def _upsert(conn: sqlite3.Connection) -> List[tuple]:
+                with conn:
+                    conn.executemany(_DRONE_UPSERT_SQL, rows)
+                    conn.executemany(TRACK_INSERT_SQL, track_rows)
+                    if not new_ids:
+                        return []
+                    marks = ",".join("?" * len(new_ids))
+                    return conn.execute(
+                        f"SELECT drone_id, id FROM drone_status WHERE drone_id IN ({marks})", new_ids
+                    ).fetchall()
+
+            try:
+                assigned = self.pool.write(_upsert)
+            except sqlite3.Error as e:
+                # 写入失败时重新标记为脏，下一轮重试
+                with self._lock:
+                    self._dirty.update(i for i in ids if i in self._drones)
+                    self._track_rows[:0] = track_rows
+                    self._stats["flush_errors"] += 1
+                logger.error(f"无人机状态落盘失败: {e}")
+                return False
+            with self._lock:
+                for drone_id, row_id in assigned:
+                    if drone_id in self._drones:
+                        self._drones[drone_id]["id"] = row_id
+                self._stats["flushes"] += 1
+                self._stats["rows_flushed"] += len(rows)
+            return True
+
+
+SYSTEM_LOG_INSERT_SQL = (
+    "INSERT INTO system_logs (timestamp, level, source, message, data, ts_ms) VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+def system_log_values(
+    level: str, source: str, message: str, data: Optional[Dict] = None, created: Optional[float] = None
+) -> tuple:
+    created = time.time() if created is None else created
+    return (
+        datetime.fromtimestamp(created).isoformat(),
+        level,
+        source,
+        message,
+        json.dumps(data, ensure_ascii=False, default=str) if data else None,
+        int(created * 1000),
+    )
+
+
+# 队列满时按级别从低到高丢弃
+_LOG_LEVEL_RANK = {"DEBUG": 0, "INFO": 1, "WARNING": 2, "ERROR": 3, "CRITICAL": 4}
+
+
+class SystemLogSink:
+    """system_logs 的异步批量写入器
+
+    调用方只把记录放入内存队列；后台线程每 flush_interval 秒（或积累 batch_size 条）
+    用一次 executemany 事务写入。队列有上限，满时先淘汰最旧的低级别记录
+    （DEBUG 最先），若队列里没有比新记录级别更低的，则丢弃新记录。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 2,
+    ) -> None:
+        self.pool = pool
+        self.queue_size = max(1, int(queue_size))
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = max(0.05, float(flush_interval))
+        # 每个级别一个队列，记录带全局序号，落盘时按序号恢复原始顺序
+        self._queues: Dict[int, deque] = {rank: deque() for rank in sorted(set(_LOG_LEVEL_RANK.values()))}
+        self._size = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"queued": 0, "written": 0, "flushes": 0, "flush_errors": 0, "dropped": {}}
+
+    def start(self) -> bool:
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="system-log-sink", daemon=True)
+        self._thread.start()
+        logger.info(f"系统日志批量写入已启动: 队列上限 {self.queue_size}, 刷新间隔 {self.flush_interval}s")
+        return True
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def in_sink_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, level: str, source: str, message: str, data: Optional[Dict] = None,
+               created: Optional[float] = None) -> bool:
+        """入队一条日志（created 为 Unix 秒，默认当前时间），不等待写入；被丢弃时返回 False"""
+        level = str(level).upper()
+        rank = _LOG_LEVEL_RANK.get(level, _LOG_LEVEL_RANK["INFO"])
+        values = system_log_values(level, source, message, data, created)
+        with self._lock:
+            if self._size >= self.queue_size:
+                victim = next((r for r in self._queues if r < rank and self._queues[r]), None)
+                if victim is None:
+                    self._count_drop(level)
+                    return False
+                _, dropped = self._queues[victim].popleft()
+                self._count_drop(dropped[1])
+                self._size -= 1
+            self._seq += 1
+            self._queues[rank].append((self._seq, values))
+            self._size += 1
+            self._stats["queued"] += 1
+            full = self._size >= self.batch_size
+        if full:
+            self._wake.set()
+        return True
+
+    def _count_drop(self, level: str) -> None:
+        dropped = self._stats["dropped"]
+        dropped[level] = dropped.get(level, 0) + 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return dict(self._stats, dropped=dict(self._stats["dropped"]), pending=self._size)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> bool:
+        """把队列中的全部记录分批写入 system_logs"""
+        with self._lock:
+            items = [item for q in self._queues.values() for item in q]
+            for q in self._queues.values():
+                q.clear()
+            self._size = 0
+        if not items:
+            return True
+        items.sort(key=lambda item: item[0])
+        rows = [values for _, values in items]
+
+        def _insert(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.executemany(SYSTEM_LOG_INSERT_SQL, rows)
+
+        try:
+            self.pool.write(_insert)
+        except sqlite3.Error as e:
+            with self._lock:
+                self._stats["flush_errors"] += 1
+                for _, values in items:
+                    self._count_drop(values[1])
+            logger.error(f"系统日志批量写入失败，丢弃 {len(rows)} 条: {e}")
+            return False
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["written"] += len(rows)
+        return True
+
+
+class SystemLogHandler(logging.Handler):
+    """把标准 logging 记录转发到 SystemLogSink，emit 只入队不落盘
+
+    exclude 中的 logger（含其子 logger）不转发，如 eventlet 的逐请求访问日志。
+    """
+
+    def __init__(self, sink: SystemLogSink, level: int = logging.INFO, exclude: Iterable[str] = ()) -> None:
+        super().__init__(level)
+        self.sink = sink
+        self.exclude = tuple(exclude)
+
+    def excluded(self, name: str) -> bool:
+        return any(name == prefix or name.startswith(prefix + ".") for prefix in self.exclude)
+
+    def emit(self, record: logging.LogRecord) -> None:
+        # 写入线程自身的日志（如落盘失败）不再回流，避免循环
+        if self.sink.in_sink_thread() or self.excluded(record.name):
+            return
+        try:
+            data = None
+            if record.exc_info:
+                data = {"exception": logging.Formatter().formatException(record.exc_info)}
+            self.sink.submit(
+                record.levelname,
+                record.name,
+                record.getMessage(),
+                data,
+                created=record.created,
+            )
+        except Exception:
+            self.handleError(record)
+
+
+# 批量任务的一步：在写事务内处理一块数据，返回处理的行数；返回 None 表示该步已完成
+BulkTask = Callable[[sqlite3.Connection], Optional[int]]
+# 指定在哪个库的写连接上执行的任务（分片模式下各分片的任务）
+PooledBulkTask = Tuple["ConnectionPool", BulkTask]
+
+
+class BulkJob:
+    """一个管理端批量任务（删除 / 更新 / 清空）及其进度"""
+
+    def __init__(self, job_id: str, kind: str, params: Dict) -> None:
+        self.id = job_id
+        self.kind = kind
+        self.params = params
+        self.state = "queued"
+        self.processed = 0
+        self.chunks = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.cancelled = threading.Event()
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "state": self.state,
+            "processed": self.processed,
+            "chunks": self.chunks,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class BulkJobRunner:
+    """管理端批量操作的后台执行器
+
+    任务按提交顺序逐个执行。每个任务拆成若干步，每步在一个短写事务内处理一块数据，
+    块之间暂停 pause 秒让出唯一的写连接，清理期间上传写入的延迟不随任务规模增长。
+    已结束的任务只保留最近 keep 个供查询进度。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        pause: float = 0.02,
+        keep: int = 100,
+        on_chunk: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.pool = pool
+        self.pause = max(0.0, float(pause))
+        self.keep = max(1, int(keep))
+        self.on_chunk = on_chunk
+        self._jobs: Dict[str, BulkJob] = {}
+        self._queue: "queue.Queue[Tuple[BulkJob, List[Union[BulkTask, PooledBulkTask]]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._thread: Optional[threading.Thread] = None
+
+    def submit(self, kind: str, params: Dict, tasks: List[Union[BulkTask, PooledBulkTask]]) -> BulkJob:
+        with self._lock:
+            self._seq += 1
+            job = BulkJob(f"{datetime.now():%Y%m%d%H%M%S}-{self._seq}", kind, params)
+            self._jobs[job.id] = job
+            self._prune()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="bulk-jobs", daemon=True)
+                self._thread.start()
+        self._queue.put((job, tasks))
+        return job
+
+    def get(self, job_id: str) -> Optional[BulkJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[BulkJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> bool:
+        """请求取消；已提交的块不会回滚，任务在当前块结束后停止"""
+        job = self.get(job_id)
+        if job is None or job.state in ("done", "failed", "cancelled"):
+            return False
+        job.cancelled.set()
+        return True
+
+    def _prune(self) -> None:
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self._jobs[job.id]
+
+    def _run(self) -> None:
+        while True:
+            job, tasks = self._queue.get()
+            self._execute(job, tasks)
+
+    def _execute(self, job: BulkJob, tasks: List[Union[BulkTask, PooledBulkTask]]) -> None:
+        job.state = "running"
+        job.started_at = datetime.now().isoformat()
+        try:
+            for item in tasks:
+                pool, task = item if isinstance(item, tuple) else (self.pool, item)
+                while not job.cancelled.is_set():
+                    count = pool.write(task)
+                    if count is None:
+                        break
+                    job.processed += count
+                    job.chunks += 1
+                    if self.on_chunk is not None:
+                        self.on_chunk()
+                    time.sleep(self.pause)
+            job.state = "cancelled" if job.cancelled.is_set() else "done"
+        except Exception as e:
+            # 任何异常（含 on_chunk 回调）都只让本任务失败，执行线程继续处理后续任务
+            job.state = "failed"
+            job.error = str(e)
+            logger.error(f"批量任务 {job.id} 失败（已处理 {job.processed} 条）: {e}")
+        finally:
+            job.finished_at = datetime.now().isoformat()
+            logger.info(f"批量任务 {job.id} ({job.kind}) 结束: {job.state}, 处理 {job.processed} 条")
+
+
+class DataVersions:
+    """按数据类别计数的版本号：每次成功写入后递增，上层缓存据此判断是否失效"""
+
+    def __init__(self) -> None:
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *names: str) -> None:
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def get(self, *names: str) -> Tuple[int, ...]:
+        with self._lock:
+            return tuple(self._versions.get(name, 0) for name in names)
+
+
+META_TABLE_SQL = "CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT)"
+EPOCH_READY_KEY = "epoch_ms_ready"
+# 快速批量导入期间被去掉的二级索引定义（JSON 列表 [[表, SQL], ...]），导入完成后清除
+BULK_LOAD_KEY = "bulk_load_indexes"
+# 位置数据的分片数（0 或缺失为不分片）
+SHARDS_KEY = "position_shards"
+
+
+def get_meta(conn: sqlite3.Connection, key: str) -> Optional[str]:
+    row = conn.execute("SELECT value FROM db_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def set_meta(conn: sqlite3.Connection, key: str, value) -> None:
+    """写入 db_meta（不提交，由调用方的事务提交）"""
+    conn.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+
+# 回填任务：(表, 源 ISO 时间列, 目标毫秒列)
+EpochTarget = Tuple[str, str, str]
+
+
+class EpochBackfill:
+    """把已有记录的 ISO 时间回填到毫秒列
+
+    每张表按 id 升序分块处理，每块一个短写事务，块间暂停让出写连接，上传写入不会被长时间阻塞。
+    进度（每张表已处理到的 id）记在 db_meta，中断或重启后从断点继续。
+    全部完成后写入 epoch_ms_ready、删除旧的文本时间索引，并回调 on_complete 切换查询路径。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        targets: Callable[[sqlite3.Connection], List[EpochTarget]],
+        chunk_size: int = 2000,
+        pause: float = 0.05,
+        on_complete: Optional[Callable[[], None]] = None,
+    ) -> None:
+        self.pool = pool
+        self.targets = targets
+        self.chunk_size = max(1, int(chunk_size))
+        self.pause = max(0.0, float(pause))
+        self.on_complete = on_complete
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._progress: Dict[str, Dict] = {}
+        self._done = False
+
+    def start(self) -> bool:
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="epoch-backfill", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def status(self) -> Dict:
+        return {"done": self._done, "running": self.is_running(), "tables": dict(self._progress)}
+
+    def _run(self) -> None:
+        try:
+            self.run()
+        except sqlite3.Error as e:
+            logger.error(f"毫秒时间列回填失败（下次启动时继续）: {e}")
+
+    def run(self) -> bool:
+        """回填到完成或被停止；全部完成时返回 True"""
+        started = time.monotonic()
+        for table, src, dst in self.pool.read(self.targets):
+            progress = self._progress.setdefault(table, {"last_id": 0, "updated": 0})
+            while not self._stop.is_set():
+                try:
+                    scanned = self.pool.write(lambda conn: self._chunk(conn, table, src, dst, progress))
+                except sqlite3.OperationalError as e:
+                    # 回填期间分区可能已被保留策略删除
+                    if "no such table" not in str(e):
+                        raise
+                    break
+                if scanned < self.chunk_size:
+                    break
+                time.sleep(self.pause)
+            if self._stop.is_set():
+                return False
+        self.pool.write(self._finish)
+        self._done = True
+        logger.info(f"毫秒时间列回填完成，用时 {time.monotonic() - started:.1f}s")
+        if self.on_complete is not None:
+            self.on_complete()
+        return True
+
+    def _chunk(self, conn: sqlite3.Connection, table: str, src: str, dst: str, progress: Dict) -> int:
+        key = f"epoch_backfill:{table}"
+        last_id = int(get_meta(conn, key) or 0)
+        rows = conn.execute(
+            f"SELECT id, {src}, {dst} FROM {table} WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, self.chunk_size),
+        ).fetchall()
+        if not rows:
+            return 0
+        updates = []
+        for row_id, value, current in rows:
+            if current is None:
+                ms = to_epoch_ms(value)
+                if ms is not None:
+                    updates.append((ms, row_id))
+        with conn:
+            conn.executemany(f"UPDATE {table} SET {dst} = ? WHERE id = ? AND {dst} IS NULL", updates)
+            set_meta(conn, key, rows[-1][0])
+        progress["last_id"] = rows[-1][0]
+        progress["updated"] += len(updates)
+        return len(rows)
+
+    def _finish(self, conn: sqlite3.Connection) -> None:
+        with conn:
+            for table, _, dst in self.targets(conn):
+                if table == "system_logs":
+                    conn.execute("DROP INDEX IF EXISTS idx_log_timestamp")
+                elif dst == "ts_ms":
+                    for sql in legacy_time_index_sql(table):
+                        conn.execute(sql)
+            set_meta(conn, EPOCH_READY_KEY, 1)
+
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+def storage_metrics(conn: sqlite3.Connection, db_path: str) -> Dict:
+    """数据库文件、WAL 与空闲页的当前大小（字节 / 页）"""
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    freelist = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+    try:
+        wal_bytes = os.path.getsize(db_path + "-wal")
+    except OSError:
+        wal_bytes = 0
+    return {
+        "page_size": page_size,
+        "page_count": page_count,
+        "db_bytes": page_size * page_count,
+        "wal_bytes": wal_bytes,
+        "freelist_pages": freelist,
+        "freelist_bytes": page_size * freelist,
+        "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, str(auto_vacuum)),
+    }
+
+
+class MaintenanceScheduler:
+    """进程内的数据库维护调度
+
+    每 interval 秒检查一次：
+    - WAL 超过 passive_bytes 时执行 PASSIVE 检查点（不等待读者，不阻塞写入）；
+    - 低负载时（上个周期写连接借出次数低于 idle_writes_per_sec）：
+      WAL 超过 truncate_bytes 则执行 TRUNCATE 检查点把 WAL 文件截回 0；
+      每 optimize_interval 秒执行一次 PRAGMA optimize 刷新查询规划统计；
+      空闲页超过 vacuum_min_free 时，每次 incremental_vacuum 回收 vacuum_pages 页。
+    所有操作都在写连接上执行，与其他写入排队，不会与上传争抢 SQLite 写锁。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        interval: float = 60,
+        passive_bytes: int = 4 * 1024 * 1024,
+        truncate_bytes: int = 64 * 1024 * 1024,
+        idle_writes_per_sec: float = 5,
+        optimize_interval: float = 3600,
+        analysis_limit: int = 1000,
+        vacuum_pages: int = 256,
+        vacuum_min_free: int = 1024,
+        checkpoint_busy_ms: int = 1000,
+    ) -> None:
+        self.pool = pool
+        self.interval = max(1.0, float(interval))
+        self.passive_bytes = int(passive_bytes)
+        self.truncate_bytes = int(truncate_bytes)
+        self.idle_writes_per_sec = float(idle_writes_per_sec)
+        self.optimize_interval = float(optimize_interval)
+        self.analysis_limit = max(0, int(analysis_limit))
+        self.vacuum_pages = max(1, int(vacuum_pages))
+        self.vacuum_min_free = max(0, int(vacuum_min_free))
+        self.checkpoint_busy_ms = max(0, int(checkpoint_busy_ms))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._last_writes: Optional[Tuple[float, int]] = None
+        self._last_optimize = time.monotonic()
+        self._metrics: Dict = {}
+        self._stats = {
+            "runs": 0,
+            "checkpoints": {
+                mode: {"count": 0, "last_ms": 0.0, "max_ms": 0.0, "total_ms": 0.0, "last_result": None}
+                for mode in ("passive", "truncate")
+            },
+            "optimize": {"count": 0, "last_ms": 0.0, "last_at": None},
+            "vacuum": {"count": 0, "pages_reclaimed": 0, "last_ms": 0.0},
+            "last_run_at": None,
+            "last_error": None,
+        }
+
+    def start(self) -> bool:
+        if self.is_running():
+            return True
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="db-maintenance", daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self, timeout: float = 10) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            stats = copy.deepcopy(self._stats)
+            storage = dict(self._metrics)
+        stats.update(running=self.is_running(), interval=self.interval, storage=storage)
+        return stats
+
+    def metrics(self) -> Dict:
+        """即时读取存储指标"""
+        metrics = self.pool.read(lambda conn: storage_metrics(conn, self.pool.db_path))
+        with self._lock:
+            self._metrics = metrics
+        return metrics
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._stats["last_error"] = str(e)
+                logger.error(f"数据库维护失败: {e}")
+
+    def _is_idle(self) -> bool:
+        """按上个周期的写连接借出速率判断负载；首次调用视为非空闲"""
+        now, writes = time.monotonic(), self.pool.stats()["write_checkouts"]
+        last, self._last_writes = self._last_writes, (now, writes)
+        if last is None or now <= last[0]:
+            return False
+        return (writes - last[1]) / (now - last[0]) < self.idle_writes_per_sec
+
+    def run_once(self, force: bool = False) -> Dict:
+        """执行一轮维护；force 时忽略负载与阈值（管理命令使用），返回维护后的存储指标"""
+        idle = self._is_idle() or force
+        metrics = self.metrics()
+        wal = metrics["wal_bytes"]
+        if force or (idle and self.truncate_bytes and wal >= self.truncate_bytes):
+            self.checkpoint("truncate")
+        elif wal >= self.passive_bytes:
+            self.checkpoint("passive")
+        if idle and (force or time.monotonic() - self._last_optimize >= self.optimize_interval):
+            self.optimize()
+        if idle and metrics["auto_vacuum"] == "incremental" and (
+            metrics["freelist_pages"] > (0 if force else self.vacuum_min_free)
+        ):
+            self.incremental_vacuum(metrics["freelist_pages"] if force else self.vacuum_pages)
+        with self._lock:
+            self._stats["runs"] += 1
+            self._stats["last_run_at"] = datetime.now().isoformat()
+        # 本轮自身的写连接借出不计入下一轮的负载判断
+        self._last_writes = (time.monotonic(), self.pool.stats()["write_checkouts"])
+        return self.metrics()
+
+    def checkpoint(self, mode: str = "passive") -> Tuple[int, int, int]:
+        """执行 WAL 检查点，返回 (是否被阻塞, WAL 帧数, 已回写帧数)"""
+        def run(conn: sqlite3.Connection) -> Tuple[int, int, int]:
+            if mode != "truncate":
+                return tuple(conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone())
+            # TRUNCATE 需等待读者结束；缩短忙等待，避免长时间占住写连接
+            conn.execute(f"PRAGMA busy_timeout={self.checkpoint_busy_ms}")
+            try:
+                return tuple(conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone())
+            finally:
+                conn.execute(f"PRAGMA busy_timeout={int(self.pool.timeout*1000)}")
+
+        started = time.monotonic()
+        result = self.pool.write(run)
+        elapsed = (time.monotonic() - started) * 1000
+        with self._lock:
+            stats = self._stats["checkpoints"][mode]
+            stats["count"] += 1
+            stats["last_ms"] = round(elapsed, 3)
+            stats["max_ms"] = max(stats["max_ms"], stats["last_ms"])
+            stats["total_ms"] = round(stats["total_ms"] + elapsed, 3)
+            stats["last_result"] = {"busy": result[0], "wal_frames": result[1], "checkpointed": result[2]}
+        return result
+
+    def optimize(self) -> None:
+        """PRAGMA optimize：只对统计信息过期的表重新 ANALYZE，analysis_limit 限制每个索引的采样行数"""
+        def run(conn: sqlite3.Connection) -> None:
+            conn.execute(f"PRAGMA analysis_limit={self.analysis_limit}")
+            conn.execute("PRAGMA optimize")
+
+        started = time.monotonic()
+        self.pool.write(run)
+        self._last_optimize = time.monotonic()
+        with self._lock:
+            stats = self._stats["optimize"]
+            stats["count"] += 1
+            stats["last_ms"] = round((self._last_optimize - started) * 1000, 3)
+            stats["last_at"] = datetime.now().isoformat()
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """回收最多 pages 个空闲页，返回实际回收的页数"""
+        def run(conn: sqlite3.Connection) -> int:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute 只推进一步（一页），executescript 才会把 PRAGMA 执行完
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+            return before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+        started = time.monotonic()
+        reclaimed = self.pool.write(run)
+        with self._lock:
+            stats = self._stats["vacuum"]
+            stats["count"] += 1
+            stats["pages_reclaimed"] += reclaimed
+            stats["last_ms"] = round((time.monotonic() - started) * 1000, 3)
+        return reclaimed
+
+
+def create_shard_schema(cur: sqlite3.Cursor, index: int, spatial: bool, text_time: bool = False) -> bool:
+    """分片库的表结构：位置表及其索引与触发器，以及本分片自己的统计、最新位置、搜索与汇总表。
+
+    返回空间索引是否可用。
+    """
+    cur.execute(META_TABLE_SQL)
+    cur.execute(POSITION_TABLE_SQL.format(table="box_positions", autoincrement=" AUTOINCREMENT"))
+    for sql in position_index_sql("box_positions", text_time=text_time):
+        cur.execute(sql)
+    for sql in STATS_TABLES_SQL:
+        cur.execute(sql)
+    cur.execute(
+        "INSERT OR IGNORE INTO stats_counters (name, value) VALUES ('total_detections', 0), ('unique_barcodes', 0)"
+    )
+    cur.execute(LATEST_TABLE_SQL)
+    create_barcode_search(cur)
+    for level in ROLLUP_LEVELS:
+        cur.execute(ROLLUP_TABLE_SQL.format(level=level))
+    spatial = spatial and create_spatial_index(cur, "box_positions")
+    install_position_triggers(cur, "box_positions", spatial=spatial)
+    cur.execute(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'box_positions', ? "
+        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'box_positions')",
+        (((index + 1) << SHARD_ID_BITS) - 1,),
+    )
+    return spatial
+
 
 class DatabaseManager:
     def __init__(self) -> None:
@@ -21,325 +1803,1840 @@ class DatabaseManager:
         _db_cfg = getattr(config, "DB_CONFIG", {}) or {}
         self.db_path = _db_cfg.get("path", "drone_positioning.db")
         self.timeout = _db_cfg.get("timeout", 30)
-        self.check_same_thread = _db_cfg.get("check_same_thread", False)
-        self._local = threading.local()
+        pool_options = dict(
+            timeout=self.timeout,
+            cached_statements=_db_cfg.get("statement_cache_size", 256),
+            checkout_timeout=_db_cfg.get("pool_checkout_timeout", 10),
+            busy_retries=_db_cfg.get("busy_retries", 3),
+            auto_vacuum=_db_cfg.get("auto_vacuum", "incremental"),
+        )
+        self.pool = ConnectionPool(
+            self.db_path,
+            read_pool_size=_db_cfg.get("read_pool_size", 4),
+            on_open=self._attach_shards,
+            **pool_options,
+        )
+        # 按 drone_id 哈希分片存储位置数据；分片库只承担写入，读取经主库读连接附加后完成
+        self.shard_count = max(0, min(int(_db_cfg.get("shards", 0) or 0), SHARD_MAX))
+        self.shard_pool_options = dict(pool_options, read_pool_size=1)
+        self.shards: Optional[ShardSet] = None
+        self.maintenance = MaintenanceScheduler(
+            self.pool,
+            interval=_db_cfg.get("maintenance_interval", 60),
+            passive_bytes=int(_db_cfg.get("wal_checkpoint_passive_mb", 4) * 1024 * 1024),
+            truncate_bytes=int(_db_cfg.get("wal_checkpoint_truncate_mb", 64) * 1024 * 1024),
+            idle_writes_per_sec=_db_cfg.get("maintenance_idle_writes_per_sec", 5),
+            optimize_interval=_db_cfg.get("optimize_interval", 3600),
+            analysis_limit=_db_cfg.get("analysis_limit", 1000),
+            vacuum_pages=_db_cfg.get("incremental_vacuum_pages", 256),
+            vacuum_min_free=_db_cfg.get("incremental_vacuum_min_free_pages", 1024),
+        )
+        self._writer: Optional[GroupCommitWriter] = None
+        # positions / drones 两类数据的版本号，供接口响应缓存失效；
+        # position_edits 只在删除、更新等非追加修改时递增，热层据此决定增量追加还是重新加载
+        self.versions = DataVersions()
+        self.drones = DroneRegistry(
+            self.pool,
+            flush_interval=_db_cfg.get("drone_flush_interval", 5),
+            tracks=TrackSimplifier(
+                tolerance_m=_db_cfg.get("track_tolerance_m", 5.0),
+                max_interval=_db_cfg.get("track_max_interval", 300),
+                max_window=_db_cfg.get("track_max_window", 500),
+            ),
+        )
+        # 毫秒时间列回填完成前，时间范围查询仍走原来的 ISO 字符串列
+        self.epoch_ready = False
+        self.backfill = EpochBackfill(
+            self.pool,
+            self._epoch_targets,
+            chunk_size=_db_cfg.get("epoch_backfill_chunk_size", 2000),
+            pause=_db_cfg.get("epoch_backfill_pause", 0.05),
+            on_complete=self._on_epoch_ready,
+        )
+        self.bulk_jobs = BulkJobRunner(
+            self.pool,
+            pause=_db_cfg.get("bulk_chunk_pause", 0.02),
+            on_chunk=lambda: self.versions.bump("positions", "position_edits"),
+        )
+        self.bulk_chunk_size = max(1, min(int(_db_cfg.get("bulk_chunk_size", 500)), 900))
+        self.system_logs = SystemLogSink(
+            self.pool,
+            queue_size=_db_cfg.get("system_log_queue_size", 10000),
+            batch_size=_db_cfg.get("system_log_batch_size", 500),
+            flush_interval=_db_cfg.get("system_log_flush_interval", 2),
+        )
+        self.spatial_enabled = False
+        self.search_enabled = False
+        period = str(_db_cfg.get("partitioning") or "none").lower()
+        if self.shard_count and period in ("day", "week"):
+            logger.warning("分片模式不与分区同时使用，忽略 partitioning 配置")
+            period = "none"
+        self.partitions: Optional[PositionPartitions] = (
+            PositionPartitions(period) if period in ("day", "week") else None
+        )
+        # 在线快照；开启 snapshot_replica 时最新快照同时作为报表查询的只读副本
+        self.snapshots = SnapshotManager(
+            self.pool,
+            directory=_db_cfg.get("snapshot_dir")
+            or os.path.join(os.path.dirname(os.path.abspath(self.db_path)), "snapshots"),
+            step_pages=_db_cfg.get("snapshot_step_pages", 256),
+            pause=_db_cfg.get("snapshot_step_pause", 0.01),
+            keep=_db_cfg.get("snapshot_keep", 3),
+            on_complete=self._on_snapshot,
+        )
+        self.replica_enabled = bool(_db_cfg.get("snapshot_replica", True))
+        self.replica_pool_size = _db_cfg.get("replica_pool_size", 2)
+        self.replica: Optional[ConnectionPool] = None
+        self.replica_epoch_ready = False
+        # 条码分析概要（HyperLogLog 去重计数 + Space-Saving 高频条码），定期检查点到 SQLite
+        self.analytics: Optional[BarcodeAnalytics] = None
+        if _db_cfg.get("analytics", True):
+            self.analytics = BarcodeAnalytics(
+                self.pool,
+                max_id=self._max_position_id,
+                precision=_db_cfg.get("analytics_hll_precision", 12),
+                topk_capacity=_db_cfg.get("analytics_topk_capacity", 1000),
+                retention_days=_db_cfg.get("analytics_retention_days", 90),
+                checkpoint_interval=_db_cfg.get("analytics_checkpoint_interval", 60),
+            )
+        # 最近数据的内存热层；需要 numpy，且在毫秒时间列就绪后才参与查询
+        self.hot: Optional[HotTier] = None
+        if _db_cfg.get("hot_tier", True) and hot_tier_available():
+            self.hot = HotTier(
+                self.pool,
+                self.versions,
+                max_id=self._max_position_id,
+                ready=lambda: self.epoch_ready,
+                window=_db_cfg.get("hot_tier_window", 6 * 3600),
+                max_rows=_db_cfg.get("hot_tier_max_rows", 500000),
+                reload_interval=_db_cfg.get("hot_tier_reload_interval", 1.0),
+            )
+
+    def connect(self) -> bool:
+        try:
+            self.pool.read(lambda conn: conn.execute("SELECT 1").fetchone())
+            logger.info(f"SQLite数据库连接成功: {self.db_path}")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"数据库连接失败: {e}")
+            return False
+
+    def disconnect(self) -> None:
+        self.pool.close()
+        if self.shards is not None:
+            self.shards.close()
+        if self.replica is not None:
+            self.replica.close()
+        logger.info("数据库连接已断开")
+
+    def get_pool_stats(self) -> Dict:
+        return self.pool.stats()
+
+    def create_tables(self) -> bool:
+        try:
+            with self.pool.writer() as conn:
+                latest_seeded, seeded, rollups_seeded = self._create_schema(conn)
+                self._setup_shards(conn)
+            # 首次启用增量统计时，从已有数据初始化计数
+            if not seeded and not self.rebuild_statistics():
+                return False
+            if not latest_seeded and not self.rebuild_box_latest():
+                return False
+            if not rollups_seeded and not self.rebuild_rollups():
+                return False
+            self.pool.read(self.drones.load)
+            self.epoch_ready = self.pool.read(lambda conn: get_meta(conn, EPOCH_READY_KEY)) == "1"
+            # 上次快速导入没有完成收尾：恢复索引与触发器并重算派生数据
+            if self.bulk_load_pending():
+                logger.warning("检测到未完成的批量导入，恢复索引并重建派生数据")
+                if not self.finish_bulk_load():
+                    return False
+            logger.info("SQLite数据库表创建成功")
+            return True
+        except ValueError as e:
+            logger.error(f"数据库配置无效: {e}")
+            return False
+        except sqlite3.Error as e:
+            logger.error(f"创建数据库表失败: {e}")
+            return False
+
+    def _create_schema(self, conn: sqlite3.Connection) -> Tuple[bool, bool, bool]:
+        """建表、索引与触发器；返回 (box_latest 是否已存在, 统计计数是否已初始化, 汇总表是否已存在)"""
+        cur = conn.cursor()
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS drone_status (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                drone_id TEXT NOT NULL UNIQUE,
+                status TEXT NOT NULL DEFAULT 'offline',
+                last_heartbeat TEXT,
+                gps_latitude REAL,
+                gps_longitude REAL,
+                gps_altitude REAL,
+                battery_level INTEGER,
+                signal_strength INTEGER,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS system_logs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+                level TEXT NOT NULL,
+                source TEXT,
+                message TEXT,
+                data TEXT
+            )
+            """
+        )
+
+        cur.execute(TRACK_TABLE_SQL)
+        cur.execute(META_TABLE_SQL)
+        # 毫秒时间列：新写入直接填充，已有记录由 EpochBackfill 回填
+        add_column_if_missing(cur, "drone_status", "last_heartbeat_ms", "INTEGER")
+        add_column_if_missing(cur, "system_logs", "ts_ms", "INTEGER")
+
+        # 索引
+        for sql in [
+            # 新的复合索引前缀已覆盖旧的单列索引
+            "DROP INDEX IF EXISTS idx_box_drone_id",
+            "DROP INDEX IF EXISTS idx_box_timestamp",
+            "CREATE INDEX IF NOT EXISTS idx_drone_id ON drone_status(drone_id)",
+            "CREATE INDEX IF NOT EXISTS idx_drone_status ON drone_status(status)",
+            "CREATE INDEX IF NOT EXISTS idx_drone_heartbeat_ms ON drone_status(last_heartbeat_ms)",
+            "CREATE INDEX IF NOT EXISTS idx_track_drone_ms ON drone_tracks(drone_id, ts_ms)",
+            "CREATE INDEX IF NOT EXISTS idx_log_ts_ms ON system_logs(ts_ms)",
+        ]:
+            cur.execute(sql)
+
+        for sql in STATS_TABLES_SQL:
+            cur.execute(sql)
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'box_latest'")
+        latest_seeded = cur.fetchone() is not None
+        cur.execute(LATEST_TABLE_SQL)
+        self.search_enabled = create_barcode_search(cur)
+        cur.execute("SELECT 1 FROM sqlite_master WHERE name = 'rollup_1m'")
+        rollups_seeded = cur.fetchone() is not None
+        for level in ROLLUP_LEVELS:
+            cur.execute(ROLLUP_TABLE_SQL.format(level=level))
+        self._create_position_tables(cur)
+
+        conn.commit()
+        cur.execute("SELECT 1 FROM stats_counters WHERE name = 'total_detections'")
+        seeded = cur.fetchone() is not None
+        cur.close()
+        return latest_seeded, seeded, rollups_seeded
+
+    def _create_position_tables(self, cur: sqlite3.Cursor) -> None:
+        cur.execute("SELECT type FROM sqlite_master WHERE name = 'box_positions'")
+        row = cur.fetchone()
+        if self.partitions is None and row is not None and row[0] == "view":
+            # 已是分区布局的数据库不能退回单表，沿用原布局
+            logger.warning("数据库已使用分区布局，忽略 partitioning=none 配置，按天分区继续运行")
+            self.partitions = PositionPartitions("day")
+
+        if self.partitions is None:
+            cur.execute(POSITION_TABLE_SQL.format(table="box_positions", autoincrement=" AUTOINCREMENT"))
+            add_column_if_missing(cur, "box_positions", "ts_ms", "INTEGER")
+            for sql in position_index_sql("box_positions", text_time=not self._epoch_ready_in(cur.connection)):
+                cur.execute(sql)
+            self.spatial_enabled = create_spatial_index(cur, "box_positions")
+            install_position_triggers(cur, "box_positions", spatial=self.spatial_enabled)
+            return
+
+        self.spatial_enabled = self._rtree_available(cur)
+        self.partitions.spatial = self.spatial_enabled
+        self.partitions.text_time = not self._epoch_ready_in(cur.connection)
+        self.partitions.setup(cur)
+        logger.info(f"位置数据按{'天' if self.partitions.period == 'day' else '周'}分区存储")
+
+    @staticmethod
+    def _rtree_available(cur: sqlite3.Cursor) -> bool:
+        try:
+            cur.execute("CREATE VIRTUAL TABLE temp.rtree_probe USING rtree(id, a, b)")
+            cur.execute("DROP TABLE temp.rtree_probe")
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite 不支持 R*Tree，空间查询将退化为全表过滤: {e}")
+            return False
+
+    def _setup_shards(self, conn: sqlite3.Connection) -> None:
+        """确定分片数并建立各分片库；已分片的库沿用记录的分片数，否则无人机会被路由到别的分片。
+
+        分片模式不支持内存热层、条码分析与只读副本，配置中仍启用时抛出 ValueError。
+        """
+        stored = int(get_meta(conn, SHARDS_KEY) or 0)
+        if stored and stored != self.shard_count:
+            logger.warning(f"数据库已按 {stored} 个分片存储，忽略 shards={self.shard_count} 配置")
+        count = stored or self.shard_count
+        if not count:
+            return
+        if self.partitions is not None:
+            logger.warning("数据库已使用分区布局，不能再按无人机分片，忽略 shards 配置")
+            return
+        # 热层与条码分析按单调递增的位置 id 追赶新数据，分片后 id 不再全局有序；快照只复制主库
+        enabled = [
+            option for option, on in (
+                ("DB_HOT_TIER", self.hot is not None),
+                ("DB_ANALYTICS", self.analytics is not None),
+                ("DB_SNAPSHOT_REPLICA", self.replica_enabled),
+            ) if on
+        ]
+        if enabled:
+            raise ValueError(
+                f"数据库按 {count} 个分片存储，不支持内存热层、条码分析与只读副本，"
+                f"请设置 {'、'.join(f'{name}=false' for name in enabled)}"
+            )
+        if not stored:
+            set_meta(conn, SHARDS_KEY, count)
+            conn.commit()
+        if self.shards is None:
+            self.shards = ShardSet(self.db_path, count, self.shard_pool_options, POSITION_COLUMNS)
+        spatial, text_time = self.spatial_enabled, not self._epoch_ready_in(conn)
+        self.spatial_enabled = self.shards.setup(
+            lambda cur, index: create_shard_schema(cur, index, spatial, text_time)
+        )
+        # 已打开的读连接没有附加分片，关闭后按需重新打开
+        self.pool.close()
+        logger.info(f"位置数据按 drone_id 分为 {count} 个分片存储")
+
+    def _attach_shards(self, conn: sqlite3.Connection) -> None:
+        if self.shards is not None:
+            self.shards.attach(conn)
+
+    def position_pools(self) -> List[ConnectionPool]:
+        """保存位置数据的各个库：主库，分片模式下另有各分片"""
+        return [self.pool] + (self.shards.pools if self.shards is not None else [])
+
+    def _schemas(self, drone_id: Optional[str] = None) -> List[str]:
+        """读连接上保存位置数据的库名"""
+        return self.shards.schemas(drone_id) if self.shards is not None else ["main"]
+
+    def _target(self, drone_id) -> Tuple[ConnectionPool, Optional[GroupCommitWriter]]:
+        """写入位置数据的连接池与组提交写入器：分片模式下按 drone_id 路由"""
+        if self.shards is None:
+            return self.pool, self._writer
+        index = self.shards.route(drone_id)
+        return self.shards.pools[index], self.shards.writers[index]
+
+    def _store_routed(
+        self,
+        rows: List[tuple],
+        store: Callable[[ConnectionPool, Optional[GroupCommitWriter], List[tuple]], List[Optional[sqlite3.Error]]],
+    ) -> List[Optional[sqlite3.Error]]:
+        """按 drone_id 把记录分到各分片并行写入，返回与 rows 对齐的逐条错误"""
+        if self.shards is None:
+            return store(self.pool, self._writer, rows)
+        shards = self.shards
+        groups: Dict[int, List[int]] = {}
+        for k, values in enumerate(rows):
+            groups.setdefault(shards.route(values[1]), []).append(k)
+        results = shards.run_each(
+            groups, lambda i, idx: store(shards.pools[i], shards.writers[i], [rows[k] for k in idx])
+        )
+        errors: List[Optional[sqlite3.Error]] = [None] * len(rows)
+        for i, idx in groups.items():
+            for k, error in zip(idx, results[i]):
+                errors[k] = error
+        return errors
+
+    def _pools_for_ids(self, ids: List[int]) -> List[Tuple[ConnectionPool, List[int]]]:
+        """按记录所在的库给 id 分组（分片模式下 id 高位即分片号）"""
+        if self.shards is None:
+            return [(self.pool, ids)]
+        groups: Dict[int, List[int]] = {}
+        for pid in ids:
+            index = self.shards.index_of_id(pid)
+            groups.setdefault(-1 if index is None else index, []).append(pid)
+        return [(self.pool if i < 0 else self.shards.pools[i], group) for i, group in sorted(groups.items())]
+
+    def get_shard_stats(self) -> Dict:
+        if self.shards is None:
+            return {"enabled": False}
+        return self.shards.stats()
+
+    def _prepare_rows(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        if self.partitions is not None:
+            self.partitions.ensure(conn, rows)
+
+    def list_partitions(self) -> List[Dict]:
+        """分区列表（非分区模式返回空列表）"""
+        if self.partitions is None:
+            return []
+        try:
+            with self.pool.reader() as conn:
+                cur = conn.cursor()
+                parts = self.partitions.list(cur)
+                cur.close()
+            return parts
+        except sqlite3.Error as e:
+            logger.error(f"获取分区列表失败: {e}")
+            return []
+
+    def _max_position_id(self, conn: sqlite3.Connection) -> int:
+        """已分配的最大位置 id；分区模式读 box_sequence，避免在视图上聚合"""
+        if self.partitions is None:
+            row = conn.execute("SELECT MAX(id) FROM box_positions").fetchone()
+        else:
+            row = conn.execute("SELECT value FROM box_sequence WHERE name = 'box_positions'").fetchone()
+        return int(row[0] or 0) if row else 0
+
+    def get_hot_tier_stats(self) -> Dict:
+        if self.hot is None:
+            return {"enabled": False}
+        return self.hot.stats()
+
+    def insert_box_position(self, data: Dict) -> bool:
+        # 启用组提交时交给后台写入器，等待其事务提交后再返回结果
+        pool, writer = self._target(data.get("drone_id"))
+        if writer is not None and writer.is_running():
+            try:
+                ok = bool(writer.submit(self._position_values(data)).result(writer.wait_timeout))
+            except Exception as e:
+                logger.error(f"插入物体箱位置数据失败: {e}")
+                return False
+            self.versions.bump("positions")
+            return ok
+        try:
+            with pool.writer() as conn:
+                rows = [self._position_values(data)]
+                errors = insert_position_rows(conn, rows, prepare=self._prepare_rows)
+                self._on_rows_stored(rows, errors)
+            error = errors[0]
+            if error is not None:
+                raise error
+            self.versions.bump("positions")
+            logger.debug(f"物体箱位置数据插入成功: {data.get('barcode_data')}")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"插入物体箱位置数据失败: {e}")
+            return False
+
+    def submit_box_position(self, data: Dict) -> Future:
+        """异步提交一条位置数据，返回 Future（结果为 True 或写入异常）。
+
+        未启用组提交时同步写入并返回已完成的 Future，调用方无需区分两种模式。
+        """
+        _, writer = self._target(data.get("drone_id"))
+        if writer is not None and writer.is_running():
+            fut = writer.submit(self._position_values(data))
+            fut.add_done_callback(self._bump_if_stored)
+            return fut
+        fut = Future()
+        fut.set_result(self.insert_box_position(data))
+        return fut
+
+    def _bump_if_stored(self, fut: Future) -> None:
+        if not fut.cancelled() and fut.exception() is None:
+            self.versions.bump("positions")
+
+    def insert_box_positions(self, items: List[Dict]) -> List[Optional[str]]:
+        """在单个事务内批量写入位置数据，返回与 items 对齐的逐条错误信息（None 表示成功）"""
+        errors: List[Optional[str]] = [None] * len(items)
+        rows: List[tuple] = []
+        index: List[int] = []
+        for i, data in enumerate(items):
+            try:
+                rows.append(self._position_values(data))
+                index.append(i)
+            except (KeyError, TypeError, AttributeError) as e:
+                errors[i] = f"数据格式错误: {e}"
+        if not rows:
+            return errors
+
+        def store(
+            pool: ConnectionPool, writer: Optional[GroupCommitWriter], part: List[tuple]
+        ) -> List[Optional[sqlite3.Error]]:
+            if writer is not None and writer.is_running():
+                return writer.submit_many(part).result(writer.wait_timeout)
+            with pool.writer() as conn:
+                part_errors = insert_position_rows(conn, part, prepare=self._prepare_rows)
+                self._on_rows_stored(part, part_errors)
+            return part_errors
+
+        try:
+            row_errors = self._store_routed(rows, store)
+        except Exception as e:
+            logger.error(f"批量插入物体箱位置数据失败: {e}")
+            row_errors = [e] * len(rows)
+
+        for i, err in zip(index, row_errors):
+            if err is not None:
+                errors[i] = str(err)
+        failed = sum(1 for e in errors if e)
+        if failed < len(items):
+            self.versions.bump("positions")
+        logger.debug(f"批量插入物体箱位置数据: 成功 {len(items) - failed} 条, 失败 {failed} 条")
+        return errors
+
+    def _on_rows_stored(self, rows: List[tuple], errors: List[Optional[sqlite3.Error]]) -> None:
+        """写入提交后、归还写连接前调用：把成功的记录计入条码分析概要"""
+        if self.analytics is not None:
+            self.analytics.add_many(
+                (detection_day(values[13], values[0]), values[1], values[2])
+                for values, error in zip(rows, errors) if error is None
+            )
+
+    @staticmethod
+    def _position_values(data: Dict) -> tuple:
+        gps = data.get("gps") or {}
+        lat = gps.get("latitude") if isinstance(gps, dict) else None
+        lon = gps.get("longitude") if isinstance(gps, dict) else None
+        alt = gps.get("altitude") if isinstance(gps, dict) else None
+        return (
+            data["timestamp"],
+            data["drone_id"],
+            data["barcode_data"],
+            data.get("barcode_type"),
+            lat,
+            lon,
+            alt,
+            data.get("confidence"),
+            data.get("bbox_x1"),
+            data.get("bbox_y1"),
+            data.get("bbox_x2"),
+            data.get("bbox_y2"),
+            datetime.now().isoformat(),
+            to_epoch_ms(data["timestamp"]),
+        )
+
+    # ----- 组提交写入器 -----
+    def start_ingest_writer(self) -> bool:
+        """启动后台组提交写入器（幂等）；分片模式下每个分片一个"""
+        _db_cfg = getattr(config, "DB_CONFIG", {}) or {}
+
+        def create(pool: ConnectionPool) -> GroupCommitWriter:
+            return GroupCommitWriter(
+                pool,
+                insert=lambda conn, rows: insert_position_rows(conn, rows, prepare=self._prepare_rows),
+                batch_size=_db_cfg.get("group_commit_batch_size", 256),
+                max_delay=_db_cfg.get("group_commit_max_delay_ms", 5) / 1000.0,
+                queue_size=_db_cfg.get("group_commit_queue_size", 10000),
+                wait_timeout=_db_cfg.get("group_commit_wait_timeout", 10),
+                on_stored=self._on_rows_stored,
+            )
+
+        if self.shards is not None:
+            return self.shards.start_writers(create)
+        if self._writer is not None and self._writer.is_running():
+            return True
+        self._writer = create(self.pool)
+        return self._writer.start()
+
+    def stop_ingest_writer(self) -> None:
+        """停止写入器，队列中剩余数据会先提交"""
+        if self.shards is not None:
+            self.shards.stop_writers()
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
+    def get_ingest_writer_stats(self) -> Dict:
+        if self.shards is not None:
+            writers = [w for w in self.shards.writers if w is not None]
+            if not writers:
+                return {"enabled": False}
+            stats = [w.stats() for w in writers]
+            totals = {k: sum(st[k] for st in stats) for k in ("batches", "rows", "failed_rows", "queue_size")}
+            return dict(
+                totals,
+                max_batch=max(st["max_batch"] for st in stats),
+                enabled=all(w.is_running() for w in writers),
+                shards=len(writers),
+            )
+        if self._writer is None:
+            return {"enabled": False}
+        return dict(self._writer.stats(), enabled=self._writer.is_running())
+
+    # ----- 条码分析 -----
+    def start_analytics(self) -> bool:
+        """从检查点恢复概要，后台补计检查点之后的记录并定期写检查点"""
+        if self.analytics is None:
+            return False
+        try:
+            return self.analytics.start()
+        except sqlite3.Error as e:
+            logger.error(f"启动条码分析失败: {e}")
+            return False
+
+    def stop_analytics(self) -> None:
+        """停止后台线程并写入最后一次检查点"""
+        if self.analytics is not None:
+            self.analytics.stop()
+
+    def get_analytics_stats(self) -> Dict:
+        if self.analytics is None:
+            return {"enabled": False}
+        return dict(self.analytics.stats(), enabled=True)
+
+    def get_distinct_barcodes(self, start: Optional[str] = None, end: Optional[str] = None) -> Optional[Dict]:
+        """日期区间内不同条码数的估计；未启用分析时返回 None，日期无效时抛出 ValueError"""
+        if self.analytics is None:
+            return None
+        return self.analytics.distinct_barcodes(start, end)
+
+    def get_distinct_barcodes_by_drone(self, drone_id: Optional[str] = None) -> Optional[Dict]:
+        if self.analytics is None:
+            return None
+        return self.analytics.distinct_by_drone(drone_id)
+
+    def get_top_barcodes(self, k: int = 20) -> Optional[Dict]:
+        if self.analytics is None:
+            return None
+        return self.analytics.top_barcodes(k)
+
+    def rebuild_analytics(self, wait: bool = False) -> bool:
+        """清空概要并从现有位置数据重新统计；wait 时在当前线程补计完成并写检查点（管理命令使用）"""
+        if self.analytics is None:
+            return False
+        try:
+            self.analytics.rebuild()
+            if wait:
+                self.analytics.replay()
+                self.analytics.checkpoint()
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"重建条码分析失败: {e}")
+            return False
+
+    # ----- 数据库维护 -----
+    def start_maintenance(self) -> bool:
+        """启动后台检查点 / 统计刷新 / 增量回收调度"""
+        return self.maintenance.start()
+
+    def stop_maintenance(self) -> None:
+        self.maintenance.stop()
+
+    def get_maintenance_stats(self) -> Dict:
+        try:
+            self.maintenance.metrics()
+        except sqlite3.Error as e:
+            logger.error(f"读取存储指标失败: {e}")
+        return self.maintenance.stats()
+
+    def run_maintenance(self) -> Optional[Dict]:
+        """立即执行一轮完整维护（TRUNCATE 检查点、optimize、回收全部空闲页），返回存储指标"""
+        try:
+            return self.maintenance.run_once(force=True)
+        except sqlite3.Error as e:
+            logger.error(f"数据库维护失败: {e}")
+            return None
+
+    def vacuum(self) -> bool:
+        """整库 VACUUM，并把 auto_vacuum 转为连接池配置的模式（已有库启用增量回收需执行一次）"""
+        def run(conn: sqlite3.Connection) -> None:
+            if self.pool.auto_vacuum:
+                conn.execute(f"PRAGMA auto_vacuum={self.pool.auto_vacuum}")
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        try:
+            started = time.monotonic()
+            self.pool.write(run)
+            logger.info(f"VACUUM 完成，用时 {time.monotonic() - started:.1f}s")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"VACUUM 失败: {e}")
+            return False
+
+    # ----- 批量导入 -----
+    def _position_tables(self, conn: sqlite3.Connection) -> List[str]:
+        """实际存放位置数据的表（分区模式下为全部分区表）"""
+        if self.partitions is None:
+            return ["box_positions"]
+        return [r[0] for r in conn.execute("SELECT name FROM box_partitions")]
+
+    def _strip_position_tables(self, conn: sqlite3.Connection, tables: List[str]) -> None:
+        """去掉位置表上的派生数据触发器与二级索引，索引定义追加记入 db_meta（在调用方事务内）"""
+        saved = json.loads(get_meta(conn, BULK_LOAD_KEY) or "[]")
+        for table in tables:
+            for name, sql in conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,),
+            ).fetchall():
+                saved.append([table, sql])
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+            for name in list(POSITION_TRIGGERS) + list(SPATIAL_TRIGGERS):
+                conn.execute(f"DROP TRIGGER IF EXISTS trg_{table}_{name}")
+        set_meta(conn, BULK_LOAD_KEY, json.dumps(saved))
+
+    def _bulk_prepare(self, conn: sqlite3.Connection, rows: List[tuple]) -> None:
+        """快速导入的写入准备：按需创建分区后，同样去掉新分区上的触发器与索引"""
+        self._prepare_rows(conn, rows)
+        if self.partitions is None:
+            return
+        tables = self._position_tables(conn)
+        marks = ",".join("?" * len(tables))
+        armed = [r[0][len("trg_"):-len("_stats_ins")] for r in conn.execute(
+            f"SELECT name FROM sqlite_master WHERE type = 'trigger' AND name IN ({marks})",
+            [f"trg_{t}_stats_ins" for t in tables],
+        )]
+        if armed:
+            self._strip_position_tables(conn, armed)
 
-    def _get_connection(self) -> sqlite3.Connection:
-        if not hasattr(self._local, "connection") or self._local.connection is None:
-            conn = sqlite3.connect(
-                self.db_path, timeout=self.timeout, check_same_thread=self.check_same_thread
-            )
-            conn.row_factory = sqlite3.Row
-            # 提升稳定性：启用 WAL、外键，设置 busy_timeout
-            try:
-                conn.execute("PRAGMA journal_mode=WAL")
-            except Exception:
-                pass
-            try:
-                conn.execute("PRAGMA foreign_keys=ON")
-            except Exception:
-                pass
-            try:
-                conn.execute(f"PRAGMA busy_timeout={int(self.timeout*1000)}")
-            except Exception:
-                pass
-            self._local.connection = conn
-        return self._local.connection  # type: ignore[return-value]
+    def begin_bulk_load(self) -> bool:
+        """快速导入前去掉位置表的派生数据触发器与二级索引；须与 finish_bulk_load 成对调用。
+
+        中途退出时索引定义仍在 db_meta 中，下次 create_tables 会自动恢复并重建派生数据。
+        """
+        def run(conn: sqlite3.Connection) -> None:
+            conn.execute("BEGIN IMMEDIATE")
+            self._strip_position_tables(conn, self._position_tables(conn))
+            conn.commit()
 
-    def connect(self) -> bool:
         try:
-            conn = self._get_connection()
-            conn.execute("SELECT 1")
-            logger.info(f"SQLite数据库连接成功: {self.db_path}")
+            for pool in self.position_pools():
+                pool.write(run)
             return True
         except sqlite3.Error as e:
-            logger.error(f"数据库连接失败: {e}")
+            logger.error(f"准备批量导入失败: {e}")
             return False
 
-    def disconnect(self) -> None:
-        if hasattr(self._local, "connection") and self._local.connection:
-            try:
-                self._local.connection.close()
-            except Exception:
-                pass
-            self._local.connection = None
-            logger.info("数据库连接已断开")
+    def insert_position_batch(self, rows: List[tuple], fast: bool = False) -> List[Optional[sqlite3.Error]]:
+        """在一个事务内写入已转换好的记录（列顺序同 POSITION_INSERT_SQL），返回逐条错误；
+        分片模式下每个分片一个事务，各分片并行写入"""
+        def store(pool: ConnectionPool, _writer, part: List[tuple]) -> List[Optional[sqlite3.Error]]:
+            with pool.writer() as conn:
+                part_errors = insert_position_rows(
+                    conn, part, prepare=self._bulk_prepare if fast else self._prepare_rows
+                )
+                self._on_rows_stored(part, part_errors)
+            return part_errors
 
-    def create_tables(self) -> bool:
-        try:
-            conn = self._get_connection()
+        errors = self._store_routed(rows, store)
+        self.versions.bump("positions", "position_edits")
+        return errors
+
+    def finish_bulk_load(self) -> bool:
+        """快速导入后恢复索引与触发器，重建空间索引，并全量重算统计、最新位置与时间序列汇总"""
+        def restore(conn: sqlite3.Connection) -> int:
+            conn.execute("BEGIN IMMEDIATE")
+            tables = self._position_tables(conn)
+            saved = json.loads(get_meta(conn, BULK_LOAD_KEY) or "[]")
+            for table, sql in saved:
+                if table in tables:
+                    conn.execute(re.sub(
+                        r"^CREATE (UNIQUE )?INDEX (?!IF NOT EXISTS)", r"CREATE \1INDEX IF NOT EXISTS ", sql
+                    ))
             cur = conn.cursor()
+            for table in tables:
+                install_position_triggers(cur, table, spatial=self.spatial_enabled)
+                if self.spatial_enabled:
+                    cur.execute(f"DELETE FROM {table}_rtree")
+                    cur.execute(
+                        f"INSERT INTO {table}_rtree (id, min_lat, max_lat, min_lon, max_lon) "
+                        f"SELECT id, latitude, latitude, longitude, longitude FROM {table} "
+                        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+                    )
+            cur.close()
+            conn.commit()
+            return len(saved)
 
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS box_positions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT NOT NULL,
-                    drone_id TEXT NOT NULL,
-                    barcode_data TEXT NOT NULL,
-                    barcode_type TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    altitude REAL,
-                    confidence REAL,
-                    bbox_x1 INTEGER,
-                    bbox_y1 INTEGER,
-                    bbox_x2 INTEGER,
-                    bbox_y2 INTEGER,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
+        def clear(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute("DELETE FROM db_meta WHERE key = ?", (BULK_LOAD_KEY,))
 
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS drone_status (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    drone_id TEXT NOT NULL UNIQUE,
-                    status TEXT NOT NULL DEFAULT 'offline',
-                    last_heartbeat TEXT,
-                    gps_latitude REAL,
-                    gps_longitude REAL,
-                    gps_altitude REAL,
-                    battery_level INTEGER,
-                    signal_strength INTEGER,
-                    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-                )
-                """
-            )
+        started = time.monotonic()
+        try:
+            indexes = sum(pool.write(restore) for pool in self.position_pools())
+        except sqlite3.Error as e:
+            logger.error(f"恢复位置表索引与触发器失败: {e}")
+            return False
+        # 触发器已恢复后再重算，之后的写入由触发器继续维护
+        if not (self.rebuild_statistics() and self.rebuild_box_latest() and self.rebuild_rollups()):
+            return False
+        try:
+            for pool in self.position_pools():
+                pool.write(clear)
+        except sqlite3.Error as e:
+            logger.error(f"清除批量导入标记失败: {e}")
+            return False
+        self.versions.bump("positions", "position_edits")
+        logger.info(f"批量导入收尾完成：恢复 {indexes} 个索引，用时 {time.monotonic() - started:.1f}s")
+        return True
 
-            cur.execute(
-                """
-                CREATE TABLE IF NOT EXISTS system_logs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-                    level TEXT NOT NULL,
-                    source TEXT,
-                    message TEXT,
-                    data TEXT
-                )
-                """
+    def bulk_load_pending(self) -> bool:
+        try:
+            return any(
+                pool.read(lambda conn: get_meta(conn, BULK_LOAD_KEY)) is not None
+                for pool in self.position_pools()
             )
+        except sqlite3.Error:
+            return False
 
-            # 索引
-            for sql in [
-                "CREATE INDEX IF NOT EXISTS idx_box_timestamp ON box_positions(timestamp)",
-                "CREATE INDEX IF NOT EXISTS idx_box_drone_id ON box_positions(drone_id)",
-                "CREATE INDEX IF NOT EXISTS idx_box_barcode ON box_positions(barcode_data)",
-                "CREATE INDEX IF NOT EXISTS idx_drone_id ON drone_status(drone_id)",
-                "CREATE INDEX IF NOT EXISTS idx_drone_status ON drone_status(status)",
-                "CREATE INDEX IF NOT EXISTS idx_log_timestamp ON system_logs(timestamp)",
-            ]:
-                cur.execute(sql)
+    # ----- 在线快照与只读副本 -----
+    def start_snapshot(self) -> Optional[Dict]:
+        """后台开始一次在线快照；已有快照在进行时返回 None"""
+        snapshot = self.snapshots.start()
+        return snapshot.to_dict() if snapshot is not None else None
 
-            conn.commit()
-            cur.close()
-            logger.info("SQLite数据库表创建成功")
-            return True
+    def create_snapshot(self) -> Dict:
+        """在当前线程完成一次快照（管理命令使用）"""
+        return self.snapshots.create().to_dict()
+
+    def get_snapshot(self, snapshot_id: str) -> Optional[Dict]:
+        snapshot = self.snapshots.get(snapshot_id)
+        return snapshot.to_dict() if snapshot is not None else None
+
+    def list_snapshots(self) -> Dict:
+        return {
+            "jobs": [s.to_dict() for s in self.snapshots.history()],
+            "files": self.snapshots.files(),
+            "replica": self.get_replica_stats(),
+        }
+
+    def cancel_snapshot(self, snapshot_id: str) -> bool:
+        return self.snapshots.cancel(snapshot_id)
+
+    def get_snapshot_stats(self) -> Dict:
+        return dict(self.snapshots.stats(), replica=self.get_replica_stats())
+
+    def _on_snapshot(self, path: str) -> None:
+        if self.replica_enabled:
+            self.open_replica(path)
+
+    def open_replica(self, path: Optional[str] = None) -> bool:
+        """把快照（默认最新的一个）作为只读副本，替换之前的副本"""
+        path = path or self.snapshots.latest()
+        if not path:
+            return False
+        replica = ConnectionPool(
+            path, timeout=self.timeout, read_pool_size=self.replica_pool_size,
+            cached_statements=self.pool.cached_statements, read_only=True,
+        )
+        try:
+            epoch_ready = replica.read(lambda conn: get_meta(conn, EPOCH_READY_KEY)) == "1"
         except sqlite3.Error as e:
-            logger.error(f"创建数据库表失败: {e}")
+            logger.error(f"打开只读副本失败: {e}")
+            replica.close()
             return False
+        previous, self.replica = self.replica, replica
+        self.replica_epoch_ready = epoch_ready
+        if previous is not None:
+            previous.close()
+        logger.info(f"只读副本已切换到 {path}")
+        return True
 
-    def insert_box_position(self, data: Dict) -> bool:
+    def get_replica_stats(self) -> Dict:
+        replica = self.replica
+        if replica is None:
+            return {"enabled": self.replica_enabled, "path": None}
+        return dict(replica.stats(), enabled=self.replica_enabled, path=replica.db_path)
+
+    def _source_pool(self, source: str) -> ConnectionPool:
+        """报表查询的数据来源：primary 为主库，replica 为最新快照（数据截至快照时刻）"""
+        if source == "primary":
+            return self.pool
+        if source != "replica":
+            raise ValueError("source 仅支持 primary 或 replica")
+        if self.shards is not None:
+            raise ValueError("分片模式不提供只读副本（快照只包含主库）")
+        replica = self.replica
+        if replica is None:
+            raise ValueError("只读副本不可用，请先生成快照")
+        # 时间键按主库状态选择，回填完成前生成的快照缺少完整的毫秒时间列
+        if self.replica_epoch_ready != self.epoch_ready:
+            raise ValueError("只读副本生成于毫秒时间列回填完成之前，请重新生成快照")
+        return replica
+
+    # ----- 毫秒时间列 -----
+    def _epoch_targets(self, conn: sqlite3.Connection) -> List[EpochTarget]:
+        if self.partitions is None:
+            tables = ["box_positions"]
+        else:
+            tables = [r[0] for r in conn.execute("SELECT name FROM box_partitions")]
+        return (
+            [(t, "timestamp", "ts_ms") for t in tables]
+            + [("drone_status", "last_heartbeat", "last_heartbeat_ms"), ("system_logs", "timestamp", "ts_ms")]
+        )
+
+    @staticmethod
+    def _epoch_ready_in(conn: sqlite3.Connection) -> bool:
+        return get_meta(conn, EPOCH_READY_KEY) == "1"
+
+    @staticmethod
+    def _drop_legacy_time_indexes(conn: sqlite3.Connection) -> None:
+        with conn:
+            for sql in legacy_time_index_sql("box_positions"):
+                conn.execute(sql)
+
+    def _on_epoch_ready(self) -> None:
+        self.epoch_ready = True
+        if self.partitions is not None:
+            self.partitions.text_time = False
+        if self.shards is not None:
+            # 分片不在回填目标内（写入时已带毫秒列），文本时间索引在这里删除
+            for pool in self.shards.pools:
+                pool.write(self._drop_legacy_time_indexes)
+        # 分页游标改用毫秒时间键，缓存的旧页需要失效
+        self.versions.bump("positions")
+        logger.info("时间范围查询已切换到毫秒时间列")
+
+    def start_epoch_backfill(self) -> bool:
+        """后台回填毫秒时间列（已完成时不启动）"""
+        if self.epoch_ready:
+            return False
+        return self.backfill.start()
+
+    def run_epoch_backfill(self) -> bool:
+        """在当前线程回填到完成（管理命令使用）"""
+        return self.epoch_ready or self.backfill.run()
+
+    def get_epoch_migration_status(self) -> Dict:
+        return dict(self.backfill.status(), ready=self.epoch_ready)
+
+    def _time_key(self) -> str:
+        return "ts_ms" if self.epoch_ready else "timestamp"
+
+    def _time_value(self, value):
+        """把 ISO 时间转为可与当前时间列比较的值；无法解析时抛出 ValueError"""
+        ms = to_epoch_ms(value)
+        if ms is None:
+            raise ValueError(f"无效的时间: {value}")
+        return ms if self.epoch_ready else str(value)
+
+    def _cursor_value(self, value):
+        """游标中的时间键：回填完成前签发的字符串游标在切换后仍可继续使用"""
+        if isinstance(value, str):
+            return self._time_value(value)
+        if not self.epoch_ready:
+            raise ValueError("分页游标已失效，请重新查询")
+        return value
+
+    # ----- 无人机状态 -----
+    def start_drone_registry(self) -> bool:
+        """启动无人机状态后台刷新；窗口为 0 时保持同步写入"""
+        return self.drones.start()
+
+    def stop_drone_registry(self) -> None:
+        """停止后台刷新并写入剩余状态"""
+        self.drones.stop()
+
+    def get_drone_registry_stats(self) -> Dict:
+        stats = dict(self.drones.stats(), flush_interval=self.drones.flush_interval, running=self.drones.is_running())
+        if self.drones.tracks is not None:
+            stats["tracks"] = self.drones.tracks.stats()
+        return stats
+
+    def update_drone_status(self, drone_id: str, status_data: Dict) -> bool:
+        """更新内存中的无人机状态，由 DroneRegistry 负责落盘"""
+        ok = self.drones.update(drone_id, status_data)
+        self.versions.bump("drones")
+        if ok:
+            logger.debug(f"无人机状态更新成功: {drone_id}")
+        return ok
+
+    def get_drone_track(
+        self,
+        drone_id: str,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        tolerance_m: Optional[float] = None,
+        max_points: int = 200000,
+    ) -> Optional[List[Dict]]:
+        """某架无人机在时间范围内的轨迹折线（默认最近 1 小时），按时间升序。
+
+        存储时已按 track_tolerance_m 压缩，tolerance_m 更大时再用 Douglas-Peucker 简化；
+        小于存储精度时返回全部已存储点。尚未存储的最新位置补在末尾。
+        时间格式错误时抛出 ValueError，查询失败时返回 None。
+        """
+        end_ms = to_epoch_ms(end) if end else int(time.time() * 1000)
+        start_ms = to_epoch_ms(start) if start else (end_ms - 3_600_000 if end_ms is not None else None)
+        if start_ms is None or end_ms is None:
+            raise ValueError(f"无效的时间: {start if start_ms is None else end}")
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
+            with self.pool.reader() as conn:
+                points: List[TrackPoint] = [
+                    tuple(r) for r in conn.execute(
+                        "SELECT ts_ms, latitude, longitude, altitude FROM drone_tracks "
+                        "WHERE drone_id = ? AND ts_ms >= ? AND ts_ms <= ? ORDER BY ts_ms LIMIT ?",
+                        (drone_id, start_ms, end_ms, max(1, int(max_points))),
+                    )
+                ]
+        except sqlite3.Error as e:
+            logger.error(f"获取无人机轨迹失败: {e}")
+            return None
+        tail = self.drones.tracks.pending(drone_id) if self.drones.tracks is not None else None
+        if tail is not None and start_ms <= tail[0] <= end_ms and (not points or tail[0] > points[-1][0]):
+            points.append(tail)
+        if tolerance_m is not None:
+            points = douglas_peucker(points, tolerance_m)
+        return [
+            {"ts_ms": p[0], "latitude": p[1], "longitude": p[2], "altitude": p[3]}
+            for p in points
+        ]
 
-            gps = data.get("gps") or {}
-            lat = gps.get("latitude") if isinstance(gps, dict) else None
-            lon = gps.get("longitude") if isinstance(gps, dict) else None
-            alt = gps.get("altitude") if isinstance(gps, dict) else None
+    def get_recent_positions(self, limit: int = 100, drone_id: Optional[str] = None) -> List[Dict]:
+        return self.get_positions_page(limit, drone_id)["data"]
 
-            sql = (
-                "INSERT INTO box_positions (timestamp, drone_id, barcode_data, barcode_type, "
-                "latitude, longitude, altitude, confidence, bbox_x1, bbox_y1, bbox_x2, bbox_y2, created_at) "
-                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+    def get_positions_page(
+        self,
+        limit: int = 100,
+        drone_id: Optional[str] = None,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+    ) -> Dict:
+        """基于 (时间键, id) 游标的分页查询，结果始终按时间倒序。
+
+        before: 返回比游标更早的一页（向后翻页）
+        after:  返回比游标更新的一页（向前翻页）
+        时间键在毫秒列回填完成后为 ts_ms，之前为 timestamp；每页都是 (ts_ms, id) /
+        (drone_id, ts_ms, id) 索引上的一次范围扫描，与翻页深度无关。
+        游标或时间格式错误时抛出 ValueError。
+        """
+        limit = max(1, int(limit))
+        key = self._time_key()
+        # 时间无法解析的记录没有毫秒值，不参与按时间排序的分页
+        where: List[str] = [f"{key} IS NOT NULL"]
+        params: List = []
+        if drone_id:
+            where.append("drone_id = ?")
+            params.append(drone_id)
+        ascending = False
+        page_cursor: Optional[Tuple[str, object, int]] = None
+        for cursor, op in ((before, "<"), (after, ">")):
+            if cursor:
+                value, row_id = decode_cursor(cursor)
+                page_cursor = (op, self._cursor_value(value), row_id)
+                where.append(f"({key}, id) {op} (?, ?)")
+                params.extend(page_cursor[1:])
+                ascending = op == ">"
+                break
+
+        # 最近的页由内存热层直接给出
+        rows = self.hot.page(limit, drone_id, page_cursor) if self.hot is not None else None
+        if rows is None:
+            try:
+                with self.pool.reader() as conn:
+                    rows = self._merge_ordered(conn, where, params, key, ascending, limit + 1, drone_id)
+            except sqlite3.Error as e:
+                logger.error(f"获取位置数据失败: {e}")
+                return {"data": [], "next_cursor": None, "prev_cursor": None}
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if ascending:
+            rows.reverse()
+        if not rows:
+            return {"data": [], "next_cursor": None, "prev_cursor": None}
+
+        first, last = rows[0], rows[-1]
+        # 向前翻页时游标本身就是更早的数据；向后翻页或指定 before 时才存在更新的数据
+        older_exists = has_more if not ascending else True
+        newer_exists = has_more if ascending else bool(before)
+        return {
+            "data": rows,
+            "next_cursor": encode_cursor(last[key], last["id"]) if older_exists else None,
+            "prev_cursor": encode_cursor(first[key], first["id"]) if newer_exists else None,
+        }
+
+    def _merge_ordered(
+        self,
+        conn: sqlite3.Connection,
+        where: List[str],
+        params: List,
+        key: str,
+        ascending: bool,
+        limit: int,
+        drone_id: Optional[str] = None,
+    ) -> List[Dict]:
+        """按 (时间键, id) 取前 limit 条：每个库在自己的索引上取前 limit 条，再按同一顺序 k 路归并。
+
+        非分片模式只有主库一路。游标是惰性读取的，归并只从各库取出实际用到的行。
+        """
+        order = "ASC" if ascending else "DESC"
+        streams = [
+            conn.execute(
+                f"SELECT * FROM {schema}.box_positions WHERE " + " AND ".join(where)
+                + f" ORDER BY {key} {order}, id {order} LIMIT ?",
+                params + [limit],
             )
-            values = (
-                data["timestamp"],
-                data["drone_id"],
-                data["barcode_data"],
-                data.get("barcode_type"),
-                lat,
-                lon,
-                alt,
-                data.get("confidence"),
-                data.get("bbox_x1"),
-                data.get("bbox_y1"),
-                data.get("bbox_x2"),
-                data.get("bbox_y2"),
-                datetime.now().isoformat(),
+            for schema in self._schemas(drone_id)
+        ]
+        merged = heapq.merge(*streams, key=lambda r: (r[key], r["id"]), reverse=not ascending)
+        return [dict(r) for r in itertools.islice(merged, limit)]
+
+    def query_positions(
+        self,
+        filters: Optional[Dict] = None,
+        order: str = "desc",
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        scan_budget: int = 20000,
+        explain: bool = False,
+        source: str = "primary",
+    ) -> Optional[Dict]:
+        """按过滤语法（见 compile_position_filter）查询位置数据，按 (时间键, id) 排序并以游标分页。
+
+        编译出的 SQL 先经 EXPLAIN QUERY PLAN 检查：条件能在索引上限定范围时直接执行；
+        计划会扫描整张表或整条时间索引时，先在 (时间键, id) 覆盖索引上找出向后第 scan_budget
+        条记录作为边界，把本页限定在这一段内执行。此时返回的页可能少于 limit 条，
+        next_cursor 从边界继续。限定后仍需全表扫描的查询被拒绝。
+        explain 为真时附带实际执行语句及其查询计划。source 为 replica 时在只读副本上执行。
+        参数不合法或查询被拒绝时抛出 ValueError，查询失败时返回 None。
+        """
+        pool = self._source_pool(source)
+        if order not in ("asc", "desc"):
+            raise ValueError("order 仅支持 asc 或 desc")
+        limit = max(1, int(limit))
+        key = self._time_key()
+        conds, params = compile_position_filter(filters or {}, key, self._time_value)
+        # 一元 + 使该条件不参与索引选择，查询计划只反映用户条件
+        conds.append(f"+{key} IS NOT NULL")
+        op = "<" if order == "desc" else ">"
+        page: List[str] = []
+        page_params: List = []
+        if cursor:
+            value, row_id = decode_cursor(cursor)
+            page.append(f"({key}, id) {op} (?, ?)")
+            page_params.extend((self._cursor_value(value), row_id))
+        direction = order.upper()
+        refused = "查询需要全表扫描，请增加时间范围、无人机或条码条件"
+
+        def build(extra: List[str], extra_params: List) -> Tuple[str, List]:
+            sql = "SELECT * FROM box_positions WHERE " + " AND ".join(conds + page + extra)
+            sql += f" ORDER BY {key} {direction}, id {direction} LIMIT ?"
+            return sql, params + page_params + extra_params + [limit + 1]
+
+        try:
+            with pool.reader() as conn:
+                sql, args = build([], [])
+                plan = explain_plan(conn, sql, args)
+                boundary = None
+                if plan_scans_fully(plan):
+                    bound_sql = (
+                        f"SELECT {key}, id FROM box_positions WHERE "
+                        + " AND ".join([f"{key} IS NOT NULL"] + page)
+                        + f" ORDER BY {key} {direction}, id {direction} LIMIT 1 OFFSET ?"
+                    )
+                    bound_params = page_params + [max(1, int(scan_budget)) - 1]
+                    # 毫秒列回填期间可能没有可用的时间索引，连边界都需要全表扫描
+                    if plan_scans_fully(explain_plan(conn, bound_sql, bound_params)):
+                        raise ValueError(refused)
+                    boundary = conn.execute(bound_sql, bound_params).fetchone()
+                    if boundary is not None:
+                        within = ">=" if order == "desc" else "<="
+                        sql, args = build([f"({key}, id) {within} (?, ?)"], list(boundary))
+                        plan = explain_plan(conn, sql, args)
+                        if plan_scans_fully(plan):
+                            raise ValueError(refused)
+                rows = [dict(r) for r in conn.execute(sql, args)]
+        except sqlite3.Error as e:
+            logger.error(f"过滤查询位置数据失败: {e}")
+            return None
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][key], rows[-1]["id"])
+        elif boundary is not None:
+            next_cursor = encode_cursor(boundary[0], boundary[1])
+        result = {"data": rows, "next_cursor": next_cursor, "scan_limited": boundary is not None}
+        if explain:
+            result["sql"] = sql
+            result["plan"] = plan
+        return result
+
+    def iter_positions(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        drone_id: Optional[str] = None,
+        barcode: Optional[str] = None,
+        chunk_size: int = 1000,
+        source: str = "primary",
+    ) -> Iterator[List[tuple]]:
+        """按 (时间键, id) 升序分块产出位置记录（元组，列顺序同 POSITION_COLUMNS）。
+
+        每块是一次独立的键集查询，块之间归还读连接：导出速度取决于客户端时，
+        既不会长期占用连接池，也不会让长读事务阻止 WAL 检查点。内存占用只与 chunk_size 有关。
+        source 为 replica 时从只读副本导出。参数在调用时立即校验，时间格式错误时抛出 ValueError。
+        """
+        pool = self._source_pool(source)
+        chunk_size = max(1, int(chunk_size))
+        key = self._time_key()
+        where: List[str] = [f"{key} IS NOT NULL"]
+        params: List = []
+        if start:
+            where.append(f"{key} >= ?")
+            params.append(self._time_value(start))
+        if end:
+            where.append(f"{key} < ?")
+            params.append(self._time_value(end))
+        # 起点落在热层覆盖范围内时直接从内存导出
+        if start and self.hot is not None and pool is self.pool:
+            chunks = self.hot.scan(
+                params[0], params[1] if end else None, drone_id, barcode, chunk_size, POSITION_COLUMNS
             )
-            cur.execute(sql, values)
-            conn.commit()
-            cur.close()
-            logger.debug(f"物体箱位置数据插入成功: {data.get('barcode_data')}")
-            return True
+            if chunks is not None:
+                return chunks
+        if drone_id:
+            where.append("drone_id = ?")
+            params.append(drone_id)
+        if barcode:
+            where.append("barcode_data = ?")
+            params.append(barcode)
+        return self._iter_chunks(key, where, params, chunk_size, pool)
+
+    def _iter_chunks(
+        self, key: str, where: List[str], params: List, chunk_size: int, pool: ConnectionPool,
+    ) -> Iterator[List[tuple]]:
+        base = f"SELECT {', '.join(POSITION_COLUMNS)} FROM box_positions"
+        last: Optional[tuple] = None
+        while True:
+            conds = list(where)
+            args = list(params)
+            if last is not None:
+                conds.append(f"({key}, id) > (?, ?)")
+                args.extend(last)
+            sql = base + " WHERE " + " AND ".join(conds) + f" ORDER BY {key}, id LIMIT ?"
+            args.append(chunk_size)
+            with pool.reader() as conn:
+                rows = conn.execute(sql, args).fetchmany(chunk_size)
+            if not rows:
+                return
+            yield [tuple(r) for r in rows]
+            if len(rows) < chunk_size:
+                return
+            last = (rows[-1][key], rows[-1]["id"])
+
+    def get_positions_summary(self, since: Optional[str] = None, group_by: str = "drone", limit: int = 100) -> Optional[List[Dict]]:
+        """按无人机或条码汇总 since 之后的检测（默认最近 1 小时），按检测数倒序。
+
+        每组返回检测数、平均置信度、首末检测毫秒时间与平均坐标；since 落在热层覆盖范围内时
+        由热层计算，否则在 SQLite 上聚合。参数不合法时抛出 ValueError，查询失败时返回 None。
+        """
+        if group_by not in HOT_SUMMARY_GROUPS:
+            raise ValueError("group_by 仅支持 drone 或 barcode")
+        limit = max(1, int(limit))
+        start_ms = to_epoch_ms(since) if since else int(time.time() * 1000) - 3_600_000
+        if start_ms is None:
+            raise ValueError(f"无效的时间: {since}")
+        rows = self.hot.summary(start_ms, group_by) if self.hot is not None else None
+        if rows is not None:
+            return rows[:limit]
+        key = self._time_key()
+        column = HOT_SUMMARY_GROUPS[group_by]
+        sql = (
+            f"SELECT {column}, COUNT(*), AVG(confidence), MIN(ts_ms), MAX(ts_ms), AVG(latitude), AVG(longitude) "
+            f"FROM box_positions WHERE {key} >= ? GROUP BY {column} ORDER BY COUNT(*) DESC, {column} LIMIT ?"
+        )
+        bound = start_ms if self.epoch_ready else datetime.fromtimestamp(start_ms / 1000).isoformat()
+        try:
+            with self.pool.reader() as conn:
+                result = conn.execute(sql, (bound, limit)).fetchall()
         except sqlite3.Error as e:
-            logger.error(f"插入物体箱位置数据失败: {e}")
-            return False
+            logger.error(f"汇总位置数据失败: {e}")
+            return None
+        names = ("key", "detections", "avg_confidence", "first_ms", "last_ms", "latitude", "longitude")
+        return [dict(zip(names, r)) for r in result]
+
+    def get_positions_within(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        since: Optional[str] = None,
+        drone_id: Optional[str] = None,
+        limit: int = 500,
+    ) -> List[Dict]:
+        """查询矩形范围内的位置数据（按时间倒序），由 R*Tree 完成范围定位"""
+        # R*Tree 以 32 位浮点保存并向外取整，用相交条件取候选，再用原始坐标精确过滤
+        exact = "p.latitude BETWEEN ? AND ? AND p.longitude BETWEEN ? AND ?"
+        filters = ""
+        extra: List = []
+        key = self._time_key()
+        if since:
+            filters += f" AND p.{key} >= ?"
+            extra.append(self._time_value(since))
+        if self.hot is not None:
+            rows = self.hot.within(
+                min_lat, min_lon, max_lat, max_lon, extra[0] if since else None, drone_id, max(1, int(limit))
+            )
+            if rows is not None:
+                return rows
+        if drone_id:
+            filters += " AND p.drone_id = ?"
+            extra.append(drone_id)
+        box = [min_lat, max_lat, min_lon, max_lon]
 
-    def update_drone_status(self, drone_id: str, status_data: Dict) -> bool:
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT id FROM drone_status WHERE drone_id = ?", (drone_id,))
-            row = cur.fetchone()
+            with self.pool.reader() as conn:
+                if self.spatial_enabled:
+                    # 每个位置表（分区）有自己的 R*Tree，逐个范围查询后合并
+                    arms = []
+                    params: List = []
+                    for table in self._spatial_tables(conn, since):
+                        arms.append(
+                            f"SELECT p.* FROM {table}_rtree r JOIN {table} p ON p.id = r.id "
+                            "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? AND "
+                            + exact + filters
+                        )
+                        params += box + box + extra
+                    if not arms:
+                        return []
+                    sql = "SELECT * FROM (" + " UNION ALL ".join(arms) + ") p"
+                else:
+                    sql = "SELECT p.* FROM box_positions p WHERE " + exact + filters
+                    params = box + extra
+                sql += f" ORDER BY p.{key} DESC, p.id DESC LIMIT ?"
+                params.append(max(1, int(limit)))
+                return [dict(r) for r in conn.execute(sql, params)]
+        except sqlite3.Error as e:
+            logger.error(f"范围查询位置数据失败: {e}")
+            return []
 
-            gps = status_data.get("gps") or {}
-            now = datetime.now().isoformat()
+    def _spatial_tables(self, conn: sqlite3.Connection, since: Optional[str] = None) -> List[str]:
+        """参与空间查询的位置表；分区模式下跳过整段早于 since 的分区，分片模式下为各库的位置表"""
+        if self.shards is not None:
+            return [f"{schema}.box_positions" for schema in self.shards.schemas()]
+        if self.partitions is None:
+            return ["box_positions"]
+        cur = conn.cursor()
+        if since:
+            cur.execute(
+                "SELECT name FROM box_partitions WHERE period_end IS NULL OR period_end > ?",
+                (str(since)[:10],),
+            )
+        else:
+            cur.execute("SELECT name FROM box_partitions")
+        names = [r[0] for r in cur.fetchall()]
+        cur.close()
+        return names
 
-            if row:
-                sql = (
-                    "UPDATE drone_status SET status=?, last_heartbeat=?, gps_latitude=?, gps_longitude=?, "
-                    "gps_altitude=?, battery_level=?, signal_strength=?, updated_at=? WHERE drone_id=?"
-                )
-                values = (
-                    status_data.get("status", "online"),
-                    now,
-                    gps.get("latitude") if isinstance(gps, dict) else None,
-                    gps.get("longitude") if isinstance(gps, dict) else None,
-                    gps.get("altitude") if isinstance(gps, dict) else None,
-                    status_data.get("battery_level"),
-                    status_data.get("signal_strength"),
-                    now,
-                    drone_id,
-                )
-            else:
-                sql = (
-                    "INSERT INTO drone_status (drone_id, status, last_heartbeat, gps_latitude, gps_longitude, "
-                    "gps_altitude, battery_level, signal_strength, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
-                )
-                values = (
-                    drone_id,
-                    status_data.get("status", "online"),
-                    now,
-                    gps.get("latitude") if isinstance(gps, dict) else None,
-                    gps.get("longitude") if isinstance(gps, dict) else None,
-                    gps.get("altitude") if isinstance(gps, dict) else None,
-                    status_data.get("battery_level"),
-                    status_data.get("signal_strength"),
-                    now,
-                    now,
-                )
+    def _nearest_candidates(
+        self, lat: float, lon: float, radius_m: float, n: int, since: Optional[str] = None
+    ) -> Tuple[List[Dict], Optional[float]]:
+        """外接矩形内按平面近似距离（经度差乘 cos(lat)）最近的 n 条，排序与截断在 SQLite 内完成。
 
-            cur.execute(sql, values)
-            conn.commit()
-            cur.close()
-            logger.debug(f"无人机状态更新成功: {drone_id}")
-            return True
+        返回 (记录, 截断处的平面距离（米）)；矩形内不足 n 条时截断距离为 None。
+        """
+        dlat = radius_m / METERS_PER_DEG_LAT
+        coslat = max(math.cos(math.radians(lat)), 1e-6)
+        dlon = min(radius_m / (METERS_PER_DEG_LAT * coslat), 360.0)
+        box = [lat - dlat, lat + dlat, lon - dlon, lon + dlon]
+        dist = "(p.latitude - ?) * (p.latitude - ?) + (p.longitude - ?) * (p.longitude - ?) * ?"
+        dist_params = [lat, lat, lon, lon, coslat * coslat]
+        exact = "p.latitude BETWEEN ? AND ? AND p.longitude BETWEEN ? AND ?"
+        filters = ""
+        extra: List = []
+        if since:
+            filters = f" AND p.{self._time_key()} >= ?"
+            extra.append(self._time_value(since))
+        try:
+            with self.pool.reader() as conn:
+                if self.spatial_enabled:
+                    # 每个位置表各取最近的 n 条，合并后再取 n 条
+                    arms = []
+                    params: List = []
+                    for table in self._spatial_tables(conn, since):
+                        arms.append(
+                            f"SELECT * FROM (SELECT p.*, {dist} AS nearest_d2 "
+                            f"FROM {table}_rtree r JOIN {table} p ON p.id = r.id "
+                            "WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ? AND "
+                            + exact + filters + " ORDER BY nearest_d2 LIMIT ?)"
+                        )
+                        params += dist_params + box + box + extra + [n]
+                    if not arms:
+                        return [], None
+                    sql = "SELECT * FROM (" + " UNION ALL ".join(arms) + ")"
+                else:
+                    sql = f"SELECT p.*, {dist} AS nearest_d2 FROM box_positions p WHERE " + exact + filters
+                    params = dist_params + box + extra
+                sql += " ORDER BY nearest_d2 LIMIT ?"
+                params.append(n)
+                rows = [dict(r) for r in conn.execute(sql, params)]
         except sqlite3.Error as e:
-            logger.error(f"更新无人机状态失败: {e}")
-            return False
+            logger.error(f"最近邻查询位置数据失败: {e}")
+            return [], None
+        bound = math.sqrt(rows[-1]["nearest_d2"]) * METERS_PER_DEG_LAT if len(rows) >= n else None
+        for row in rows:
+            del row["nearest_d2"]
+        return rows, bound
 
-    def get_recent_positions(self, limit: int = 100, drone_id: Optional[str] = None) -> List[Dict]:
+    def get_nearest_positions(
+        self,
+        lat: float,
+        lon: float,
+        k: int = 10,
+        max_distance_m: Optional[float] = None,
+        since: Optional[str] = None,
+    ) -> List[Dict]:
+        """查询距离 (lat, lon) 最近的 k 条位置数据，结果附带 distance_m。
+
+        R*Tree 不直接支持最近邻，这里按外接矩形逐步扩大搜索半径，每次只取回平面近似距离最近的
+        若干倍 k 条候选：候选数达到 k 后，以第 k 近的距离为半径再查一次；第 k 近超出候选截断处时
+        加大候选数重查，保证密集区域也只处理有限条记录。
+        """
+        k = max(1, int(k))
+        limit_m = max_distance_m if max_distance_m else math.pi * EARTH_RADIUS_M
+        radius = min(50.0, limit_m)
+        fetch = NEAREST_CANDIDATE_FACTOR * k
+        while True:
+            rows, bound = self._nearest_candidates(lat, lon, radius, fetch, since)
+            for row in rows:
+                row["distance_m"] = haversine_m(lat, lon, row["latitude"], row["longitude"])
+            candidates = sorted((r for r in rows if r["distance_m"] <= limit_m), key=lambda r: r["distance_m"])
+
+            if len(candidates) >= k:
+                kth = candidates[k - 1]["distance_m"]
+                truncated = bound is not None and kth > bound
+                # 矩形外接于半径为 radius 的圆：第 k 近点在圆内且未被截断时结果已精确
+                if kth <= radius and not truncated:
+                    return candidates[:k]
+                if truncated:
+                    fetch *= 4
+                else:
+                    radius = min(kth, limit_m)
+                continue
+            if bound is not None and bound < min(radius, limit_m):
+                fetch *= 4
+                continue
+            if radius >= limit_m:
+                return candidates
+            radius = min(radius * 4, limit_m)
+
+    def get_box_latest(self, barcode: str) -> Optional[Dict]:
+        """某个条码的最新位置（box_latest 主键查找），不存在时返回 None；分片模式下合并各库的记录"""
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            if drone_id:
-                cur.execute(
-                    "SELECT * FROM box_positions WHERE drone_id = ? ORDER BY timestamp DESC LIMIT ?",
-                    (drone_id, limit),
-                )
-            else:
-                cur.execute(
-                    "SELECT * FROM box_positions ORDER BY timestamp DESC LIMIT ?",
-                    (limit,),
-                )
-            rows = cur.fetchall()
-            cur.close()
-            return [dict(r) for r in rows]
+            with self.pool.reader() as conn:
+                records = [
+                    dict(r)
+                    for schema in self._schemas()
+                    for r in conn.execute(f"SELECT * FROM {schema}.box_latest WHERE barcode_data = ?", (barcode,))
+                ]
+            return merge_box_latest(records) if records else None
+        except sqlite3.Error as e:
+            logger.error(f"获取物体箱最新位置失败: {e}")
+            return None
+
+    def get_boxes_latest(self, barcodes: List[str]) -> List[Dict]:
+        """批量查询最新位置，只返回存在的条码"""
+        found: Dict[str, List[Dict]] = {}
+        unique = list(dict.fromkeys(barcodes))
+        try:
+            with self.pool.reader() as conn:
+                # 分块以避开 SQLite 绑定参数数量上限
+                for start in range(0, len(unique), 500):
+                    chunk = unique[start:start + 500]
+                    marks = ",".join("?" * len(chunk))
+                    for schema in self._schemas():
+                        cur = conn.execute(
+                            f"SELECT * FROM {schema}.box_latest WHERE barcode_data IN ({marks})", chunk
+                        )
+                        for r in cur.fetchall():
+                            found.setdefault(r["barcode_data"], []).append(dict(r))
+            return [merge_box_latest(records) for records in found.values()]
         except sqlite3.Error as e:
-            logger.error(f"获取位置数据失败: {e}")
+            logger.error(f"批量获取物体箱最新位置失败: {e}")
             return []
 
-    def get_drone_status(self, drone_id: Optional[str] = None) -> List[Dict]:
+    def search_boxes(
+        self, q: str, mode: str = "contains", sort: str = "recent", limit: int = 50
+    ) -> List[Dict]:
+        """按部分条码搜索物体箱（不区分大小写），返回 box_latest 记录。
+
+        mode: contains 任意位置 / prefix 开头 / suffix 结尾
+        sort: recent 按最近出现时间、confidence 按最高置信度，另一项作为次序
+        关键字不少于 3 个字符时由 trigram 索引取候选，更短的关键字扫描 box_latest。
+        参数不合法时抛出 ValueError。
+        """
+        q = (q or "").strip()
+        if not q:
+            raise ValueError("需要搜索关键字 q")
+        affix = {
+            "contains": None,
+            "prefix": "lower(substr(b.barcode_data, 1, length(?))) = lower(?)",
+            "suffix": "lower(substr(b.barcode_data, -length(?))) = lower(?)",
+        }
+        if mode not in affix:
+            raise ValueError("match 仅支持 contains、prefix 或 suffix")
+        orders = {
+            "recent": "b.last_seen DESC, b.best_confidence DESC",
+            "confidence": "b.best_confidence DESC, b.last_seen DESC",
+        }
+        if sort not in orders:
+            raise ValueError("sort 仅支持 recent 或 confidence")
+
+        if self.search_enabled and len(q) >= SEARCH_MIN_LENGTH:
+            sql = (
+                "SELECT b.* FROM {db}.box_search s JOIN {db}.box_barcodes k ON k.id = s.rowid "
+                "JOIN {db}.box_latest b ON b.barcode_data = k.barcode_data WHERE s.box_search MATCH ?"
+            )
+            # 整体作为短语匹配，关键字中的双引号按 FTS5 规则转义
+            params: List = ['"' + q.replace('"', '""') + '"']
+        else:
+            sql = "SELECT b.* FROM {db}.box_latest b WHERE instr(lower(b.barcode_data), lower(?)) > 0"
+            params = [q]
+        if affix[mode]:
+            sql += " AND " + affix[mode]
+            params += [q, q]
+        limit = max(1, int(limit))
+        page = f" ORDER BY {orders[sort]} LIMIT ?"
+        primary, secondary = ("last_seen", "best_confidence") if sort == "recent" else ("best_confidence", "last_seen")
+        schemas = self._schemas()
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            if drone_id:
-                cur.execute("SELECT * FROM drone_status WHERE drone_id = ?", (drone_id,))
-            else:
-                cur.execute("SELECT * FROM drone_status ORDER BY updated_at DESC")
-            rows = cur.fetchall()
-            cur.close()
-            return [dict(r) for r in rows]
+            with self.pool.reader() as conn:
+                if len(schemas) == 1:
+                    return [dict(r) for r in conn.execute(sql.format(db=schemas[0]) + page, params + [limit])]
+                # 分片模式：各库各取前 limit 个，再补上与第 limit 个主排序值相同的条码作为候选。
+                # 合并后的排序值不小于任一库中的值，真正的前 limit 个必在候选之中
+                candidates: Dict[str, None] = {}
+                for schema in schemas:
+                    rows = conn.execute(sql.format(db=schema) + page, params + [limit]).fetchall()
+                    if len(rows) == limit:
+                        rows += conn.execute(
+                            sql.format(db=schema) + f" AND b.{primary} IS ?", params + [rows[-1][primary]]
+                        ).fetchall()
+                    candidates.update((r["barcode_data"], None) for r in rows)
         except sqlite3.Error as e:
-            logger.error(f"获取无人机状态失败: {e}")
+            logger.error(f"搜索物体箱失败: {e}")
             return []
+        # 候选条码按全部库的记录合并后重新排序，结果与单库一致
+        merged = self.get_boxes_latest(list(candidates))
+        # 与 SQL 的降序一致：NULL 排在最后
+        merged.sort(
+            key=lambda r: (r[primary] is not None, r[primary] or 0, r[secondary] is not None, r[secondary] or 0),
+            reverse=True,
+        )
+        return merged[:limit]
+
+    def get_drone_status(self, drone_id: Optional[str] = None) -> List[Dict]:
+        return self.drones.get(drone_id)
 
     def cleanup_old_data(self, days: Optional[int] = None) -> bool:
         _sys_cfg = getattr(config, "SYSTEM_CONFIG", {}) or {}
         keep_days = days or _sys_cfg.get("data_retention_days", 30)
         cutoff = (datetime.now() - timedelta(days=keep_days)).isoformat()
-        try:
-            conn = self._get_connection()
+        key, bound = self._time_key(), self._time_value(cutoff)
+        rollup_keep = (getattr(config, "DB_CONFIG", {}) or {}).get("rollup_retention_days") or {}
+        now_ms = int(time.time() * 1000)
+
+        def _trim_rollups(cur: sqlite3.Cursor) -> None:
+            # 汇总表不随原始数据删除，按各粒度自己的保留天数清理（0 表示永久保留）
+            for level, keep in rollup_keep.items():
+                if level in ROLLUP_LEVELS and keep:
+                    cur.execute(f"DELETE FROM rollup_{level} WHERE bucket < ?", (now_ms - int(keep) * 86_400_000,))
+
+        def _cleanup(conn: sqlite3.Connection) -> Tuple[int, List[str], int]:
             cur = conn.cursor()
-            cur.execute("DELETE FROM box_positions WHERE timestamp < ?", (cutoff,))
-            pos_deleted = cur.rowcount
-            cur.execute("DELETE FROM system_logs WHERE timestamp < ?", (cutoff,))
+            dropped: List[str] = []
+            if self.partitions is None:
+                set_meta(conn, RETENTION_CLEANUP_KEY, 1)
+                cur.execute(f"DELETE FROM box_positions WHERE {key} < ?", (bound,))
+                pos_deleted = cur.rowcount
+            else:
+                pos_deleted, dropped = self._cleanup_partitions(cur, cutoff, key, bound)
+            cur.execute("DELETE FROM db_meta WHERE key = ?", (RETENTION_CLEANUP_KEY,))
+            # system_logs 与位置表同批回填，沿用同一时间键
+            cur.execute(f"DELETE FROM system_logs WHERE {key} < ?", (bound,))
             log_deleted = cur.rowcount
+            cur.execute("DELETE FROM drone_tracks WHERE ts_ms < ?", (to_epoch_ms(cutoff),))
+            _trim_rollups(cur)
+            conn.commit()
+            cur.close()
+            return pos_deleted, dropped, log_deleted
+
+        def _cleanup_shard(conn: sqlite3.Connection) -> int:
+            cur = conn.cursor()
+            set_meta(conn, RETENTION_CLEANUP_KEY, 1)
+            cur.execute(f"DELETE FROM box_positions WHERE {key} < ?", (bound,))
+            deleted = cur.rowcount
+            cur.execute("DELETE FROM db_meta WHERE key = ?", (RETENTION_CLEANUP_KEY,))
+            _trim_rollups(cur)
             conn.commit()
             cur.close()
+            return deleted
+
+        try:
+            pos_deleted, dropped, log_deleted = self.pool.write(_cleanup)
+            for pool in self.position_pools()[1:]:
+                pos_deleted += pool.write(_cleanup_shard)
+            self.versions.bump("positions", "position_edits")
             logger.info(
-                f"数据清理完成 - 位置数据: {pos_deleted}条, 日志数据: {log_deleted}条"
+                f"数据清理完成 - 位置数据: {pos_deleted}条, 删除分区: {len(dropped)}个, 日志数据: {log_deleted}条"
             )
             return True
         except sqlite3.Error as e:
             logger.error(f"数据清理失败: {e}")
             return False
 
+    def _cleanup_partitions(self, cur: sqlite3.Cursor, cutoff: str, key: str, bound) -> Tuple[int, List[str]]:
+        """整段过期的分区直接 DROP；只有跨越截止时间的分区和默认分区需要逐行删除。
+
+        分区按 timestamp 的日期前缀划分，因此分区选择用 cutoff 的日期，逐行删除用 key/bound。
+        """
+        assert self.partitions is not None
+        cur.execute("BEGIN IMMEDIATE")
+        # 标记只在本事务内存在：逐行删除不扣减汇总表，提交前由调用方清除
+        set_meta(cur.connection, RETENTION_CLEANUP_KEY, 1)
+        dropped = self.partitions.expired(cur, cutoff[:10])
+        for name in dropped:
+            self.partitions.drop(cur, name, keep_rollups=True)
+        cur.execute(
+            "SELECT name FROM box_partitions WHERE period_start IS NULL OR period_start <= ?",
+            (cutoff[:10],),
+        )
+        deleted = 0
+        for (name,) in cur.fetchall():
+            cur.execute(f"DELETE FROM {name} WHERE {key} < ?", (bound,))
+            deleted += cur.rowcount
+        return deleted, dropped
+
     def get_statistics(self) -> Dict:
+        """读取触发器维护的统计计数，代价与表大小无关（分片模式下去重条码数除外）"""
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM box_positions")
-            total = cur.fetchone()[0]
-
             today = datetime.now().date().isoformat()
-            cur.execute(
-                "SELECT COUNT(*) FROM box_positions WHERE date(timestamp) = ?",
-                (today,),
-            )
-            today_count = cur.fetchone()[0]
-
-            one_minute_ago = (datetime.now() - timedelta(minutes=1)).isoformat()
-            cur.execute(
-                "SELECT COUNT(*) FROM drone_status WHERE status = 'online' AND last_heartbeat > ?",
-                (one_minute_ago,),
-            )
-            online = cur.fetchone()[0]
+            with self.pool.reader() as conn:
+                if self.shards is not None:
+                    total, today_count, unique = self._merged_statistics(conn, today)
+                else:
+                    cur = conn.cursor()
+                    cur.execute("SELECT name, value FROM stats_counters")
+                    counters = {row["name"]: row["value"] for row in cur.fetchall()}
+                    cur.execute("SELECT detections FROM stats_daily WHERE day = ?", (today,))
+                    row = cur.fetchone()
+                    today_count = row[0] if row else 0
+                    cur.close()
+                    total = counters.get("total_detections", 0)
+                    unique = counters.get("unique_barcodes", 0)
 
-            cur.execute("SELECT COUNT(DISTINCT barcode_data) FROM box_positions")
-            uniq = cur.fetchone()[0]
-            cur.close()
+            online = self.drones.online_count(int(time.time() * 1000) - 60000)
             return {
                 "total_detections": total,
                 "today_detections": today_count,
                 "online_drones": online,
-                "unique_barcodes": uniq,
+                "unique_barcodes": unique,
             }
         except sqlite3.Error as e:
             logger.error(f"获取统计信息失败: {e}")
             return {}
 
-    def log_system_event(self, level: str, source: str, message: str, data: Optional[Dict] = None) -> None:
+    def _merged_statistics(self, conn: sqlite3.Connection, today: str) -> Tuple[int, int, int]:
+        """分片模式的统计：检测数各库相加；同一条码可能出现在多个库中，
+        去重条码数由各库按条码有序的 stats_barcodes 做 k 路归并计数，内存占用与条码数无关"""
+        total = today_count = 0
+        streams = []
+        for schema in self._schemas():
+            row = conn.execute(f"SELECT value FROM {schema}.stats_counters WHERE name = 'total_detections'").fetchone()
+            total += row[0] if row else 0
+            row = conn.execute(f"SELECT detections FROM {schema}.stats_daily WHERE day = ?", (today,)).fetchone()
+            today_count += row[0] if row else 0
+            streams.append(conn.execute(f"SELECT barcode_data FROM {schema}.stats_barcodes ORDER BY barcode_data"))
+        first = itemgetter(0)
+        unique = sum(1 for _ in itertools.groupby(heapq.merge(*streams, key=first), key=first))
+        return total, today_count, unique
+
+    def get_daily_statistics(self, days: int = 30) -> List[Dict]:
+        """按天的检测数量（最近 days 天，日期倒序）；分片模式下按日期 k 路归并各库的计数"""
+        first = itemgetter(0)
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute(
-                "INSERT INTO system_logs (timestamp, level, source, message, data) VALUES (?, ?, ?, ?, ?)",
-                (
-                    datetime.now().isoformat(),
-                    level,
-                    source,
-                    message,
-                    json.dumps(data, ensure_ascii=False) if data else None,
-                ),
-            )
+            with self.pool.reader() as conn:
+                streams = [
+                    conn.execute(f"SELECT day, detections FROM {schema}.stats_daily ORDER BY day DESC LIMIT ?", (days,))
+                    for schema in self._schemas()
+                ]
+                merged = heapq.merge(*streams, key=first, reverse=True)
+                return [
+                    {"day": day, "detections": sum(r[1] for r in group)}
+                    for day, group in itertools.islice(itertools.groupby(merged, key=first), days)
+                ]
+        except sqlite3.Error as e:
+            logger.error(f"获取每日统计失败: {e}")
+            return []
+
+    def rebuild_box_latest(self) -> bool:
+        """从 box_positions 全量重建 box_latest（分片模式下逐库重建）"""
+        try:
+            for pool in self.position_pools():
+                with pool.writer() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM box_latest")
+                    conn.execute(
+                        "INSERT INTO box_latest (barcode_data, " + _LATEST_COLUMNS + ", "
+                        "best_confidence, first_seen, sightings) "
+                        "SELECT barcode_data, " + _LATEST_SOURCE + ", best, first, n FROM ("
+                        "  SELECT *, ROW_NUMBER() OVER (PARTITION BY barcode_data ORDER BY timestamp DESC, id DESC) AS rn,"
+                        "  MAX(confidence) OVER w AS best, MIN(timestamp) OVER w AS first, COUNT(*) OVER w AS n"
+                        "  FROM box_positions WINDOW w AS (PARTITION BY barcode_data)"
+                        ") WHERE rn = 1"
+                    )
+                    conn.commit()
+            logger.info("物体箱最新位置表重建完成")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"重建物体箱最新位置表失败: {e}")
+            return False
+
+    def rebuild_statistics(self) -> bool:
+        """从 box_positions 全量重算统计表（写锁内完成，期间插入会等待）"""
+        try:
+            for pool in self.position_pools():
+                with pool.writer() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM stats_daily")
+                    conn.execute("DELETE FROM stats_barcodes")
+                    conn.execute(
+                        "INSERT INTO stats_daily (day, detections) "
+                        "SELECT " + _day_of("p") + ", COUNT(*) FROM box_positions p GROUP BY 1"
+                    )
+                    conn.execute(
+                        "INSERT INTO stats_barcodes (barcode_data, detections) "
+                        "SELECT barcode_data, COUNT(*) FROM box_positions GROUP BY barcode_data"
+                    )
+                    conn.execute(
+                        "INSERT OR REPLACE INTO stats_counters (name, value) VALUES "
+                        "('total_detections', (SELECT COALESCE(SUM(detections), 0) FROM stats_daily)), "
+                        "('unique_barcodes', (SELECT COUNT(*) FROM stats_barcodes))"
+                    )
+                    conn.commit()
+            self.versions.bump("positions")
+            logger.info("统计数据重建完成")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"重建统计数据失败: {e}")
+            return False
+
+    def rebuild_rollups(self) -> bool:
+        """从 box_positions 重算时间序列汇总表。
+
+        只替换原始数据仍覆盖的时间桶（不早于最早一条记录所在的桶），
+        保留策略已删除原始数据的更早历史不受影响。
+        """
+        try:
+            for pool in self.position_pools():
+                with pool.writer() as conn:
+                    conn.execute("BEGIN IMMEDIATE")
+                    for level in ROLLUP_LEVELS:
+                        conn.execute(
+                            f"DELETE FROM rollup_{level} WHERE bucket >= "
+                            f"(SELECT {rollup_bucket_sql('MIN(ts_ms)', level)} FROM box_positions)"
+                        )
+                        for dim, key in _rollup_keys("p").items():
+                            conn.execute(
+                                f"INSERT INTO rollup_{level} (dimension, key, bucket, detections) "
+                                f"SELECT '{dim}', {key}, {rollup_bucket_sql('p.ts_ms', level)}, COUNT(*) "
+                                "FROM box_positions p WHERE p.ts_ms IS NOT NULL GROUP BY 2, 3"
+                            )
+                    conn.commit()
+            logger.info("时间序列汇总表重建完成")
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"重建时间序列汇总表失败: {e}")
+            return False
+
+    def get_timeseries(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        group_by: str = "drone",
+        key: Optional[str] = None,
+        step_ms: Optional[int] = None,
+        max_points: int = 1000,
+    ) -> Optional[Dict]:
+        """按无人机或条码前缀分组的检测数量时间序列。
+
+        时间范围默认最近 24 小时，起止按分钟对齐（起点向下、终点向上取整）；
+        step 未指定时取点数不超过 max_points 的最细步长。从粗到细选择第一个
+        能整除 step 且与起止时间对齐的汇总粒度，因此结果与按原始数据统计一致。
+        每个分组只返回有检测的时间点 [起始毫秒, 数量]。
+        参数不合法时抛出 ValueError，查询失败时返回 None。
+        """
+        if group_by not in ("drone", "prefix"):
+            raise ValueError("group_by 仅支持 drone 或 prefix")
+        minute = ROLLUP_LEVELS["1m"]
+        end_ms = to_epoch_ms(end) if end else int(time.time() * 1000)
+        if end_ms is None:
+            raise ValueError(f"无效的时间: {end}")
+        start_ms = to_epoch_ms(start) if start else end_ms - 86_400_000
+        if start_ms is None:
+            raise ValueError(f"无效的时间: {start}")
+        start_ms = rollup_bucket(start_ms, "1m")
+        end_ms = -(-end_ms // minute) * minute
+        if start_ms >= end_ms:
+            raise ValueError("起始时间必须早于结束时间")
+
+        span = end_ms - start_ms
+        if step_ms is None:
+            step_ms = next((s for s in TIMESERIES_AUTO_STEPS if span / s <= max_points), TIMESERIES_AUTO_STEPS[-1])
+        if step_ms <= 0 or step_ms % minute:
+            raise ValueError("step 需为整分钟")
+        if span / step_ms > max_points:
+            raise ValueError(f"时间点超过上限 {max_points}，请增大 step 或缩小时间范围")
+        level = next(
+            lv for lv in ("1d", "1h", "1m")
+            if step_ms % ROLLUP_LEVELS[lv] == 0
+            and rollup_bucket(start_ms, lv) == start_ms and rollup_bucket(end_ms, lv) == end_ms
+        )
+
+        cond = "dimension = ? AND bucket >= ? AND bucket < ?"
+        cond_params: List = [group_by, start_ms, end_ms]
+        if key:
+            cond += " AND key = ?"
+            cond_params.append(key)
+        schemas = self._schemas()
+        if len(schemas) == 1:
+            source = f"rollup_{level} WHERE {cond}"
+            params: List = [start_ms, start_ms, step_ms, step_ms] + cond_params
+        else:
+            # 分片模式：各库汇总表中同一时间桶的计数相加
+            source = "(" + " UNION ALL ".join(
+                f"SELECT key, bucket, detections FROM {schema}.rollup_{level} WHERE {cond}" for schema in schemas
+            ) + ")"
+            params = [start_ms, start_ms, step_ms, step_ms] + cond_params * len(schemas)
+        sql = f"SELECT key, ? + (bucket - ?) / ? * ? AS t, SUM(detections) FROM {source} GROUP BY key, t ORDER BY key, t"
+        try:
+            with self.pool.reader() as conn:
+                rows = conn.execute(sql, params).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"获取时间序列失败: {e}")
+            return None
+
+        series: Dict[str, List] = {}
+        for k, t, n in rows:
+            series.setdefault(k, []).append([t, n])
+        return {
+            "group_by": group_by,
+            "rollup": level,
+            "step": step_ms,
+            "from": start_ms,
+            "to": end_ms,
+            "series": [{"key": k, "points": points} for k, points in series.items()],
+        }
+
+    # ----- 系统日志 -----
+    def start_system_log_sink(self) -> bool:
+        return self.system_logs.start()
+
+    def stop_system_log_sink(self) -> None:
+        """停止后台写入，队列中剩余日志会先落盘"""
+        self.system_logs.stop()
+
+    def get_system_log_stats(self) -> Dict:
+        return dict(self.system_logs.stats(), running=self.system_logs.is_running())
+
+    def system_log_handler(self, level: int = logging.INFO, exclude: Iterable[str] = ()) -> SystemLogHandler:
+        """返回可挂到 logging 的 Handler，日志经批量写入器进入 system_logs；exclude 为不转发的 logger"""
+        return SystemLogHandler(self.system_logs, level, exclude)
+
+    def log_system_event(self, level: str, source: str, message: str, data: Optional[Dict] = None) -> None:
+        # 写入器运行时只入队；未启动（如管理命令）时同步写入
+        if self.system_logs.is_running():
+            self.system_logs.submit(level, source, message, data)
+            return
+        values = system_log_values(level, source, message, data)
+
+        def _insert(conn: sqlite3.Connection) -> None:
+            conn.execute(SYSTEM_LOG_INSERT_SQL, values)
             conn.commit()
-            cur.close()
+
+        try:
+            self.pool.write(_insert)
         except sqlite3.Error as e:
             logger.error(f"记录系统事件失败: {e}")
 
@@ -347,13 +3644,19 @@ class DatabaseManager:
     def delete_positions(self, ids: List[int]) -> bool:
         if not ids:
             return True
+        step = self.bulk_chunk_size
+
+        def _delete(conn: sqlite3.Connection, group: List[int]) -> None:
+            # 分块绑定参数，避开 SQLite 变量数上限；大批量删除应使用 submit_bulk_job
+            with conn:
+                for i in range(0, len(group), step):
+                    chunk = group[i:i + step]
+                    conn.execute(f"DELETE FROM box_positions WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
         try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            q = ','.join(['?'] * len(ids))
-            cur.execute(f"DELETE FROM box_positions WHERE id IN ({q})", ids)
-            conn.commit()
-            cur.close()
+            for pool, group in self._pools_for_ids(ids):
+                pool.write(lambda conn, g=group: _delete(conn, g))
+            self.versions.bump("positions", "position_edits")
             logger.info(f"删除位置数据 {len(ids)} 条")
             return True
         except sqlite3.Error as e:
@@ -361,21 +3664,38 @@ class DatabaseManager:
             return False
 
     def clear_positions(self) -> bool:
-        try:
-            conn = self._get_connection()
+        def _clear(conn: sqlite3.Connection) -> None:
             cur = conn.cursor()
-            cur.execute("DELETE FROM box_positions")
+            if self.partitions is None:
+                cur.execute("DELETE FROM box_positions")
+            else:
+                cur.execute("BEGIN IMMEDIATE")
+                for name in self.partitions.names(cur):
+                    if name == PositionPartitions.DEFAULT:
+                        cur.execute(f"DELETE FROM {name}")
+                    else:
+                        self.partitions.drop(cur, name)
             conn.commit()
             cur.close()
+
+        def _clear_shard(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute("DELETE FROM box_positions")
+
+        try:
+            self.pool.write(_clear)
+            for pool in self.position_pools()[1:]:
+                pool.write(_clear_shard)
+            self.versions.bump("positions", "position_edits")
             logger.warning("已清空 box_positions 表")
             return True
         except sqlite3.Error as e:
             logger.error(f"清空位置数据失败: {e}")
             return False
 
-    def update_position(self, pid: int, fields: Dict) -> bool:
-        if not fields:
-            return True
+    @staticmethod
+    def _update_assignments(fields: Dict) -> Tuple[List[str], List]:
+        """可修改字段的 SET 子句与参数；修改 timestamp 时同步 ts_ms"""
         allowed = {
             'timestamp','drone_id','barcode_data','barcode_type','latitude','longitude','altitude',
             'confidence','bbox_x1','bbox_y1','bbox_x2','bbox_y2'
@@ -386,27 +3706,234 @@ class DatabaseManager:
             if k in allowed:
                 sets.append(f"{k}=?")
                 values.append(v)
+        if sets and 'timestamp' in fields:
+            sets.append("ts_ms=?")
+            values.append(to_epoch_ms(fields['timestamp']))
+        return sets, values
+
+    def update_position(self, pid: int, fields: Dict) -> bool:
+        if not fields:
+            return True
+        sets, values = self._update_assignments(fields)
         if not sets:
             return True
+        if self.shards is not None and "drone_id" in fields:
+            logger.error("分片模式下不能修改 drone_id：记录按 drone_id 存放在对应分片")
+            return False
         values.append(pid)
-        try:
-            conn = self._get_connection()
-            cur = conn.cursor()
-            cur.execute(f"UPDATE box_positions SET {', '.join(sets)} WHERE id=?", values)
+
+        def _update(conn: sqlite3.Connection) -> None:
+            conn.execute(f"UPDATE box_positions SET {', '.join(sets)} WHERE id=?", values)
             conn.commit()
-            cur.close()
+
+        try:
+            pool = self._pools_for_ids([pid])[0][0]
+            pool.write(_update)
+            self.versions.bump("positions", "position_edits")
             return True
         except sqlite3.Error as e:
             logger.error(f"更新位置数据失败: {e}")
             return False
 
-    def clear_drones(self) -> bool:
-        try:
-            conn = self._get_connection()
+    # ----- 管理操作：后台分块批量任务 -----
+    BULK_FILTER_KEYS = ("from", "to", "drone_id", "barcode")
+
+    def submit_bulk_job(
+        self,
+        kind: str,
+        ids: Optional[List[int]] = None,
+        filters: Optional[Dict] = None,
+        fields: Optional[Dict] = None,
+    ) -> Dict:
+        """提交后台批量任务，返回任务信息（含 id）。
+
+        kind: delete / update / clear。delete 与 update 需要 ids 或 filters
+        （from/to 时间范围、drone_id、barcode，条件之间为 AND）；update 另需 fields。
+        参数不合法时抛出 ValueError。
+        """
+        filters = {k: v for k, v in (filters or {}).items() if v not in (None, "")}
+        unknown = set(filters) - set(self.BULK_FILTER_KEYS)
+        if unknown:
+            raise ValueError(f"不支持的过滤条件: {', '.join(sorted(unknown))}")
+        if kind == "clear":
+            ids, filters = None, {}
+        elif kind in ("delete", "update"):
+            if ids is None and not filters:
+                raise ValueError("需要 ids 或过滤条件")
+        else:
+            raise ValueError(f"不支持的批量操作: {kind}")
+        if ids is not None and filters:
+            raise ValueError("ids 与过滤条件不能同时使用")
+        if ids is not None and not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+            raise ValueError("ids 需要为整数列表")
+
+        sets: List[str] = []
+        values: List = []
+        if kind == "update":
+            sets, values = self._update_assignments(fields or {})
+            if not sets:
+                raise ValueError("fields 中没有可修改的字段")
+            if self.shards is not None and "drone_id" in (fields or {}):
+                raise ValueError("分片模式下不能修改 drone_id：记录按 drone_id 存放在对应分片")
+        tasks: List[Union[BulkTask, PooledBulkTask]]
+        if ids is not None:
+            action = self._bulk_action(kind, sets, values)
+            tasks = [
+                (pool, self._bulk_id_task(group, action)) for pool, group in self._pools_for_ids(sorted(set(ids)))
+            ]
+        elif self.shards is not None:
+            where, params = self._bulk_where(filters)
+            action = self._bulk_action(kind, sets, values)
+            tasks = [
+                (pool, self._bulk_range_task("box_positions", where, params, action))
+                for pool in self.position_pools()
+            ]
+        else:
+            where, params = self._bulk_where(filters)
+            action = self._bulk_action(kind, sets, values)
+            if kind == "clear" and self.partitions is not None:
+                # 清空时非默认分区整表删除（每个分区一步），只有默认分区逐块删除
+                tasks = [
+                    self._partition_drop_task(),
+                    self._bulk_range_task(PositionPartitions.DEFAULT, where, params, action),
+                ]
+            else:
+                tasks = [self._bulk_range_task(t, where, params, action) for t in self._bulk_tables(filters)]
+        params_info = {"ids": len(ids) if ids is not None else None, "filters": filters or None}
+        if kind == "update":
+            params_info["fields"] = {k: v for k, v in (fields or {}).items()}
+        job = self.bulk_jobs.submit(kind, params_info, tasks)
+        logger.info(f"已提交批量任务 {job.id}: {kind} {params_info}")
+        return job.to_dict()
+
+    def get_bulk_job(self, job_id: str) -> Optional[Dict]:
+        job = self.bulk_jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def list_bulk_jobs(self) -> List[Dict]:
+        return [job.to_dict() for job in self.bulk_jobs.list()]
+
+    def cancel_bulk_job(self, job_id: str) -> bool:
+        return self.bulk_jobs.cancel(job_id)
+
+    def _bulk_where(self, filters: Dict) -> Tuple[List[str], List]:
+        key = self._time_key()
+        where: List[str] = []
+        params: List = []
+        if filters.get("from"):
+            where.append(f"{key} >= ?")
+            params.append(self._time_value(filters["from"]))
+        if filters.get("to"):
+            where.append(f"{key} < ?")
+            params.append(self._time_value(filters["to"]))
+        if filters.get("drone_id"):
+            where.append("drone_id = ?")
+            params.append(filters["drone_id"])
+        if filters.get("barcode"):
+            where.append("barcode_data = ?")
+            params.append(filters["barcode"])
+        return where, params
+
+    def _bulk_tables(self, filters: Dict) -> List[str]:
+        """按条件扫描的位置表：分区模式下逐个分区（跳过时间范围之外的分区），避免在视图上排序"""
+        if self.partitions is None:
+            return ["box_positions"]
+        sql = "SELECT name FROM box_partitions WHERE 1"
+        params: List = []
+        if filters.get("from"):
+            sql += " AND (period_end IS NULL OR period_end > ?)"
+            params.append(str(filters["from"])[:10])
+        if filters.get("to"):
+            sql += " AND (period_start IS NULL OR period_start <= ?)"
+            params.append(str(filters["to"])[:10])
+        return self.pool.read(lambda conn: [r[0] for r in conn.execute(sql, params)])
+
+    @staticmethod
+    def _bulk_action(kind: str, sets: List[str], values: List) -> Callable[[sqlite3.Connection, str, List[int]], int]:
+        def apply(conn: sqlite3.Connection, table: str, ids: List[int]) -> int:
+            marks = ",".join("?" * len(ids))
+            if kind == "update":
+                cur = conn.execute(f"UPDATE {table} SET {', '.join(sets)} WHERE id IN ({marks})", values + ids)
+            else:
+                cur = conn.execute(f"DELETE FROM {table} WHERE id IN ({marks})", ids)
+            return max(cur.rowcount, 0)
+        return apply
+
+    def _bulk_id_task(self, ids: List[int], action: Callable) -> BulkTask:
+        chunks = iter(range(0, len(ids), self.bulk_chunk_size))
+
+        def task(conn: sqlite3.Connection) -> Optional[int]:
+            start = next(chunks, None)
+            if start is None:
+                return None
+            chunk = ids[start:start + self.bulk_chunk_size]
+            with conn:
+                if self.partitions is None:
+                    return action(conn, "box_positions", chunk)
+                # 视图上经 INSTEAD OF 触发器执行的修改不计入 rowcount，先统计命中的记录数
+                marks = ",".join("?" * len(chunk))
+                count = conn.execute(f"SELECT COUNT(*) FROM box_positions WHERE id IN ({marks})", chunk).fetchone()[0]
+                action(conn, "box_positions", chunk)
+                return count
+        return task
+
+    def _bulk_range_task(self, table: str, where: List[str], params: List, action: Callable) -> BulkTask:
+        state = {"last_id": 0}
+        cond = "".join(f" AND {w}" for w in where)
+
+        def task(conn: sqlite3.Connection) -> Optional[int]:
+            # 按 id 键集推进：每块只扫描上一块之后的记录，整个任务对每张表只扫一遍
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                ids = [r[0] for r in conn.execute(
+                    f"SELECT id FROM {table} WHERE id > ?{cond} ORDER BY id LIMIT ?",
+                    [state["last_id"]] + params + [self.bulk_chunk_size],
+                )]
+                count = action(conn, table, ids) if ids else 0
+                conn.execute("COMMIT")
+            except sqlite3.OperationalError as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                # 任务执行期间分区可能已被保留策略删除
+                if "no such table" in str(e):
+                    return None
+                raise
+            if not ids:
+                return None
+            state["last_id"] = ids[-1]
+            return count
+        return task
+
+    def _partition_drop_task(self) -> BulkTask:
+        assert self.partitions is not None
+        partitions = self.partitions
+
+        def task(conn: sqlite3.Connection) -> Optional[int]:
             cur = conn.cursor()
-            cur.execute("DELETE FROM drone_status")
+            cur.execute("BEGIN IMMEDIATE")
+            names = [n for n in partitions.names(cur) if n != PositionPartitions.DEFAULT]
+            if not names:
+                conn.rollback()
+                return None
+            cur.execute(f"SELECT COUNT(*) FROM {names[-1]}")
+            count = cur.fetchone()[0]
+            partitions.drop(cur, names[-1])
             conn.commit()
             cur.close()
+            return count
+        return task
+
+    def clear_drones(self) -> bool:
+        def _clear(conn: sqlite3.Connection) -> None:
+            conn.execute("DELETE FROM drone_status")
+            conn.execute("DELETE FROM drone_tracks")
+            conn.commit()
+
+        try:
+            # 先清空内存（会等待进行中的落盘结束），避免刷新线程把旧状态写回
+            self.drones.clear()
+            self.pool.write(_clear)
+            self.versions.bump("drones")
             logger.warning("已清空 drone_status 表")
             return True
         except sqlite3.Error as e:
@@ -415,6 +3942,10 @@ class DatabaseManager:
 
     def __del__(self) -> None:  # 防御性关闭
         try:
+            self.stop_ingest_writer()
+            self.stop_drone_registry()
+            self.stop_system_log_sink()
+            self.backfill.stop()
             self.disconnect()
         except Exception:
             pass
@@ -0,0 +1,426 @@
+"""
+内存热层模块 - 最近检测数据的 NumPy 列式缓存
+
+最近 window 秒的位置记录常驻内存，最近的分页、范围、导出与汇总查询直接在列数组上完成，
+不访问 SQLite；结果无法完全由热层给出时返回 None，由 database 模块回落到 SQLite 查询。
+需要 numpy，未安装时 database 模块不创建热层。
+"""
+from __future__ import annotations
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+
+from connections import ConnectionPool
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时不启用内存热层
+    np = None
+
+if TYPE_CHECKING:
+    from database import DataVersions
+
+logger = logging.getLogger(__name__)
+
+
+def hot_tier_available() -> bool:
+    return np is not None
+
+
+# 热层加载的列（顺序与 _HOT_LOAD_SQL 一致）
+HOT_LOAD_COLUMNS = (
+    "id", "ts_ms", "drone_id", "barcode_data", "barcode_type", "latitude", "longitude", "altitude",
+    "confidence", "bbox_x1", "bbox_y1", "bbox_x2", "bbox_y2", "timestamp", "created_at",
+)
+HOT_SUMMARY_GROUPS = {"drone": "drone_id", "barcode": "barcode_data"}
+
+
+def _hot_float(value) -> float:
+    try:
+        return float(value) if value is not None else math.nan
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _hot_value(value: float, integer: bool = False):
+    """NaN 还原为 None；INTEGER 列的整数值还原为 int，与 SQLite 的类型亲和一致"""
+    if math.isnan(value):
+        return None
+    if integer and value.is_integer():
+        return int(value)
+    return float(value)
+
+
+class _HotDictionary:
+    """字符串字典编码：只追加，已发出的编码始终有效"""
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, values) -> "np.ndarray":
+        out = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            if value is None:
+                out[i] = -1
+                continue
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.names)
+                self.names.append(value)
+            out[i] = code
+        return out
+
+    def decode(self, code: int) -> Optional[str]:
+        return self.names[code] if code >= 0 else None
+
+
+class HotTier:
+    """最近检测数据的内存列式热层，SQLite 为冷层
+
+    保存时间不早于 now - window 的全部记录（最多 max_rows 条），按 (ts_ms, id) 升序
+    存放在 NumPy 列数组中：id 与毫秒时间为 int64，无人机、条码、条码类型为字典编码的
+    int32，坐标、置信度与 bbox 为 float64（NULL 记为 NaN）。热层完整覆盖 ts_ms >= cutoff
+    的记录；查询只在结果能完全由这一区间给出时才走热层，否则返回 None，由调用方回落到 SQLite。
+
+    与数据库的同步在读取时按数据版本号进行：只有新增写入时按 id 增量追加；删除、更新等
+    修改后由后台线程整体重新加载，加载完成前查询直接回落到 SQLite（两次重新加载至少间隔
+    reload_interval 秒），请求线程不做全量加载。每次同步生成新的数组，查询持有的快照
+    不会被并发修改。毫秒时间列回填完成前不启用。
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        versions: DataVersions,
+        max_id: Callable[[sqlite3.Connection], int],
+        ready: Callable[[], bool],
+        window: float = 6 * 3600,
+        max_rows: int = 500000,
+        reload_interval: float = 1.0,
+    ) -> None:
+        self.pool = pool
+        self.versions = versions
+        self.max_id = max_id
+        self.ready = ready
+        self.window_ms = int(window * 1000)
+        self.max_rows = max(1, int(max_rows))
+        self.reload_interval = max(0.0, float(reload_interval))
+        self._lock = threading.Lock()
+        self._cols: Optional[Dict[str, "np.ndarray"]] = None
+        self._cutoff = 0
+        self._last_id = 0
+        self._version: Tuple[int, ...] = ()
+        self._last_reload = 0.0
+        self._reloading: Optional[threading.Thread] = None
+        self._dicts: Dict[str, _HotDictionary] = {}
+        self._stats = {"hits": 0, "misses": 0, "reloads": 0, "appended": 0, "evicted": 0}
+
+    # ----- 同步 -----
+    def snapshot(self) -> Optional[Tuple[Dict[str, "np.ndarray"], int, Dict[str, _HotDictionary]]]:
+        """与数据库同步后返回 (列数组, cutoff, 字典)；热层不可用时返回 None"""
+        if not self.ready():
+            return None
+        with self._lock:
+            version = self.versions.get("positions", "position_edits")
+            if self._cols is None or version[1] != self._version[1]:
+                self._start_reload()
+                return None
+            try:
+                if version != self._version:
+                    self.pool.read(self._append)
+            except sqlite3.Error as e:
+                logger.error(f"热层同步失败: {e}")
+                self._cols = None
+                return None
+            self._version = version
+            self._evict(int(time.time() * 1000) - self.window_ms)
+            return self._cols, self._cutoff, self._dicts
+
+    def _load_sql(self, where: str) -> str:
+        return f"SELECT {', '.join(HOT_LOAD_COLUMNS)} FROM box_positions WHERE {where}"
+
+    def _start_reload(self) -> None:
+        """（持有 _lock）启动后台重新加载；正在加载或距上次不足 reload_interval 秒时不启动"""
+        if self._reloading is not None and self._reloading.is_alive():
+            return
+        if time.monotonic() - self._last_reload < self.reload_interval:
+            return
+        self._last_reload = time.monotonic()
+        self._reloading = threading.Thread(target=self._reload, name="hot-tier-reload", daemon=True)
+        self._reloading.start()
+
+    def wait_reload(self, timeout: Optional[float] = None) -> None:
+        """等待进行中的后台重新加载结束"""
+        thread = self._reloading
+        if thread is not None:
+            thread.join(timeout)
+
+    def _reload(self) -> None:
+        # 先取版本号再读数据：版本号在写入提交后才递增，载入的数据不会比记下的版本旧
+        version = self.versions.get("positions", "position_edits")
+        try:
+            cols, cutoff, last_id, dicts = self.pool.read(self._load)
+        except sqlite3.Error as e:
+            logger.error(f"热层重新加载失败: {e}")
+            return
+        with self._lock:
+            self._cols, self._cutoff, self._last_id, self._dicts = cols, cutoff, last_id, dicts
+            self._version = version
+            self._stats["reloads"] += 1
+
+    def _load(self, conn: sqlite3.Connection) -> Tuple[Dict[str, "np.ndarray"], int, int, Dict[str, _HotDictionary]]:
+        last_id = self.max_id(conn)
+        cutoff = int(time.time() * 1000) - self.window_ms
+        rows = conn.execute(
+            self._load_sql("ts_ms >= ? AND id <= ?") + " ORDER BY ts_ms DESC, id DESC LIMIT ?",
+            (cutoff, last_id, self.max_rows),
+        ).fetchall()
+        rows.reverse()
+        dicts = {name: _HotDictionary() for name in ("drone_id", "barcode_data", "barcode_type")}
+        cols = self._columns(rows, dicts)
+        if len(rows) == self.max_rows:
+            # 达到上限时最早的时间点可能只载入了一部分，整体丢弃，保证 cutoff 之后完整
+            cutoff = int(cols["ts_ms"][0]) + 1
+            cols = self._slice(cols, int(np.searchsorted(cols["ts_ms"], cutoff, "left")))
+        return cols, cutoff, last_id, dicts
+
+    def _append(self, conn: sqlite3.Connection) -> None:
+        last_id = self.max_id(conn)
+        if last_id <= self._last_id:
+            return
+        rows = conn.execute(
+            self._load_sql("id > ? AND id <= ? AND ts_ms >= ?") + " ORDER BY ts_ms, id",
+            (self._last_id, last_id, self._cutoff),
+        ).fetchall()
+        self._last_id = last_id
+        if not rows:
+            return
+        cols, new = self._cols, self._columns(rows, self._dicts)
+        in_order = not len(cols["id"]) or (
+            (new["ts_ms"][0], new["id"][0]) > (cols["ts_ms"][-1], cols["id"][-1])
+        )
+        cols = {name: np.concatenate((cols[name], new[name])) for name in cols}
+        if not in_order:
+            order = np.lexsort((cols["id"], cols["ts_ms"]))
+            cols = {name: values[order] for name, values in cols.items()}
+        self._stats["appended"] += len(rows)
+        overflow = len(cols["id"]) - self.max_rows
+        if overflow > 0:
+            self._cutoff = int(cols["ts_ms"][overflow])
+            cols = self._slice(cols, int(np.searchsorted(cols["ts_ms"], self._cutoff, "left")))
+        self._cols = cols
+
+    def _evict(self, cutoff: int) -> None:
+        if self._cols is None or cutoff <= self._cutoff:
+            return
+        self._cutoff = cutoff
+        lo = int(np.searchsorted(self._cols["ts_ms"], cutoff, "left"))
+        if lo:
+            self._cols = self._slice(self._cols, lo)
+
+    def _slice(self, cols: Dict[str, "np.ndarray"], lo: int) -> Dict[str, "np.ndarray"]:
+        self._stats["evicted"] += lo
+        return {name: values[lo:].copy() for name, values in cols.items()}
+
+    def _columns(self, rows: List[tuple], dicts: Dict[str, _HotDictionary]) -> Dict[str, "np.ndarray"]:
+        data = list(zip(*rows)) if rows else [()] * len(HOT_LOAD_COLUMNS)
+        col = dict(zip(HOT_LOAD_COLUMNS, data))
+        cols = {
+            "id": np.array(col["id"], dtype=np.int64),
+            "ts_ms": np.array(col["ts_ms"], dtype=np.int64),
+            "timestamp": np.array(col["timestamp"], dtype=object),
+            "created_at": np.array(col["created_at"], dtype=object),
+            "bbox": np.array(
+                [[_hot_float(v) for v in box] for box in zip(*(col[f"bbox_{k}"] for k in ("x1", "y1", "x2", "y2")))],
+                dtype=np.float64,
+            ).reshape(len(rows), 4),
+        }
+        for name in ("drone_id", "barcode_data", "barcode_type"):
+            cols[name] = dicts[name].encode(col[name])
+        for name in ("latitude", "longitude", "altitude", "confidence"):
+            cols[name] = np.array([_hot_float(v) for v in col[name]], dtype=np.float64)
+        return cols
+
+    # ----- 查询 -----
+    @staticmethod
+    def _bound(cols: Dict[str, "np.ndarray"], ms: int, row_id: int, side: str) -> int:
+        """(ms, row_id) 在 (ts_ms, id) 有序数组中的插入位置"""
+        ts = cols["ts_ms"]
+        lo = int(np.searchsorted(ts, ms, "left"))
+        hi = int(np.searchsorted(ts, ms, "right"))
+        return lo + int(np.searchsorted(cols["id"][lo:hi], row_id, side))
+
+    @staticmethod
+    def _code(dicts: Dict[str, _HotDictionary], name: str, value: str) -> Optional[int]:
+        return dicts[name].codes.get(value)
+
+    def _matches(self, cols, dicts, lo: int, hi: int, **equals) -> "np.ndarray":
+        """[lo, hi) 内满足等值条件的下标（升序）"""
+        mask = np.ones(max(0, hi - lo), dtype=bool)
+        for name, value in equals.items():
+            if value:
+                code = self._code(dicts, name, value)
+                if code is None:
+                    return np.empty(0, dtype=np.int64)
+                mask &= cols[name][lo:hi] == code
+        return np.flatnonzero(mask) + lo
+
+    def _row(self, cols, dicts, i: int) -> Dict:
+        bbox = cols["bbox"][i]
+        return {
+            "id": int(cols["id"][i]),
+            "timestamp": cols["timestamp"][i],
+            "drone_id": dicts["drone_id"].decode(int(cols["drone_id"][i])),
+            "barcode_data": dicts["barcode_data"].decode(int(cols["barcode_data"][i])),
+            "barcode_type": dicts["barcode_type"].decode(int(cols["barcode_type"][i])),
+            "latitude": _hot_value(cols["latitude"][i]),
+            "longitude": _hot_value(cols["longitude"][i]),
+            "altitude": _hot_value(cols["altitude"][i]),
+            "confidence": _hot_value(cols["confidence"][i]),
+            "bbox_x1": _hot_value(bbox[0], integer=True),
+            "bbox_y1": _hot_value(bbox[1], integer=True),
+            "bbox_x2": _hot_value(bbox[2], integer=True),
+            "bbox_y2": _hot_value(bbox[3], integer=True),
+            "created_at": cols["created_at"][i],
+            "ts_ms": int(cols["ts_ms"][i]),
+        }
+
+    def _result(self, rows: Optional[List]) -> Optional[List]:
+        self._stats["hits" if rows is not None else "misses"] += 1
+        return rows
+
+    def page(
+        self,
+        limit: int,
+        drone_id: Optional[str] = None,
+        cursor: Optional[Tuple[str, int, int]] = None,
+    ) -> Optional[List[Dict]]:
+        """get_positions_page 的热层版本：返回最多 limit+1 条（向前翻页时升序，其余倒序）。
+
+        cursor 为 (比较符, 毫秒时间, id)。倒序时热层命中 limit+1 条即可确定结果；
+        向前翻页时游标不早于 cutoff 才能确定，否则返回 None。
+        """
+        snap = self.snapshot()
+        if snap is None:
+            return self._result(None)
+        cols, cutoff, dicts = snap
+        n = len(cols["id"])
+        if cursor is not None and cursor[0] == ">":
+            if cursor[1] < cutoff:
+                return self._result(None)
+            idx = self._matches(cols, dicts, self._bound(cols, cursor[1], cursor[2], "right"), n, drone_id=drone_id)
+            idx = idx[:limit + 1]
+        else:
+            hi = self._bound(cols, cursor[1], cursor[2], "left") if cursor is not None else n
+            idx = self._matches(cols, dicts, 0, hi, drone_id=drone_id)[::-1][:limit + 1]
+            if len(idx) <= limit:
+                return self._result(None)
+        return self._result([self._row(cols, dicts, int(i)) for i in idx])
+
+    def within(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        since_ms: Optional[int],
+        drone_id: Optional[str],
+        limit: int,
+    ) -> Optional[List[Dict]]:
+        """矩形范围内的最新 limit 条（倒序）；无法完全由热层确定时返回 None"""
+        snap = self.snapshot()
+        if snap is None:
+            return self._result(None)
+        cols, cutoff, dicts = snap
+        lo = int(np.searchsorted(cols["ts_ms"], since_ms, "left")) if since_ms is not None else 0
+        idx = self._matches(cols, dicts, lo, len(cols["id"]), drone_id=drone_id)
+        lat, lon = cols["latitude"][idx], cols["longitude"][idx]
+        idx = idx[(lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)][::-1][:limit]
+        if len(idx) < limit and (since_ms is None or since_ms < cutoff):
+            return self._result(None)
+        return self._result([self._row(cols, dicts, int(i)) for i in idx])
+
+    def scan(
+        self,
+        start_ms: int,
+        end_ms: Optional[int],
+        drone_id: Optional[str],
+        barcode: Optional[str],
+        chunk_size: int,
+        columns: Tuple[str, ...],
+    ) -> Optional[Iterator[List[tuple]]]:
+        """iter_positions 的热层版本（元组列顺序同 columns），起始时间早于 cutoff 时返回 None"""
+        snap = self.snapshot()
+        if snap is None or start_ms < snap[1]:
+            return self._result(None)
+        cols, _, dicts = snap
+        ts = cols["ts_ms"]
+        hi = int(np.searchsorted(ts, end_ms, "left")) if end_ms is not None else len(ts)
+        idx = self._matches(
+            cols, dicts, int(np.searchsorted(ts, start_ms, "left")), hi, drone_id=drone_id, barcode_data=barcode,
+        )
+        self._stats["hits"] += 1
+
+        def chunks() -> Iterator[List[tuple]]:
+            for pos in range(0, len(idx), chunk_size):
+                rows = (self._row(cols, dicts, int(i)) for i in idx[pos:pos + chunk_size])
+                yield [tuple(row[c] for c in columns) for row in rows]
+
+        return chunks()
+
+    def summary(self, start_ms: int, group_by: str) -> Optional[List[Dict]]:
+        """按无人机或条码汇总 start_ms 之后的检测：数量、平均置信度、首末时间、平均坐标"""
+        snap = self.snapshot()
+        if snap is None or start_ms < snap[1]:
+            return self._result(None)
+        cols, _, dicts = snap
+        name = HOT_SUMMARY_GROUPS[group_by]
+        lo = int(np.searchsorted(cols["ts_ms"], start_ms, "left"))
+        codes = cols[name][lo:]
+        ts = cols["ts_ms"][lo:]
+        size = len(dicts[name].names)
+        counts = np.bincount(codes, minlength=size)
+
+        def mean(values: "np.ndarray") -> "np.ndarray":
+            valid = ~np.isnan(values)
+            total = np.bincount(codes[valid], weights=values[valid], minlength=size)
+            n = np.bincount(codes[valid], minlength=size)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return total / n
+
+        confidence, lat, lon = (mean(cols[c][lo:]) for c in ("confidence", "latitude", "longitude"))
+        first_ms = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+        last_ms = np.full(size, -1, dtype=np.int64)
+        np.minimum.at(first_ms, codes, ts)
+        np.maximum.at(last_ms, codes, ts)
+        result = [
+            {
+                "key": dicts[name].names[code],
+                "detections": int(counts[code]),
+                "avg_confidence": _hot_value(confidence[code]),
+                "first_ms": int(first_ms[code]),
+                "last_ms": int(last_ms[code]),
+                "latitude": _hot_value(lat[code]),
+                "longitude": _hot_value(lon[code]),
+            }
+            for code in np.flatnonzero(counts)
+        ]
+        result.sort(key=lambda r: (-r["detections"], r["key"]))
+        return self._result(result)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            cols = self._cols
+            stats = dict(self._stats, cutoff_ms=self._cutoff if cols is not None else None)
+        stats.update(
+            enabled=self.ready(),
+            window_s=self.window_ms / 1000,
+            rows=len(cols["id"]) if cols is not None else 0,
+            bytes=sum(v.nbytes for v in cols.values()) if cols is not None else 0,
+        )
+        return stats
@@ -0,0 +1,389 @@
+"""
+批量导入模块 - 历史检测数据高速入库
+
+支持的输入（按扩展名识别，也可显式指定格式）：
+- CSV：表头为 box_positions 列名（/api/positions/export 导出格式）或测试台 test_results 列名；
+- JSON：NDJSON（每行一条）或 JSON 数组，元素为上传数据包格式（gps 嵌套、bbox 元组）或扁平记录；
+- SQLite：旧服务器实例的数据库（box_positions）或测试台数据库（test_results）。
+输入按批流式读取，每批先按列转换类型（有 numpy 时整列向量化转换与校验），
+再以 executemany 在一个大事务内写入。快速模式下导入期间去掉位置表的触发器与二级索引，
+结束后统一重建索引、统计、最新位置与时间序列汇总。
+"""
+from __future__ import annotations
+
+import csv
+import json
+import logging
+import math
+import os
+import sqlite3
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from database import DatabaseManager, to_epoch_ms
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时逐个值转换
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# 输入字段别名（测试台 / 上传数据包 / 旧版本导出）→ 位置表列
+FIELD_ALIASES = {
+    "timestamp": ("timestamp", "time", "detected_at"),
+    "drone_id": ("drone_id",),
+    "barcode_data": ("barcode_data", "barcode"),
+    "barcode_type": ("barcode_type", "type"),
+    "latitude": ("latitude", "lat", "gps_latitude"),
+    "longitude": ("longitude", "lon", "lng", "gps_longitude"),
+    "altitude": ("altitude", "alt", "gps_altitude"),
+    "confidence": ("confidence",),
+    "bbox_x1": ("bbox_x1",),
+    "bbox_y1": ("bbox_y1",),
+    "bbox_x2": ("bbox_x2",),
+    "bbox_y2": ("bbox_y2",),
+    "created_at": ("created_at",),
+}
+REQUIRED_FIELDS = ("timestamp", "drone_id", "barcode_data")
+FLOAT_FIELDS = ("latitude", "longitude", "altitude", "confidence")
+INT_FIELDS = ("bbox_x1", "bbox_y1", "bbox_x2", "bbox_y2")
+COORDINATE_BOUNDS = {"latitude": (-90.0, 90.0), "longitude": (-180.0, 180.0)}
+SQLITE_SOURCE_TABLES = ("box_positions", "test_results")
+FORMATS = ("csv", "json", "sqlite")
+
+
+def detect_format(path: str) -> str:
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".csv", ".tsv"):
+        return "csv"
+    if ext in (".json", ".ndjson", ".jsonl"):
+        return "json"
+    if ext in (".db", ".sqlite", ".sqlite3"):
+        return "sqlite"
+    raise ValueError(f"无法识别的文件类型: {path}（请用 --format 指定 csv / json / sqlite）")
+
+
+def _flatten(record: Dict) -> Dict:
+    """上传数据包格式（gps 嵌套、bbox 元组）展开为扁平字段"""
+    gps = record.get("gps")
+    bbox = record.get("bbox")
+    if not isinstance(gps, dict) and not isinstance(bbox, (list, tuple)):
+        return record
+    flat = dict(record)
+    if isinstance(gps, dict):
+        for key in ("latitude", "longitude", "altitude"):
+            flat.setdefault(key, gps.get(key))
+    if isinstance(bbox, (list, tuple)) and len(bbox) == 4:
+        for key, value in zip(INT_FIELDS, bbox):
+            flat.setdefault(key, value)
+    return flat
+
+
+def _iter_json_array(f, chunk_size: int = 1 << 20) -> Iterator[Dict]:
+    """流式解析顶层 JSON 数组，内存只与单个元素和读缓冲有关"""
+    decoder = json.JSONDecoder()
+    buf = f.read(chunk_size).lstrip()
+    pos = 1
+    while True:
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                break
+            buf, pos = f.read(chunk_size), 0
+            if not buf:
+                raise ValueError("JSON 数组不完整")
+        if buf[pos] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            more = f.read(chunk_size)
+            if not more:
+                raise
+            buf, pos = buf[pos:] + more, 0
+            continue
+        yield item
+        pos = end
+
+
+def iter_records(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[str, Dict]]:
+    """流式产出 (来源位置, 记录)；来源位置用于报告被拒绝的记录"""
+    fmt = fmt or detect_format(path)
+    name = os.path.basename(path)
+    if fmt == "csv":
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            dialect = "excel-tab" if path.lower().endswith(".tsv") else "excel"
+            # 第 1 行是表头，数据从第 2 行开始
+            for line, row in enumerate(csv.DictReader(f, dialect=dialect), start=2):
+                yield f"{name}:{line}", row
+    elif fmt == "json":
+        with open(path, encoding="utf-8-sig") as f:
+            head = f.read(1 << 16).lstrip()
+            f.seek(0)
+            if head.startswith("["):
+                for i, item in enumerate(_iter_json_array(f)):
+                    yield f"{name}[{i}]", item
+                return
+            for line, text in enumerate(f, start=1):
+                text = text.strip()
+                if not text:
+                    continue
+                try:
+                    item = json.loads(text)
+                except json.JSONDecodeError:
+                    if line > 1:
+                        raise ValueError(f"{name}:{line} 不是合法的 JSON")
+                    break
+                yield f"{name}:{line}", item
+            else:
+                return
+            # 不是 NDJSON：整体是一个 JSON 对象（如接口响应 {"data": [...]}）
+            f.seek(0)
+            body = json.load(f)
+            items = body.get("data") if isinstance(body, dict) and isinstance(body.get("data"), list) else [body]
+            for i, item in enumerate(items):
+                yield f"{name}[{i}]", item
+    elif fmt == "sqlite":
+        yield from _iter_sqlite(path, name)
+    else:
+        raise ValueError(f"不支持的格式: {fmt}")
+
+
+def _iter_sqlite(path: str, name: str, chunk_size: int = 10000) -> Iterator[Tuple[str, Dict]]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'view')")}
+        table = next((t for t in SQLITE_SOURCE_TABLES if t in tables), None)
+        if table is None:
+            raise ValueError(f"{name} 中没有 box_positions 或 test_results 表")
+        # 按 id 键集分块读取，不把整张表载入内存
+        last = 0
+        while True:
+            rows = conn.execute(f"SELECT * FROM {table} WHERE id > ? ORDER BY id LIMIT ?", (last, chunk_size)).fetchall()
+            for row in rows:
+                yield f"{name}#{table}:{row['id']}", dict(row)
+            if len(rows) < chunk_size:
+                return
+            last = rows[-1]["id"]
+    finally:
+        conn.close()
+
+
+def _pick(record: Dict, field: str):
+    for alias in FIELD_ALIASES[field]:
+        value = record.get(alias)
+        if value is not None:
+            return value
+    return None
+
+
+def _float_column(values: List) -> Tuple[List[Optional[float]], List[int]]:
+    """整列转换为浮点数，缺失值为 None；返回 (结果, 无法转换或非有限值（NaN / inf）的行号)"""
+    if np is not None:
+        try:
+            if all(isinstance(v, str) for v in values):
+                # CSV 的字符串列：由 numpy 在 C 层解析
+                arr = np.char.strip(np.asarray(values, dtype=np.str_))
+                missing = arr == ""
+                arr = np.where(missing, "nan", arr).astype(np.float64)
+            else:
+                missing = np.asarray([v is None for v in values], dtype=bool)
+                arr = np.asarray(values, dtype=np.float64)  # None → NaN
+        except (TypeError, ValueError, OverflowError):
+            arr = None
+        if arr is not None:
+            finite = np.isfinite(arr)
+            out = arr.astype(object)
+            out[~finite] = None
+            return out.tolist(), np.flatnonzero(~finite & ~missing).tolist()
+    # 没有 numpy 或列中有非法值：逐个转换并定位坏值
+    out: List[Optional[float]] = []
+    bad: List[int] = []
+    for i, value in enumerate(values):
+        if value is None or (isinstance(value, str) and not value.strip()):
+            out.append(None)
+            continue
+        try:
+            number = float(value)
+        except (TypeError, ValueError, OverflowError):
+            number = math.nan
+        if math.isfinite(number):
+            out.append(number)
+        else:
+            out.append(None)
+            bad.append(i)
+    return out, bad
+
+
+def _out_of_bounds(values: List[Optional[float]], low: float, high: float) -> List[int]:
+    if np is not None:
+        arr = np.asarray(values, dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            return np.flatnonzero((arr < low) | (arr > high)).tolist()
+    return [i for i, v in enumerate(values) if v is not None and not low <= v <= high]
+
+
+def convert_batch(records: List[Dict], now: Optional[str] = None) -> Tuple[List[tuple], List[int], List[str]]:
+    """把一批记录按列转换为写入元组（列顺序同 POSITION_INSERT_SQL）。
+
+    返回 (写入元组, 对应的记录下标, 每条记录的拒绝原因)；原因为空字符串表示记录有效。
+    """
+    now = now or datetime.now().isoformat()
+    records = [_flatten(r) if isinstance(r, dict) else {} for r in records]
+    n = len(records)
+    reasons = ["" for _ in range(n)]
+    columns = {field: [_pick(r, field) for r in records] for field in FIELD_ALIASES}
+
+    for field in REQUIRED_FIELDS:
+        values = columns[field]
+        for i in range(n):
+            value = values[i]
+            if value is None or (isinstance(value, str) and not value.strip()):
+                reasons[i] = reasons[i] or f"缺少必要字段: {field}"
+            elif not isinstance(value, str):
+                values[i] = str(value)
+
+    for field in FLOAT_FIELDS + INT_FIELDS:
+        converted, bad = _float_column(columns[field])
+        for i in bad:
+            reasons[i] = reasons[i] or f"{field} 不是数值"
+        if field in COORDINATE_BOUNDS:
+            for i in _out_of_bounds(converted, *COORDINATE_BOUNDS[field]):
+                reasons[i] = reasons[i] or f"{field} 超出范围"
+        if field in INT_FIELDS:
+            converted = [int(round(v)) if v is not None else None for v in converted]
+        columns[field] = converted
+
+    for i, value in enumerate(columns["barcode_type"]):
+        if value is not None and not isinstance(value, str):
+            columns["barcode_type"][i] = str(value)
+    created = [c if c else now for c in columns["created_at"]]
+    ts_ms = [to_epoch_ms(t) for t in columns["timestamp"]]
+
+    index = [i for i in range(n) if not reasons[i]]
+    rows = [
+        (
+            columns["timestamp"][i], columns["drone_id"][i], columns["barcode_data"][i], columns["barcode_type"][i],
+            columns["latitude"][i], columns["longitude"][i], columns["altitude"][i], columns["confidence"][i],
+            columns["bbox_x1"][i], columns["bbox_y1"][i], columns["bbox_x2"][i], columns["bbox_y2"][i],
+            created[i], ts_ms[i],
+        )
+        for i in index
+    ]
+    return rows, index, reasons
+
+
+class PositionImporter:
+    """把若干输入文件批量导入位置表
+
+    fast 为真（默认）时先调用 begin_bulk_load 去掉触发器与二级索引，全部文件导入后
+    finish_bulk_load 统一重建；导入期间位置查询会变慢，适合停服或低峰时执行。
+    fast 为假时保留触发器与索引逐批维护派生数据，可与服务同时运行。
+    导入期间写连接上的 PRAGMA 按 pragmas 调整，结束后恢复原值。
+    """
+
+    def __init__(
+        self,
+        db: DatabaseManager,
+        batch_size: int = 50000,
+        fast: bool = True,
+        pragmas: Optional[Dict[str, object]] = None,
+        max_rejections: int = 20,
+    ) -> None:
+        self.db = db
+        self.batch_size = max(1, int(batch_size))
+        self.fast = fast
+        self.pragmas = dict(pragmas or {})
+        self.max_rejections = max(0, int(max_rejections))
+        self.report: Dict = {}
+
+    def _set_pragmas(self, values: Dict[str, object]) -> Dict[str, object]:
+        """在各库（分片模式下含全部分片）的写连接上设置 PRAGMA，返回原值"""
+        def run(conn: sqlite3.Connection) -> Dict[str, object]:
+            previous = {}
+            for name, value in values.items():
+                row = conn.execute(f"PRAGMA {name}").fetchone()
+                previous[name] = row[0] if row else None
+                conn.execute(f"PRAGMA {name}={value}")
+            return previous
+
+        previous = [pool.write(run) for pool in self.db.position_pools()]
+        return previous[0]
+
+    def run(self, paths: List[str], fmt: Optional[str] = None) -> Dict:
+        """导入全部文件并返回报告（行数、被拒绝的记录样例、各阶段耗时与每秒行数）"""
+        for path in paths:
+            if not os.path.exists(path):
+                raise ValueError(f"文件不存在: {path}")
+            if os.path.abspath(path) == os.path.abspath(self.db.db_path):
+                raise ValueError("不能把数据库导入到自身")
+            if fmt is None:
+                detect_format(path)
+        report = self.report = {
+            "files": list(paths), "mode": "fast" if self.fast else "online",
+            "rows_read": 0, "rows_inserted": 0, "rows_rejected": 0, "batches": 0,
+            "rejections": [], "convert_s": 0.0, "insert_s": 0.0, "rebuild_s": 0.0,
+        }
+        started = time.monotonic()
+        previous = self._set_pragmas(self.pragmas) if self.pragmas else {}
+        if self.fast and not self.db.begin_bulk_load():
+            raise RuntimeError("准备批量导入失败")
+        try:
+            for path in paths:
+                batch: List[Tuple[str, Dict]] = []
+                for item in iter_records(path, fmt):
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        self._load(batch)
+                        batch = []
+                if batch:
+                    self._load(batch)
+                logger.info(f"导入完成 {path}：累计写入 {report['rows_inserted']} 条")
+        finally:
+            if previous:
+                self._set_pragmas(previous)
+            if self.fast:
+                rebuild_started = time.monotonic()
+                ok = self.db.finish_bulk_load()
+                report["rebuild_s"] = round(time.monotonic() - rebuild_started, 3)
+                if not ok:
+                    logger.error("批量导入收尾失败，下次启动时将自动重试")
+        elapsed = time.monotonic() - started
+        load_s = report["convert_s"] + report["insert_s"]
+        report.update(
+            elapsed_s=round(elapsed, 3),
+            convert_s=round(report["convert_s"], 3),
+            insert_s=round(report["insert_s"], 3),
+            load_rows_per_sec=round(report["rows_inserted"] / load_s, 1) if load_s else 0.0,
+            rows_per_sec=round(report["rows_inserted"] / elapsed, 1) if elapsed else 0.0,
+        )
+        return report
+
+    def _load(self, batch: List[Tuple[str, Dict]]) -> None:
+        report = self.report
+        t0 = time.monotonic()
+        rows, index, reasons = convert_batch([record for _, record in batch])
+        t1 = time.monotonic()
+        errors = self.db.insert_position_batch(rows, fast=self.fast) if rows else []
+        t2 = time.monotonic()
+        for i, error in zip(index, errors):
+            if error is not None:
+                reasons[i] = str(error)
+        rejected = [(batch[i][0], reason) for i, reason in enumerate(reasons) if reason]
+        room = self.max_rejections - len(report["rejections"])
+        if room > 0:
+            report["rejections"].extend({"source": s, "reason": r} for s, r in rejected[:room])
+        report["rows_read"] += len(batch)
+        report["rows_rejected"] += len(rejected)
+        report["rows_inserted"] += len(batch) - len(rejected)
+        report["batches"] += 1
+        report["convert_s"] += t1 - t0
+        report["insert_s"] += t2 - t1
+        logger.info(
+            f"导入批次 {report['batches']}：{len(batch) - len(rejected)}/{len(batch)} 条，"
+            f"{len(batch) / (t2 - t0) if t2 > t0 else 0.0:.0f} 行/秒"
+        )
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+服务器端管理命令
+
+用法（在 server_side 目录执行）:
+  python manage.py rebuild-stats    从 box_positions 全量重算统计表
+  python manage.py rebuild-latest   从 box_positions 全量重建条码最新位置表
+  python manage.py rebuild-rollups  从 box_positions 重算时间序列汇总表（保留更早的历史）
+  python manage.py migrate-epoch    回填毫秒时间列（可中断，重复执行从断点继续）
+  python manage.py maintenance      立即执行检查点、PRAGMA optimize 与增量回收
+  python manage.py vacuum           整库 VACUUM（已有库启用增量回收时执行一次，需停服）
+  python manage.py rebuild-analytics 从 box_positions 重新统计条码分析概要（删除大量数据后执行）
+  python manage.py snapshot         在线生成数据库快照（服务运行中也可执行）
+  python manage.py import FILE...   批量导入 CSV / JSON / SQLite 历史检测数据（默认快速模式，建议停服执行）
+"""
+import argparse
+import logging
+import sys
+
+import config
+from database import DatabaseManager
+from importer import FORMATS, PositionImporter
+
+
+def cmd_rebuild_stats(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    if not db.rebuild_statistics():
+        return False
+    print(db.get_statistics())
+    return True
+
+
+def cmd_rebuild_latest(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    return db.rebuild_box_latest()
+
+
+def cmd_rebuild_rollups(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    return db.rebuild_rollups()
+
+
+def cmd_migrate_epoch(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    if not db.run_epoch_backfill():
+        return False
+    print(db.get_epoch_migration_status())
+    return True
+
+
+def cmd_maintenance(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    metrics = db.run_maintenance()
+    if metrics is None:
+        return False
+    print(metrics)
+    return True
+
+
+def cmd_vacuum(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    if not db.vacuum():
+        return False
+    print(db.maintenance.metrics())
+    return True
+
+
+def cmd_rebuild_analytics(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    if not db.rebuild_analytics(wait=True):
+        return False
+    print(db.get_analytics_stats())
+    return True
+
+
+def cmd_snapshot(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    snapshot = db.create_snapshot()
+    print(snapshot)
+    return snapshot['state'] == 'done'
+
+
+def cmd_import(db: DatabaseManager, args: argparse.Namespace) -> bool:
+    _db_cfg = getattr(config, 'DB_CONFIG', {}) or {}
+    importer = PositionImporter(
+        db,
+        batch_size=args.batch_size or _db_cfg.get('import_batch_size', 50000),
+        fast=not args.online,
+        pragmas=_db_cfg.get('import_pragmas'),
+    )
+    # 条码分析概要从检查点恢复后随导入增量计入，结束时写检查点
+    db.start_analytics()
+    try:
+        report = importer.run(args.files, fmt=args.format)
+    except (ValueError, RuntimeError) as e:
+        print(f'导入失败: {e}', file=sys.stderr)
+        return False
+    finally:
+        db.stop_analytics()
+    if args.online:
+        print('服务运行期间导入的记录不会进入服务进程的条码分析概要，'
+              '导入后请执行 POST /api/admin/analytics/rebuild', file=sys.stderr)
+    else:
+        db.run_maintenance()
+    print(report)
+    return report['rows_inserted'] > 0 or report['rows_read'] == 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='无人机定位服务器管理命令')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('rebuild-stats', help='全量重算统计计数')
+    p.set_defaults(func=cmd_rebuild_stats)
+
+    p = sub.add_parser('rebuild-latest', help='全量重建条码最新位置表')
+    p.set_defaults(func=cmd_rebuild_latest)
+
+    p = sub.add_parser('rebuild-rollups', help='重算时间序列汇总表')
+    p.set_defaults(func=cmd_rebuild_rollups)
+
+    p = sub.add_parser('migrate-epoch', help='回填毫秒时间列并切换时间查询')
+    p.set_defaults(func=cmd_migrate_epoch)
+
+    p = sub.add_parser('maintenance', help='执行一轮数据库维护')
+    p.set_defaults(func=cmd_maintenance)
+
+    p = sub.add_parser('vacuum', help='整库 VACUUM 并启用增量回收')
+    p.set_defaults(func=cmd_vacuum)
+
+    p = sub.add_parser('rebuild-analytics', help='重新统计条码分析概要')
+    p.set_defaults(func=cmd_rebuild_analytics)
+
+    p = sub.add_parser('snapshot', help='在线生成数据库快照')
+    p.set_defaults(func=cmd_snapshot)
+
+    p = sub.add_parser('import', help='批量导入历史检测数据')
+    p.add_argument('files', nargs='+', help='CSV / JSON(NDJSON) / SQLite 文件')
+    p.add_argument('--format', choices=FORMATS, help='输入格式，默认按扩展名识别')
+    p.add_argument('--batch-size', type=int, help='每个事务写入的行数')
+    p.add_argument('--online', action='store_true', help='保留触发器与索引，可与服务同时运行（较慢）')
+    p.set_defaults(func=cmd_import)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args(argv)
+
+    db = DatabaseManager()
+    if not db.connect() or not db.create_tables():
+        print('数据库初始化失败', file=sys.stderr)
+        return 1
+    try:
+        return 0 if args.func(db, args) else 1
+    finally:
+        db.disconnect()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
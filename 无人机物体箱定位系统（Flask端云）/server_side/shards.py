@@ -0,0 +1,144 @@
+"""
+位置数据分片模块 - 按 drone_id 哈希分片存储
+
+每个分片是主库旁的独立数据库文件，有自己的写连接与组提交写入器；主库读连接附加全部分片，
+跨分片读取在各库的有序结果上归并。分片库的表结构由 database 模块建立。
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+from connections import ConnectionPool, GroupCommitWriter
+
+T = TypeVar("T")
+
+
+# 读连接要附加全部分片，SQLite 默认最多附加 10 个库
+SHARD_MAX = 8
+# 分片 i 的位置 id 从 (i + 1) << SHARD_ID_BITS 开始分配：id 全局唯一，高位即所在分片
+SHARD_ID_BITS = 40
+
+
+def shard_for(drone_id, count: int) -> int:
+    """drone_id 的稳定哈希路由（不受进程哈希随机化影响）"""
+    digest = hashlib.blake2b(str(drone_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % count
+
+
+def merge_box_latest(records: List[Dict]) -> Dict:
+    """合并同一条码在多个库中的最新位置：位置取最后出现的一条，最高置信度、首次出现与次数跨库汇总"""
+    latest = dict(max(records, key=lambda r: (r["last_seen"], r["position_id"])))
+    confidences = [r["best_confidence"] for r in records if r["best_confidence"] is not None]
+    latest["best_confidence"] = max(confidences) if confidences else None
+    latest["first_seen"] = min(r["first_seen"] for r in records)
+    latest["sightings"] = sum(r["sightings"] for r in records)
+    return latest
+
+
+class ShardSet:
+    """按 drone_id 哈希分片的位置数据存储
+
+    每个分片是主库旁的独立数据库文件（<主库名>.shard{i}.db），有自己的写连接和组提交写入器，
+    写入不同分片的请求互不排队，写吞吐随分片数增长。分片内的统计、最新位置、搜索与汇总表
+    由本分片的触发器维护。主库的读连接以 shard{i} 附加全部分片，并用临时视图 box_positions
+    合并主库（启用分片前的数据）与各分片，原有的位置表查询无需改动；分页、统计等跨分片读取
+    在各库的有序结果上做 k 路归并。
+    """
+
+    def __init__(self, db_path: str, count: int, pool_options: Dict, columns: Tuple[str, ...]) -> None:
+        base, ext = os.path.splitext(db_path)
+        self.count = count
+        self.columns = columns
+        self.paths = [f"{base}.shard{i}{ext or '.db'}" for i in range(count)]
+        self.pools = [ConnectionPool(path, **pool_options) for path in self.paths]
+        self.writers: List[Optional[GroupCommitWriter]] = [None] * count
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def schema(index: int) -> str:
+        return f"shard{index}"
+
+    def route(self, drone_id) -> int:
+        return shard_for(drone_id, self.count)
+
+    def index_of_id(self, pid: int) -> Optional[int]:
+        """位置 id 所在的分片；启用分片前写入主库的记录返回 None"""
+        index = (int(pid) >> SHARD_ID_BITS) - 1
+        return index if 0 <= index < self.count else None
+
+    def schemas(self, drone_id: Optional[str] = None) -> List[str]:
+        """读连接上保存位置数据的库：主库与全部分片；指定 drone_id 时只有主库与它所在的分片"""
+        if drone_id:
+            return ["main", self.schema(self.route(drone_id))]
+        return ["main"] + [self.schema(i) for i in range(self.count)]
+
+    def setup(self, create_schema: Callable[[sqlite3.Cursor, int], bool]) -> bool:
+        """创建（或升级）各分片的表结构，返回空间索引是否在全部分片上可用。
+
+        create_schema(cur, 分片序号) 建立一个分片库的表结构并返回空间索引是否可用。
+        """
+        available = True
+        for i, pool in enumerate(self.pools):
+            def create(conn: sqlite3.Connection, index: int = i) -> bool:
+                cur = conn.cursor()
+                ok = create_schema(cur, index)
+                conn.commit()
+                cur.close()
+                return ok
+            available = pool.write(create) and available
+        return available
+
+    def attach(self, conn: sqlite3.Connection) -> None:
+        """读连接附加全部分片，临时视图 box_positions 覆盖主库的同名表"""
+        for i, path in enumerate(self.paths):
+            conn.execute("ATTACH DATABASE ? AS ?", (path, self.schema(i)))
+        columns = ", ".join(self.columns)
+        conn.execute(
+            "CREATE TEMP VIEW IF NOT EXISTS box_positions AS "
+            + " UNION ALL ".join(f"SELECT {columns} FROM {s}.box_positions" for s in self.schemas())
+        )
+
+    def run_each(self, groups: Dict[int, T], fn: Callable[[int, T], object]) -> Dict[int, object]:
+        """各分片的工作在各自的写连接上并行执行，返回 {分片: 结果}；只涉及一个分片时在当前线程执行"""
+        if len(groups) <= 1:
+            return {i: fn(i, group) for i, group in groups.items()}
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.count, thread_name_prefix="db-shard")
+        futures = {i: self._executor.submit(fn, i, group) for i, group in groups.items()}
+        return {i: fut.result() for i, fut in futures.items()}
+
+    def start_writers(self, create: Callable[[ConnectionPool], GroupCommitWriter]) -> bool:
+        for i, pool in enumerate(self.pools):
+            writer = self.writers[i]
+            if writer is None or not writer.is_running():
+                self.writers[i] = writer = create(pool)
+                writer.start()
+        return True
+
+    def stop_writers(self) -> None:
+        for i, writer in enumerate(self.writers):
+            if writer is not None:
+                writer.stop()
+                self.writers[i] = None
+
+    def stats(self) -> Dict:
+        shards = []
+        for i, (path, pool, writer) in enumerate(zip(self.paths, self.pools, self.writers)):
+            shards.append({
+                "index": i,
+                "path": path,
+                "writer": dict(writer.stats(), enabled=writer.is_running()) if writer else {"enabled": False},
+                "pool": pool.stats(),
+            })
+        return {"enabled": True, "count": self.count, "shards": shards}
+
+    def close(self) -> None:
+        for pool in self.pools:
+            pool.close()
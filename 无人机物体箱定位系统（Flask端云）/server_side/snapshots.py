@@ -0,0 +1,237 @@
+"""
+数据库快照模块 - 基于 SQLite 在线备份 API 的分步快照
+
+快照在独立的读连接上分步复制，不阻塞写入；最新一份快照可作为报表查询的只读副本。
+"""
+from __future__ import annotations
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from connections import ConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotCancelled(Exception):
+    """在备份进度回调中抛出以中止 sqlite3 备份"""
+
+
+class Snapshot:
+    """一次在线快照及其进度"""
+
+    def __init__(self, snapshot_id: str, path: str) -> None:
+        self.id = snapshot_id
+        self.path = path
+        self.state = "queued"
+        self.page_size = 0
+        self.pages_total = 0
+        self.pages_done = 0
+        self.steps = 0
+        self.error: Optional[str] = None
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[str] = None
+        self.finished_at: Optional[str] = None
+        self.elapsed_s = 0.0
+        self.cancelled = threading.Event()
+        self._started = 0.0
+
+    def to_dict(self) -> Dict:
+        elapsed = time.monotonic() - self._started if self.state == "running" else self.elapsed_s
+        copied = self.pages_done * self.page_size
+        return {
+            "id": self.id,
+            "path": self.path,
+            "state": self.state,
+            "pages_total": self.pages_total,
+            "pages_done": self.pages_done,
+            "progress": round(self.pages_done / self.pages_total, 4) if self.pages_total else 0.0,
+            "bytes_copied": copied,
+            "steps": self.steps,
+            "elapsed_s": round(elapsed, 3),
+            "mb_per_sec": round(copied / 1048576 / elapsed, 3) if elapsed > 0 else 0.0,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class SnapshotManager:
+    """基于 SQLite 在线备份 API 的数据库快照
+
+    在独立的只读连接上先开启读事务，再用 Connection.backup 每步复制 step_pages 页，
+    步与步之间暂停 pause 秒。WAL 模式下读事务不阻塞写入，且快照固定在开始时刻的一致状态，
+    备份期间的写入不会让备份从头重来；代价是备份期间检查点无法回收 WAL。
+    备份先写入 .partial 临时文件，完成后切换为回滚日志模式并改名，目录中只保留最近 keep 个快照。
+    同一时间只运行一个快照；完成后调用 on_complete(path)。
+    """
+
+    PREFIX = "snapshot-"
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        directory: str,
+        step_pages: int = 256,
+        pause: float = 0.01,
+        keep: int = 3,
+        on_complete: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.pool = pool
+        self.directory = directory
+        self.step_pages = max(1, int(step_pages))
+        self.pause = max(0.0, float(pause))
+        self.keep = max(1, int(keep))
+        self.on_complete = on_complete
+        self._history: List[Snapshot] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> Optional[Snapshot]:
+        """在后台开始一次快照；已有快照在进行时返回 None"""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return None
+            snapshot = self._new()
+            self._thread = threading.Thread(target=self.run, args=(snapshot,), name="db-snapshot", daemon=True)
+            self._thread.start()
+        return snapshot
+
+    def create(self) -> Snapshot:
+        """在当前线程完成一次快照（管理命令使用）"""
+        with self._lock:
+            snapshot = self._new()
+        self.run(snapshot)
+        return snapshot
+
+    def _new(self) -> Snapshot:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        snapshot = Snapshot(stamp, os.path.join(self.directory, f"{self.PREFIX}{stamp}.db"))
+        self._history.append(snapshot)
+        del self._history[:-20]
+        return snapshot
+
+    def get(self, snapshot_id: str) -> Optional[Snapshot]:
+        with self._lock:
+            return next((s for s in self._history if s.id == snapshot_id), None)
+
+    def history(self) -> List[Snapshot]:
+        with self._lock:
+            return list(self._history)
+
+    def cancel(self, snapshot_id: str) -> bool:
+        snapshot = self.get(snapshot_id)
+        if snapshot is None or snapshot.state not in ("queued", "running"):
+            return False
+        snapshot.cancelled.set()
+        return True
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def run(self, snapshot: Snapshot) -> None:
+        snapshot.state = "running"
+        snapshot.started_at = datetime.now().isoformat()
+        snapshot._started = time.monotonic()
+        partial = snapshot.path + ".partial"
+
+        def progress(status: int, remaining: int, total: int) -> None:
+            snapshot.pages_total = total
+            snapshot.pages_done = total - remaining
+            snapshot.steps += 1
+            if snapshot.cancelled.is_set():
+                raise SnapshotCancelled()
+            # backup 只在 SQLITE_BUSY 时才 sleep，步间暂停放在回调里
+            if remaining:
+                time.sleep(self.pause)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            src = self.pool.open_dedicated()
+            try:
+                dst = sqlite3.connect(partial)
+                try:
+                    snapshot.page_size = src.execute("PRAGMA page_size").fetchone()[0]
+                    # 开启读事务：备份各步都读同一个 WAL 快照，不会因并发写入而重新开始
+                    src.execute("BEGIN")
+                    src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+                    src.backup(dst, pages=self.step_pages, progress=progress)
+                    src.rollback()
+                    # 快照单独使用，不依赖 -wal / -shm 文件
+                    dst.execute("PRAGMA journal_mode=DELETE")
+                finally:
+                    dst.close()
+            finally:
+                src.close()
+            os.replace(partial, snapshot.path)
+            snapshot.state = "done"
+        except SnapshotCancelled:
+            snapshot.state = "cancelled"
+        except (sqlite3.Error, OSError) as e:
+            snapshot.state = "failed"
+            snapshot.error = str(e)
+            logger.error(f"数据库快照 {snapshot.id} 失败: {e}")
+        snapshot.elapsed_s = time.monotonic() - snapshot._started
+        snapshot.finished_at = datetime.now().isoformat()
+        if snapshot.state != "done":
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            return
+        logger.info(
+            f"数据库快照完成: {snapshot.path}，{snapshot.pages_done * snapshot.page_size / 1048576:.1f}MB，"
+            f"用时 {snapshot.elapsed_s:.1f}s"
+        )
+        self._prune()
+        if self.on_complete is not None:
+            self.on_complete(snapshot.path)
+
+    def files(self) -> List[Dict]:
+        """目录中已完成的快照，按时间从新到旧"""
+        try:
+            names = sorted(
+                (n for n in os.listdir(self.directory) if n.startswith(self.PREFIX) and n.endswith(".db")),
+                reverse=True,
+            )
+        except OSError:
+            return []
+        out = []
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            out.append({
+                "path": path,
+                "size_bytes": st.st_size,
+                "created_at": datetime.fromtimestamp(st.st_mtime).isoformat(),
+            })
+        return out
+
+    def latest(self) -> Optional[str]:
+        files = self.files()
+        return files[0]["path"] if files else None
+
+    def _prune(self) -> None:
+        for item in self.files()[self.keep:]:
+            try:
+                os.remove(item["path"])
+            except OSError as e:
+                logger.warning(f"删除旧快照失败: {e}")
+
+    def stats(self) -> Dict:
+        history = self.history()
+        return {
+            "running": self.is_running(),
+            "directory": self.directory,
+            "last": history[-1].to_dict() if history else None,
+            "snapshots": len(self.files()),
+        }
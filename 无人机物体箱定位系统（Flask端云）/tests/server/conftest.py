@@ -0,0 +1,67 @@
+"""
+服务端数据层测试的公共夹具
+
+每个测试使用临时目录中的独立数据库；存储布局（单表 / 按天分区 / 分片）与可选功能通过
+config.DB_CONFIG 覆盖，测试结束后恢复。
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+SERVER_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "server_side"))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+import config  # noqa: E402
+from database import DatabaseManager  # noqa: E402
+
+LAYOUTS = {
+    "plain": {"partitioning": "none", "shards": 0},
+    "partitioned": {"partitioning": "day", "shards": 0},
+    # 分片模式不支持热层、条码分析与只读副本
+    "sharded": {"partitioning": "none", "shards": 3, "hot_tier": False, "analytics": False, "snapshot_replica": False},
+}
+
+
+def package(i, minutes_ago=0, drone=None, barcode=None, lat=30.0, lon=120.0):
+    """构造一个上传数据包"""
+    ts = datetime.now().replace(microsecond=0) - timedelta(minutes=minutes_ago)
+    return {
+        "timestamp": ts.isoformat(),
+        "drone_id": drone or f"d{i % 3}",
+        "barcode_data": barcode or f"BOX{i:05d}",
+        "confidence": 0.5,
+        "gps": {"latitude": lat, "longitude": lon, "altitude": 10},
+    }
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    """按布局创建数据库：make_db("plain" | "partitioned" | "sharded", backfill=True, **DB_CONFIG 覆盖项)"""
+    created = []
+
+    def make(layout="plain", backfill=True, **overrides):
+        options = {
+            "path": str(tmp_path / f"db{len(created)}.db"),
+            "group_commit": False,
+            "hot_tier": False,
+            "analytics": False,
+            "snapshot_replica": False,
+            "maintenance": False,
+        }
+        options.update(LAYOUTS[layout])
+        options.update(overrides)
+        for key, value in options.items():
+            monkeypatch.setitem(config.DB_CONFIG, key, value)
+        db = DatabaseManager()
+        assert db.connect() and db.create_tables()
+        if backfill:
+            db.run_epoch_backfill()
+        created.append(db)
+        return db
+
+    yield make
+    for db in created:
+        db.disconnect()
@@ -0,0 +1,79 @@
+"""条码分析概要：HyperLogLog 误差界与 Space-Saving 的计数保证"""
+import random
+from collections import Counter
+
+import pytest
+
+from analytics import HyperLogLog, SpaceSaving
+
+
+@pytest.mark.parametrize("n", [50, 1000, 20000, 200000])
+def test_hyperloglog_estimate_within_error_bound(n):
+    hll = HyperLogLog(12)
+    for i in range(n):
+        hll.add(f"BOX{i:07d}")
+    # 哈希固定，结果确定；按 4 倍标准误差取界
+    assert abs(hll.count() - n) <= max(2, 4 * hll.relative_error * n)
+
+
+def test_hyperloglog_ignores_duplicates_and_merges_as_union():
+    a, b = HyperLogLog(12), HyperLogLog(12)
+    for i in range(6000):
+        a.add(f"B{i}")
+        a.add(f"B{i}")
+    for i in range(3000, 9000):
+        b.add(f"B{i}")
+    single = a.count()
+    assert abs(single - 6000) <= 4 * a.relative_error * 6000
+
+    restored = HyperLogLog(12, a.to_bytes())
+    restored.merge(b)
+    assert abs(restored.count() - 9000) <= 4 * a.relative_error * 9000
+    assert a.count() == single
+
+
+def test_hyperloglog_rejects_mismatched_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(3)
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
+
+
+def _zipf_stream(n, distinct, seed=7):
+    rng = random.Random(seed)
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    return rng.choices([f"BOX{i:05d}" for i in range(distinct)], weights=weights, k=n)
+
+
+@pytest.mark.parametrize("capacity", [10, 50, 200])
+def test_space_saving_bounds_hold_for_every_tracked_item(capacity):
+    stream = _zipf_stream(50000, 2000)
+    truth = Counter(stream)
+    sketch = SpaceSaving(capacity)
+    for item in stream:
+        sketch.add(item)
+
+    assert sketch.total == len(stream)
+    assert len(sketch.counts) == capacity
+    for item, (count, error) in sketch.counts.items():
+        assert count - error <= truth[item] <= count
+        assert error <= sketch.max_error
+    # 真实次数超过 total / capacity 的条码一定被跟踪
+    for item, n in truth.items():
+        if n > sketch.total / capacity:
+            assert item in sketch.counts
+
+
+def test_space_saving_top_and_round_trip():
+    sketch = SpaceSaving(20)
+    for item in _zipf_stream(5000, 300):
+        sketch.add(item)
+    top = sketch.top(5)
+    assert [t["count"] for t in top] == sorted((t["count"] for t in top), reverse=True)
+    assert top[0]["barcode"] == "BOX00000"
+
+    restored = SpaceSaving.from_bytes(sketch.to_bytes(), 20)
+    assert restored.total == sketch.total and restored.counts == sketch.counts
+    # 恢复后继续计数仍满足上界
+    restored.add("BOX00000", 3)
+    assert restored.top(1)[0]["count"] == top[0]["count"] + 3
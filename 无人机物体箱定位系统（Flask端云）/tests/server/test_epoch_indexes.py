@@ -0,0 +1,64 @@
+"""毫秒时间列回填：完成前分页走文本时间索引，完成后删除文本时间索引"""
+import pytest
+
+import database
+from conftest import package
+
+
+def _index_names(db):
+    def read(conn):
+        names = set()
+        for schema in db._schemas():
+            names.update(r[0] for r in conn.execute(f"SELECT name FROM {schema}.sqlite_master WHERE type = 'index'"))
+        return names
+    return db.pool.read(read)
+
+
+def _page_plans(db):
+    """get_positions_page 在各库上执行的语句的查询计划"""
+    key = db._time_key()
+    plans = []
+
+    def read(conn):
+        for schema in db._schemas():
+            for where, params in (([f"{key} IS NOT NULL"], []), ([f"{key} IS NOT NULL", "drone_id = ?"], ["d1"])):
+                sql = (f"SELECT * FROM {schema}.box_positions WHERE " + " AND ".join(where)
+                       + f" ORDER BY {key} DESC, id DESC LIMIT ?")
+                rows = conn.execute("EXPLAIN QUERY PLAN " + sql, params + [51]).fetchall()
+                plans.append((sql, " | ".join(r[3] for r in rows)))
+    db.pool.read(read)
+    return plans
+
+
+def _reset_backfill(db):
+    """模拟升级前写入的数据：清空毫秒列与回填完成标记"""
+    def reset(conn):
+        with conn:
+            for table, _, dst in db.backfill.targets(conn):
+                conn.execute(f"UPDATE {table} SET {dst} = NULL")
+            conn.execute("DELETE FROM db_meta WHERE key = ?", (database.EPOCH_READY_KEY,))
+    db.pool.write(reset)
+
+
+@pytest.mark.parametrize("layout", ["plain", "partitioned", "sharded"])
+def test_text_time_indexes_serve_pages_until_backfill_finishes(make_db, layout):
+    db = make_db(layout)
+    assert not any(db.insert_box_positions([package(i, minutes_ago=i) for i in range(60)]))
+    path = db.db_path
+    _reset_backfill(db)
+    db.disconnect()
+
+    db = make_db(layout, backfill=False, path=path)
+    assert not db.epoch_ready and db._time_key() == "timestamp"
+    assert {"idx_box_drone_ts", "idx_box_ts_id"} <= _index_names(db)
+    for sql, plan in _page_plans(db):
+        assert "TEMP B-TREE" not in plan and "USING INDEX idx_" in plan, (sql, plan)
+    newest = db.get_positions_page(limit=10)["data"]
+    assert [r["barcode_data"] for r in newest] == [f"BOX{i:05d}" for i in range(10)]
+
+    assert db.run_epoch_backfill()
+    assert db.epoch_ready and db._time_key() == "ts_ms"
+    names = _index_names(db)
+    assert not {n for n in names if n.endswith(("_drone_ts", "_ts_id"))}, names
+    for sql, plan in _page_plans(db):
+        assert "TEMP B-TREE" not in plan, (sql, plan)
@@ -0,0 +1,130 @@
+"""内存热层：与 SQLite 结果一致，删除 / 更新后在后台重新加载，请求线程不阻塞"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import package
+
+pytest.importorskip("numpy")
+
+
+def _sql_page(db, **kwargs):
+    hot, db.hot = db.hot, None
+    try:
+        return db.get_positions_page(**kwargs)
+    finally:
+        db.hot = hot
+
+
+def _warm(db):
+    """触发并等待重新加载，返回热层快照"""
+    for _ in range(100):
+        snap = db.hot.snapshot()
+        if snap is not None:
+            return snap
+        db.hot.wait_reload(5)
+        time.sleep(db.hot.reload_interval / 10)
+    raise AssertionError("热层未完成加载")
+
+
+@pytest.fixture
+def hot_db(make_db):
+    db = make_db("plain", hot_tier=True, hot_tier_reload_interval=0.01)
+    assert not any(db.insert_box_positions([package(i, minutes_ago=i) for i in range(80)]))
+    _warm(db)
+    return db
+
+
+def test_pages_match_sql_including_appends(hot_db):
+    db = hot_db
+    assert not any(db.insert_box_positions([package(100 + i, minutes_ago=0) for i in range(5)]))
+    hits = db.hot.stats()["hits"]
+    for drone_id in (None, "d1"):
+        page = db.get_positions_page(limit=20, drone_id=drone_id)
+        assert page == _sql_page(db, limit=20, drone_id=drone_id)
+        older = db.get_positions_page(limit=20, drone_id=drone_id, before=page["next_cursor"])
+        assert older == _sql_page(db, limit=20, drone_id=drone_id, before=page["next_cursor"])
+        newer = db.get_positions_page(limit=20, drone_id=drone_id, after=older["prev_cursor"])
+        assert newer == _sql_page(db, limit=20, drone_id=drone_id, after=older["prev_cursor"])
+    assert db.hot.stats()["hits"] > hits
+    assert db.hot.stats()["appended"] == 5
+
+
+def test_edit_reloads_in_background_without_blocking_reads(hot_db):
+    db = hot_db
+    release = threading.Event()
+    load = db.hot._load
+
+    def slow_load(conn):
+        release.wait(10)
+        return load(conn)
+
+    db.hot._load = slow_load
+    newest = db.get_positions_page(limit=5)["data"][0]
+    assert db.delete_positions([newest["id"]])
+
+    started = time.monotonic()
+    page = db.get_positions_page(limit=5)
+    assert time.monotonic() - started < 1.0
+    # 重新加载完成前回落到 SQLite，已删除的记录不会出现
+    assert newest["id"] not in [r["id"] for r in page["data"]]
+    assert db.hot.snapshot() is None
+
+    release.set()
+    db.hot.wait_reload(10)
+    cols, _, _ = _warm(db)
+    assert newest["id"] not in set(cols["id"].tolist())
+    assert db.get_positions_page(limit=5) == _sql_page(db, limit=5)
+
+
+def test_update_is_visible_after_reload(hot_db):
+    db = hot_db
+    target = db.get_positions_page(limit=1)["data"][0]
+    assert db.update_position(target["id"], {"barcode_data": "EDITED"})
+    _warm(db)
+    assert db.get_positions_page(limit=1)["data"][0]["barcode_data"] == "EDITED"
+
+
+def _without_hot(db, fn, *args, **kwargs):
+    hot, db.hot = db.hot, None
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        db.hot = hot
+
+
+def test_within_summary_and_export_match_sql(hot_db):
+    db = hot_db
+    assert not any(db.insert_box_positions([
+        package(200 + i, minutes_ago=i, lat=30.0 + i * 0.001, lon=120.0 + i * 0.001) for i in range(40)
+    ]))
+    since = (datetime.now() - timedelta(hours=1)).replace(microsecond=0).isoformat()
+    hits = db.hot.stats()["hits"]
+
+    within = db.get_positions_within(30.005, 120.005, 30.03, 120.03, since=since, limit=15)
+    assert within == _without_hot(db, db.get_positions_within, 30.005, 120.005, 30.03, 120.03, since=since, limit=15)
+    assert within
+
+    for group_by in ("drone", "barcode"):
+        hot_rows = db.get_positions_summary(since=since, group_by=group_by)
+        sql_rows = _without_hot(db, db.get_positions_summary, since=since, group_by=group_by)
+        assert [(r["key"], r["detections"]) for r in hot_rows] == [(r["key"], r["detections"]) for r in sql_rows]
+        for a, b in zip(hot_rows, sql_rows):
+            assert a["latitude"] == pytest.approx(b["latitude"]) and a["avg_confidence"] == pytest.approx(b["avg_confidence"])
+
+    exported = [row for chunk in db.iter_positions(start=since, chunk_size=7) for row in chunk]
+    assert exported == [row for chunk in _without_hot(db, db.iter_positions, start=since, chunk_size=7) for row in chunk]
+    assert db.hot.stats()["hits"] > hits
+
+
+def test_queries_older_than_the_window_fall_back_to_sql(make_db):
+    db = make_db("plain", hot_tier=True, hot_tier_window=3600, hot_tier_reload_interval=0.01)
+    assert not any(db.insert_box_positions([package(i, minutes_ago=i * 5) for i in range(40)]))
+    _warm(db)
+    misses = db.hot.stats()["misses"]
+    old = (datetime.now() - timedelta(hours=2, seconds=150)).isoformat()
+    rows = [row for chunk in db.iter_positions(start=old) for row in chunk]
+    assert len(rows) == 25
+    assert db.hot.stats()["misses"] == misses + 1
@@ -0,0 +1,119 @@
+"""时间序列汇总表：触发器维护的计数与原始数据 GROUP BY 一致，删除触发器只做主键查找"""
+import sqlite3
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from conftest import package
+
+
+def _wait_job(db, job):
+    deadline = time.monotonic() + 30
+    while db.get_bulk_job(job["id"])["state"] in ("queued", "running"):
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+    return db.get_bulk_job(job["id"])["state"]
+
+
+def _rollup_counts(db):
+    def read(conn):
+        counts = Counter()
+        for schema in db._schemas():
+            for level in database.ROLLUP_LEVELS:
+                for dim, key, bucket, n in conn.execute(
+                    f"SELECT dimension, key, bucket, detections FROM {schema}.rollup_{level}"
+                ):
+                    counts[(level, dim, key, bucket)] += n
+        return counts
+    return db.pool.read(read)
+
+
+def _raw_counts(db):
+    def read(conn):
+        counts = Counter()
+        for level in database.ROLLUP_LEVELS:
+            for dim, key in database._rollup_keys("p").items():
+                sql = (
+                    f"SELECT {key}, {database.rollup_bucket_sql('p.ts_ms', level)}, COUNT(*) "
+                    "FROM box_positions p WHERE p.ts_ms IS NOT NULL GROUP BY 1, 2"
+                )
+                for key_value, bucket, n in conn.execute(sql):
+                    counts[(level, dim, key_value, bucket)] += n
+        return counts
+    return db.pool.read(read)
+
+
+def test_rollup_remove_statements_probe_primary_key():
+    conn = sqlite3.connect(":memory:")
+    for level in database.ROLLUP_LEVELS:
+        conn.execute(database.ROLLUP_TABLE_SQL.format(level=level))
+    body = (
+        database._ROLLUP_REMOVE.replace("OLD.ts_ms", "?")
+        .replace("OLD.drone_id", "'d1'")
+        .replace("OLD.barcode_data", "'BOX1'")
+    )
+    statements = [s for s in body.split(";") if s.strip()]
+    assert statements
+    for sql in statements:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, [0] * sql.count("?")).fetchall()
+        details = " ".join(row[3] for row in plan)
+        assert "USING PRIMARY KEY" in details, (sql, details)
+        assert "SCAN" not in details, (sql, details)
+
+
+def test_delete_chunk_stays_fast_with_large_rollup_tables(make_db):
+    db = make_db("plain")
+    base = int(time.time() * 1000) - 60 * 86_400_000
+    # 约 20 万个与待删记录无关的分钟桶
+    filler = [("drone", f"other{i % 20}", base + (i // 20) * 60_000, 1) for i in range(200_000)]
+    db.pool.write(lambda conn: (conn.executemany(
+        "INSERT INTO rollup_1m (dimension, key, bucket, detections) VALUES (?, ?, ?, ?)", filler
+    ), conn.commit()))
+    assert not any(db.insert_box_positions([package(i, minutes_ago=i % 120) for i in range(500)]))
+    ids = db.pool.read(lambda conn: [r[0] for r in conn.execute("SELECT id FROM box_positions")])
+    assert len(ids) == 500
+
+    started = time.monotonic()
+    assert db.delete_positions(ids)
+    assert time.monotonic() - started < 2.0
+
+
+@pytest.mark.parametrize("layout", ["plain", "partitioned", "sharded"])
+def test_rollups_match_raw_group_by_after_inserts_deletes_and_updates(make_db, layout):
+    db = make_db(layout)
+    assert not any(db.insert_box_positions([package(i, minutes_ago=i * 7) for i in range(120)]))
+    assert _rollup_counts(db) == _raw_counts(db)
+
+    ids = db.pool.read(lambda conn: [r[0] for r in conn.execute("SELECT id FROM box_positions ORDER BY id")])
+    assert db.delete_positions(ids[:10])
+    assert db.update_position(ids[10], {"barcode_data": "RENAMED-1"})
+    later = (datetime.now() - timedelta(days=2)).replace(microsecond=0).isoformat()
+    assert db.update_position(ids[11], {"timestamp": later})
+    if layout != "sharded":
+        assert db.update_position(ids[12], {"drone_id": "moved"})
+    assert _rollup_counts(db) == _raw_counts(db)
+
+    assert _wait_job(db, db.submit_bulk_job("delete", filters={"drone_id": "d1"})) == "done"
+    assert _wait_job(db, db.submit_bulk_job("update", filters={"drone_id": "d2"}, fields={"barcode_data": "BULK"})) == "done"
+    assert _rollup_counts(db) == _raw_counts(db)
+
+    assert _wait_job(db, db.submit_bulk_job("clear")) == "done"
+    assert _raw_counts(db) == Counter()
+    assert _rollup_counts(db) == Counter()
+
+
+@pytest.mark.parametrize("layout", ["plain", "partitioned"])
+def test_retention_cleanup_keeps_rollup_history(make_db, layout):
+    db = make_db(layout)
+    db.insert_box_positions([package(i, minutes_ago=i) for i in range(5)])
+    db.insert_box_positions([package(i, minutes_ago=40 * 1440 + i) for i in range(5)])
+    before = _rollup_counts(db)
+    assert db.cleanup_old_data(30)
+    after = _rollup_counts(db)
+    assert db.pool.read(lambda conn: conn.execute("SELECT COUNT(*) FROM box_positions").fetchone()[0]) == 5
+    # 1h / 1d 粒度保留被清理数据的历史
+    for level in ("1h", "1d"):
+        assert {k: v for k, v in after.items() if k[0] == level} == {k: v for k, v in before.items() if k[0] == level}
@@ -0,0 +1,99 @@
+"""分片模式：按 drone_id 路由、跨分片有序归并，不兼容的功能在启动时被拒绝"""
+import pytest
+
+import config
+from conftest import package
+from database import DatabaseManager
+from shards import SHARD_ID_BITS, shard_for
+
+DRONES = [f"uav-{i}" for i in range(12)]
+
+
+@pytest.fixture
+def sharded(make_db):
+    db = make_db("sharded")
+    assert not any(db.insert_box_positions([
+        package(i, minutes_ago=i % 50, drone=DRONES[i % len(DRONES)]) for i in range(240)
+    ]))
+    return db
+
+
+def _shard_rows(db, index):
+    return db.shards.pools[index].read(
+        lambda conn: conn.execute("SELECT id, drone_id FROM box_positions").fetchall()
+    )
+
+
+def test_rows_are_stored_in_the_shard_of_their_drone(sharded):
+    db = sharded
+    counts = []
+    for i in range(db.shards.count):
+        rows = _shard_rows(db, i)
+        counts.append(len(rows))
+        for row_id, drone_id in rows:
+            assert shard_for(drone_id, db.shards.count) == i == db.shards.route(drone_id)
+            assert db.shards.index_of_id(row_id) == i
+            assert row_id >> SHARD_ID_BITS == i + 1
+    assert sum(counts) == 240
+    assert sum(1 for n in counts if n) >= 2
+    # 启用分片前写入主库的记录没有分片号
+    assert db.shards.index_of_id(5) is None
+    assert db.pool.read(lambda conn: conn.execute("SELECT COUNT(*) FROM main.box_positions").fetchone()[0]) == 0
+
+
+def test_routing_is_stable_and_limits_schemas_for_a_drone(sharded):
+    db = sharded
+    assert [shard_for(d, 3) for d in DRONES] == [shard_for(d, 3) for d in DRONES]
+    schemas = db._schemas("uav-1")
+    assert schemas == ["main", f"shard{db.shards.route('uav-1')}"]
+    assert len(db._schemas()) == 1 + db.shards.count
+
+
+@pytest.mark.parametrize("ascending", [False, True])
+@pytest.mark.parametrize("limit", [1, 17, 500])
+def test_merge_ordered_equals_global_sort(sharded, ascending, limit):
+    db = sharded
+    rows = [r for i in range(db.shards.count) for r in db.shards.pools[i].read(
+        lambda conn: conn.execute("SELECT id, ts_ms FROM box_positions").fetchall()
+    )]
+    expected = [r[0] for r in sorted(rows, key=lambda r: (r[1], r[0]), reverse=not ascending)][:limit]
+    with db.pool.reader() as conn:
+        merged = db._merge_ordered(conn, ["ts_ms IS NOT NULL"], [], "ts_ms", ascending, limit)
+    assert [r["id"] for r in merged] == expected
+
+
+def test_drone_filtered_reads_only_return_that_drone(sharded):
+    db = sharded
+    page = db.get_positions_page(limit=100, drone_id="uav-3")
+    assert len(page["data"]) == 20
+    assert {r["drone_id"] for r in page["data"]} == {"uav-3"}
+
+
+@pytest.mark.parametrize("feature", ["hot_tier", "analytics", "snapshot_replica"])
+def test_sharding_rejects_incompatible_features(tmp_path, monkeypatch, feature):
+    options = {"path": str(tmp_path / "db.db"), "shards": 2, "hot_tier": False, "analytics": False,
+               "snapshot_replica": False, "group_commit": False, "maintenance": False}
+    options[feature] = True
+    for key, value in options.items():
+        monkeypatch.setitem(config.DB_CONFIG, key, value)
+    db = DatabaseManager()
+    try:
+        assert db.connect()
+        assert not db.create_tables()
+    finally:
+        db.disconnect()
+
+
+def test_stored_shard_count_applies_the_same_check(make_db, monkeypatch):
+    db = make_db("sharded")
+    path = db.db_path
+    db.disconnect()
+    # 已分片的库即使配置改回 shards=0 也按分片运行，仍需关闭热层
+    monkeypatch.setitem(config.DB_CONFIG, "shards", 0)
+    monkeypatch.setitem(config.DB_CONFIG, "hot_tier", True)
+    monkeypatch.setitem(config.DB_CONFIG, "path", path)
+    db = DatabaseManager()
+    try:
+        assert db.connect() and not db.create_tables()
+    finally:
+        db.disconnect()
@@ -0,0 +1,18 @@
+"""system_logs：logging 记录经批量写入器落库，访问日志等排除的 logger 不写库"""
+import logging
+
+import config
+
+
+def _sources(db):
+    return db.pool.read(lambda conn: [r[0] for r in conn.execute("SELECT source FROM system_logs ORDER BY id")])
+
+
+def test_handler_skips_excluded_loggers(make_db):
+    db = make_db("plain")
+    db.start_system_log_sink()
+    handler = db.system_log_handler(logging.INFO, config.LOG_CONFIG["db_exclude"])
+    for name in ("eventlet", "eventlet.wsgi", "werkzeug", "eventlets", "app", "database"):
+        handler.handle(logging.LogRecord(name, logging.INFO, __file__, 1, "msg", None, None))
+    db.stop_system_log_sink()
+    assert _sources(db) == ["eventlets", "app", "database"]
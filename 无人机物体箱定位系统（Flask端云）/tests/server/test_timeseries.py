@@ -0,0 +1,80 @@
+"""时间序列：按步长与起止对齐选择汇总粒度，结果与原始数据分桶计数一致"""
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+import database
+from conftest import package
+
+MINUTE, HOUR, DAY = 60_000, 3_600_000, 86_400_000
+
+
+def _local_midnight(days_ago=0):
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days_ago)
+
+
+def _raw_series(db, start_ms, end_ms, step_ms):
+    rows = db.pool.read(lambda conn: conn.execute(
+        "SELECT drone_id, ts_ms FROM box_positions WHERE ts_ms >= ? AND ts_ms < ?", (start_ms, end_ms)
+    ).fetchall())
+    counts = Counter((drone, start_ms + (ts - start_ms) // step_ms * step_ms) for drone, ts in rows)
+    series = {}
+    for (drone, t), n in sorted(counts.items()):
+        series.setdefault(drone, []).append([t, n])
+    return [{"key": k, "points": points} for k, points in series.items()]
+
+
+@pytest.fixture
+def db(make_db):
+    db = make_db("plain")
+    # 3 天内每 17 分钟一条
+    assert not any(db.insert_box_positions([package(i, minutes_ago=i * 17) for i in range(260)]))
+    return db
+
+
+def test_default_range_picks_finest_step_within_max_points(db):
+    result = db.get_timeseries()
+    assert result["to"] - result["from"] in (DAY, DAY + MINUTE)
+    # 24 小时 / 1 分钟超过 1000 点，取下一档 5 分钟，只能由分钟汇总给出
+    assert (result["step"], result["rollup"]) == (300_000, "1m")
+    assert result["series"] == _raw_series(db, result["from"], result["to"], result["step"])
+
+
+@pytest.mark.parametrize("start, end, step, level", [
+    # 整点对齐、步长为整小时：小时汇总
+    (lambda: _local_midnight(2) + timedelta(hours=5), lambda: _local_midnight(0) + timedelta(hours=3), HOUR, "1h"),
+    # 本地零点对齐、步长为整天：天汇总
+    (lambda: _local_midnight(3), lambda: _local_midnight(-1), DAY, "1d"),
+    # 步长为整天但起点不在零点：退到小时汇总
+    (lambda: _local_midnight(3) + timedelta(hours=1), lambda: _local_midnight(-1) + timedelta(hours=1), DAY, "1h"),
+    # 起点不在整点：只能用分钟汇总
+    (lambda: _local_midnight(1) + timedelta(minutes=7), lambda: _local_midnight(0) + timedelta(hours=2), HOUR, "1m"),
+])
+def test_bucket_selection_matches_raw_counts(db, start, end, step, level):
+    start, end = start(), end()
+    result = db.get_timeseries(start=start.isoformat(), end=end.isoformat(), step_ms=step)
+    assert result["rollup"] == level
+    assert result["from"] == database.to_epoch_ms(start.isoformat())
+    assert result["series"] == _raw_series(db, result["from"], result["to"], step)
+    assert sum(n for s in result["series"] for _, n in s["points"]) > 0
+
+
+def test_endpoints_are_aligned_to_minutes(db):
+    end = _local_midnight(0) + timedelta(hours=1, seconds=30)
+    start = end - timedelta(hours=2, seconds=10)
+    result = db.get_timeseries(start=start.isoformat(), end=end.isoformat(), step_ms=MINUTE)
+    assert result["from"] % MINUTE == 0 and result["to"] % MINUTE == 0
+    assert result["from"] <= database.to_epoch_ms(start.isoformat()) and result["to"] >= database.to_epoch_ms(end.isoformat())
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"step_ms": 90_000},
+    {"step_ms": MINUTE, "start": (datetime.now() - timedelta(days=2)).isoformat()},
+    {"group_by": "barcode"},
+    {"start": datetime.now().isoformat(), "end": (datetime.now() - timedelta(hours=1)).isoformat()},
+])
+def test_invalid_parameters_raise(db, kwargs):
+    with pytest.raises(ValueError):
+        db.get_timeseries(**kwargs)
@@ -0,0 +1,87 @@
+"""轨迹简化：Douglas-Peucker 与在线 TrackSimplifier 的误差保证"""
+import math
+import random
+
+import pytest
+
+from database import METERS_PER_DEG_LAT, TrackSimplifier, douglas_peucker, segment_distance_m
+
+DEG_PER_M = 1 / METERS_PER_DEG_LAT
+
+
+def _walk(n, seed=3, step_m=8.0):
+    """随机转向的飞行轨迹：(ts_ms, lat, lon, alt)，每秒一个点"""
+    rng = random.Random(seed)
+    lat, lon, heading = 30.0, 120.0, 0.0
+    points = []
+    for i in range(n):
+        heading += rng.gauss(0, 0.3)
+        lat += math.cos(heading) * step_m * DEG_PER_M
+        lon += math.sin(heading) * step_m * DEG_PER_M / math.cos(math.radians(lat))
+        points.append((i * 1000, lat, lon, 50.0))
+    return points
+
+
+def _max_deviation(points, kept):
+    """每个原始点到覆盖它的简化线段的最大距离"""
+    index = {p[0]: i for i, p in enumerate(points)}
+    worst = 0.0
+    for a, b in zip(kept, kept[1:]):
+        for p in points[index[a[0]] + 1:index[b[0]]]:
+            worst = max(worst, segment_distance_m(p, a, b))
+    return worst
+
+
+def test_segment_distance_is_metric_in_metres():
+    a, b = (0, 30.0, 120.0, None), (1, 30.0, 120.001, None)
+    above = (2, 30.0 + 10 * DEG_PER_M, 120.0005, None)
+    assert segment_distance_m(above, a, b) == pytest.approx(10.0, rel=1e-6)
+    # 投影落在线段外时取到端点的距离
+    beyond = (3, 30.0, 120.002, None)
+    assert segment_distance_m(beyond, a, b) == pytest.approx(segment_distance_m(beyond, b, b), rel=1e-9)
+
+
+@pytest.mark.parametrize("tolerance", [1.0, 5.0, 25.0])
+def test_douglas_peucker_keeps_endpoints_and_stays_within_tolerance(tolerance):
+    points = _walk(2000)
+    kept = douglas_peucker(points, tolerance)
+    assert kept[0] == points[0] and kept[-1] == points[-1]
+    assert len(kept) < len(points)
+    assert [p[0] for p in kept] == sorted(p[0] for p in kept)
+    assert _max_deviation(points, kept) <= tolerance
+
+
+def test_douglas_peucker_collapses_straight_line_and_handles_short_input():
+    line = [(i, 30.0 + i * 1e-5, 120.0, None) for i in range(100)]
+    assert douglas_peucker(line, 0.5) == [line[0], line[-1]]
+    assert douglas_peucker(line[:2], 5.0) == line[:2]
+    assert douglas_peucker(line, 0) == line
+
+
+@pytest.mark.parametrize("tolerance", [2.0, 10.0])
+def test_track_simplifier_stored_polyline_stays_within_tolerance(tolerance):
+    points = _walk(3000, seed=11)
+    simplifier = TrackSimplifier(tolerance_m=tolerance, max_interval=10_000, max_window=10_000)
+    stored = []
+    for p in points:
+        stored.extend(simplifier.add("d1", p))
+    assert simplifier.pending("d1") == points[-1]
+    stored.extend(p for _, p in simplifier.drain())
+
+    assert stored[0] == points[0] and stored[-1] == points[-1]
+    assert len(stored) < len(points) // 2
+    assert _max_deviation(points, stored) <= tolerance
+    assert simplifier.stats()["received"] == len(points)
+
+
+def test_track_simplifier_forces_points_on_long_gaps_and_full_windows():
+    simplifier = TrackSimplifier(tolerance_m=5.0, max_interval=60, max_window=10)
+    line = [(i * 1000, 30.0 + i * 1e-5, 120.0, None) for i in range(25)]
+    stored = [p for point in line for p in simplifier.add("d1", point)]
+    # 直线上只因窗口写满才存储
+    assert stored[0] == line[0] and 2 <= len(stored) <= 1 + 2 * (len(line) // 10)
+
+    simplifier.add("d2", (0, 30.0, 120.0, None))
+    simplifier.add("d2", (1000, 30.0001, 120.0, None))
+    late = (500_000, 30.0002, 120.0, None)
+    assert simplifier.add("d2", late) == [(1000, 30.0001, 120.0, None), late]